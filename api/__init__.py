@@ -11,19 +11,26 @@ Description:
 """
 
 import os
+import threading
+import time
 from logging.config import dictConfig
 
 # Set environment variable to disable tokenizers parallelism warning
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
 
+# Imported first so the startup clock includes every other import
+from api.models.startup_timer import startup_timer
 from api.controllers.chatbot_controller import ChatbotController
+from api.controllers.database_controller import DatabaseController
 from api.controllers.document_chunk_controller import DocumentChunkController
+from api.controllers.history_stats_controller import HistoryStatsController
 from api.controllers.user_controller import UserController
-from api.models.chatbot import Chatbot
-from api.settings import CHATBOT_API_DB_PATH, CHATBOT_GUIDELINES, LLM_TEMPERATURE, LLM_MAX_TOKENS
+from api.settings import CHATBOT_GUIDELINES, DOCUMENT_OFFLOAD, LLM_TEMPERATURE, LLM_MAX_TOKENS
 from flask import Flask
 from flask import current_app as app
 
+startup_timer.record("import api modules", time.perf_counter() - startup_timer.started_at)
+
 def initialise_app():
     dictConfig({
         'version': 1,
@@ -42,18 +49,22 @@ def initialise_app():
     })
 
     app = Flask(__name__)
+    # send_file only sets the X-Sendfile header and the web server sends the document
+    app.config["USE_X_SENDFILE"] = DOCUMENT_OFFLOAD == "x-sendfile"
     
     # Initialize database within application context
-    with app.app_context():
+    with app.app_context(), startup_timer.phase("initialise database"):
         initialise_sqlite_database()
     
     return app
 
 def initialise_sqlite_database():
     """Initialise the SQLite database and create necessary tables."""
+    DatabaseController.enable_write_ahead_logging()
     ChatbotController.create_chatbot_instances_table()
     UserController.create_users_table()
     UserController.create_user_history_table()
+    HistoryStatsController.create_history_stats_tables()
     DocumentChunkController.create_document_chunks_table()
 
     chatbot_instances = ChatbotController.get_all_chatbot_instances()
@@ -73,35 +84,67 @@ def initialise_sqlite_database():
     if len(users) == 0:
         UserController.create_user("guest_user", "guest_user@example.com")
 
-def load_chatbots():
-    """Load available chatbots from the database and start them"""
+def load_chatbots(available_chatbots=None):
+    """Load available chatbots from the database and start them, adding each one to available_chatbots as soon as it is ready"""
     chatbot_instances = ChatbotController.get_all_chatbot_instances()
 
-    available_chatbots = {}
+    if available_chatbots is None:
+        available_chatbots = {}
 
     for row in chatbot_instances:
         chatbot_id = f"{row["id"]}"
-        available_chatbots[chatbot_id] = ChatbotController.run_chatbot_instance(
-            id=chatbot_id,
-            name=row["name"],
-            area_expertise=row["area_expertise"],
-            module_name=row["module_name"],
-            system_guidelines=row["system_guidelines"],
-            llm_model=row["llm_model"],
-            temperature=row["temperature"],
-            max_tokens=row["max_tokens"],
-            documents_path=row["documents_path"],
-            vector_db_path=row["vector_db_path"],
-            use_ollama=row["use_ollama"]
-        )
+        try:
+            with startup_timer.phase(f"load chatbot {chatbot_id}"):
+                available_chatbots[chatbot_id] = ChatbotController.run_chatbot_instance(
+                    id=chatbot_id,
+                    name=row["name"],
+                    area_expertise=row["area_expertise"],
+                    module_name=row["module_name"],
+                    system_guidelines=row["system_guidelines"],
+                    llm_model=row["llm_model"],
+                    temperature=row["temperature"],
+                    max_tokens=row["max_tokens"],
+                    documents_path=row["documents_path"],
+                    vector_db_path=row["vector_db_path"],
+                    use_ollama=row["use_ollama"],
+                    use_reranker=row["use_reranker"],
+                    rerank_candidates=row["rerank_candidates"],
+                    embedding_backend=row["embedding_backend"],
+                    use_response_cache=row["use_response_cache"]
+                )
+        except Exception as e:
+            # A broken chatbot must not keep the others from loading, it is reported by /readyz
+            app.logger.exception(f"Failed to load chatbot {chatbot_id}: {e}")
+            startup_timer.record_error(f"Failed to load chatbot {chatbot_id}: {e}")
 
     return available_chatbots
 
-def get_available_chatbots():
+def get_available_chatbots(available_chatbots=None):
     """Get a list of available chatbots."""
-    available_chatbots = load_chatbots()
+    available_chatbots = load_chatbots(available_chatbots)
     if not available_chatbots:
         app.logger.warning("No chatbots available. Please check the database.")
     else:
         app.logger.info(f"Loaded {len(available_chatbots)} chatbots from the database.")
-    return available_chatbots
\ No newline at end of file
+    startup_timer.mark_ready()
+    return available_chatbots
+
+def load_chatbots_in_background(flask_app, available_chatbots):
+    """
+        Load the chatbots in a background thread so the server can accept connections straight away.
+        Chatbots are added to available_chatbots as they load and the API reports ready once all are loaded.
+        Chatbots that fail to load are skipped and reported by /readyz. If loading stops altogether (e.g. the
+        database cannot be read) the API is still marked ready, so the admin endpoints can be used to fix it.
+    """
+    def run():
+        with flask_app.app_context():
+            try:
+                get_available_chatbots(available_chatbots)
+            except Exception as e:
+                flask_app.logger.exception(f"Failed to load chatbots: {e}")
+                startup_timer.record_error(f"Failed to load chatbots: {e}")
+                startup_timer.mark_ready()
+
+    thread = threading.Thread(target=run, name="chatbot-loader", daemon=True)
+    thread.start()
+    return thread
\ No newline at end of file
@@ -2,11 +2,12 @@ from glob import glob
 from flask import app
 from api.controllers.database_controller import DatabaseController
 from api.controllers.document_chunk_controller import DocumentChunkController
+from api.controllers.history_stats_controller import HistoryStatsController
 import os
 
-from api.models.chatbot import Chatbot
-from api.settings import CHATBOT_API_DB_PATH
-from components.rag_retriever import RagRetriever
+from api.models.history_writer import history_writer
+from api.models.startup_timer import startup_timer
+from api.settings import CHATBOT_API_DB_PATH, EMBEDDING_BACKEND, RERANKER_CANDIDATES, VECTOR_DB_MULTI_TENANT, VECTOR_DB_SHARED_PATH
 
 class ChatbotController():
     def create_chatbot_instances_table():
@@ -23,11 +24,25 @@ class ChatbotController():
             documents_path TEXT NOT NULL,
             vector_db_path TEXT,
             use_ollama INTEGER NOT NULL DEFAULT 0,
+            use_reranker INTEGER NOT NULL DEFAULT 0,
+            rerank_candidates INTEGER NOT NULL DEFAULT 20,
+            embedding_backend TEXT NOT NULL DEFAULT 'torch',
+            use_response_cache INTEGER NOT NULL DEFAULT 0,
             timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
             )
         """, "chatbot_instances")
+        DatabaseController.add_column_if_missing("chatbot_instances", "use_reranker", "INTEGER NOT NULL DEFAULT 0")
+        DatabaseController.add_column_if_missing("chatbot_instances", "rerank_candidates", "INTEGER NOT NULL DEFAULT 20")
+        DatabaseController.add_column_if_missing("chatbot_instances", "embedding_backend", "TEXT NOT NULL DEFAULT 'torch'")
+        DatabaseController.add_column_if_missing("chatbot_instances", "use_response_cache", "INTEGER NOT NULL DEFAULT 0")
+
+    def run_chatbot_instance(id, name, area_expertise, module_name, system_guidelines, llm_model, max_tokens, documents_path, vector_db_path, temperature, use_ollama,
+                             use_reranker=0, rerank_candidates=RERANKER_CANDIDATES, embedding_backend=EMBEDDING_BACKEND,
+                             use_response_cache=0, chatbot_api_db_path=CHATBOT_API_DB_PATH):
+        # Imported on first use so the API starts without loading the RAG stack (torch, milvus, langchain...)
+        with startup_timer.phase("import chatbot modules", once=True):
+            from api.models.chatbot import Chatbot
 
-    def run_chatbot_instance(id, name, area_expertise, module_name, system_guidelines, llm_model, max_tokens, documents_path, vector_db_path, temperature, use_ollama, chatbot_api_db_path=CHATBOT_API_DB_PATH):
         chatbot_instance = Chatbot({
             "id": id,
             "name": name,
@@ -39,7 +54,11 @@ class ChatbotController():
             "max_tokens": max_tokens,
             "documents_path": documents_path,
             "vector_db_path": vector_db_path,
-            "use_ollama": use_ollama
+            "use_ollama": use_ollama,
+            "use_reranker": use_reranker,
+            "rerank_candidates": rerank_candidates,
+            "embedding_backend": embedding_backend,
+            "use_response_cache": use_response_cache
         }, chatbot_api_db_path=chatbot_api_db_path)
         return chatbot_instance
     
@@ -49,18 +68,22 @@ class ChatbotController():
     def get_chatbot_instance_by_id(id):
         return DatabaseController.execute_query("SELECT * FROM chatbot_instances WHERE id = ?", (id,))[0]
 
-    def create_chatbot_instance(name, area_expertise, module_name, llm_model, temperature, max_tokens, system_guidelines, documents_path, use_ollama=0, vector_db_path=None):
+    def create_chatbot_instance(name, area_expertise, module_name, llm_model, temperature, max_tokens, system_guidelines, documents_path, use_ollama=0, vector_db_path=None,
+                                use_reranker=0, rerank_candidates=RERANKER_CANDIDATES, embedding_backend=EMBEDDING_BACKEND, use_response_cache=0):
+        if vector_db_path is None and VECTOR_DB_MULTI_TENANT:
+            # Store the chunks in the shared collection, scoped by this chatbot's id
+            vector_db_path = VECTOR_DB_SHARED_PATH
+
         if vector_db_path is None:
             query = """
-                INSERT INTO chatbot_instances (name, area_expertise, module_name, llm_model, temperature, system_guidelines, max_tokens, documents_path, use_ollama)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                INSERT INTO chatbot_instances (name, area_expertise, module_name, llm_model, temperature, system_guidelines, max_tokens, documents_path, use_ollama, use_reranker, rerank_candidates, embedding_backend, use_response_cache)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             """
-            params = (name, area_expertise, module_name, llm_model, temperature, system_guidelines, max_tokens, documents_path, use_ollama)
+            params = (name, area_expertise, module_name, llm_model, temperature, system_guidelines, max_tokens, documents_path, use_ollama, use_reranker, rerank_candidates, embedding_backend, use_response_cache)
             id = DatabaseController.execute_query(query, params)
-            # Create vector database with proper .db extension
+            # Create vector database with proper .db extension.
+            # Documents are parsed and indexed by the chatbot's retriever when it starts below.
             vector_db_path = f"./databases/rag_milvus_{id}.db"
-            _retriever = RagRetriever(vector_db_path=vector_db_path, documents_path=documents_path)
-            _retriever.save_documents(documents_path)
             
             # Update the record with the vector_db_path
             update_query = "UPDATE chatbot_instances SET vector_db_path = ? WHERE id = ?"
@@ -68,10 +91,10 @@ class ChatbotController():
         
         else:
             query = """
-                INSERT INTO chatbot_instances (name, area_expertise, module_name, llm_model, temperature, system_guidelines, max_tokens, documents_path, vector_db_path, use_ollama)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                INSERT INTO chatbot_instances (name, area_expertise, module_name, llm_model, temperature, system_guidelines, max_tokens, documents_path, vector_db_path, use_ollama, use_reranker, rerank_candidates, embedding_backend, use_response_cache)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             """
-            params = (name, area_expertise, module_name, llm_model, temperature, system_guidelines, max_tokens, documents_path, vector_db_path, use_ollama)
+            params = (name, area_expertise, module_name, llm_model, temperature, system_guidelines, max_tokens, documents_path, vector_db_path, use_ollama, use_reranker, rerank_candidates, embedding_backend, use_response_cache)
             id = DatabaseController.execute_query(query, params)
 
         chatbot_instance = ChatbotController.run_chatbot_instance(
@@ -85,12 +108,16 @@ class ChatbotController():
             max_tokens = max_tokens, 
             documents_path = documents_path,
             vector_db_path=vector_db_path,
-            use_ollama=use_ollama
+            use_ollama=use_ollama,
+            use_reranker=use_reranker,
+            rerank_candidates=rerank_candidates,
+            embedding_backend=embedding_backend,
+            use_response_cache=use_response_cache
         )
          
         return id, chatbot_instance
 
-    def update_chatbot_instance_settings(id, name, area_expertise, module_name, llm_model, system_guidelines, max_tokens):
+    def update_chatbot_instance_settings(chatbot_instance, id, name, area_expertise, module_name, llm_model, system_guidelines, max_tokens):
         # Update chatbot instance settings in the database
         query = """
             UPDATE chatbot_instances SET
@@ -99,7 +126,7 @@ class ChatbotController():
             module_name = ?,
             llm_model = ?,
             system_guidelines = ?,
-            max_tokens = ?,
+            max_tokens = ?
             WHERE id = ?
         """
         params = (
@@ -113,61 +140,63 @@ class ChatbotController():
         )
         DatabaseController.execute_query(query, params)
 
-        instance = ChatbotController.get_chatbot_instance_by_id(id)
-
-        chatbot_instance = ChatbotController.run_chatbot_instance(
-            id=instance['id'],
-            name=instance['name'],
-            area_expertise=instance['instance'],
-            module_name=instance['module_name'],
-            system_guidelines=instance['system_guidelines'],
-            llm_model=instance['llm_model'],
-            max_tokens=instance['max_tokens'],
-            documents_path=instance['documents_path'],
-            vector_db_path=instance['vector_db_path'],
-            use_ollama=instance['use_ollama']
-        )
+        # Apply the new settings to the running instance instead of rebuilding it,
+        # so the embedding model, vector store and user conversations are kept
+        instance = dict(ChatbotController.get_chatbot_instance_by_id(id))
+        chatbot_instance.update_settings(instance)
         return chatbot_instance
     
     def update_chatbot_instance_memory(instance, deleted_documents, added_documents):
+        """Remove and index documents of a running chatbot, returns the documents that could not be updated"""
         documents_not_updated = []
-        for document in deleted_documents:
-            uuids = instance.retriever.delete_document(document)
-            if not uuids or uuids == []:
-                documents_not_updated.append(document)
+        try:
+            for document in deleted_documents:
+                # Chunks are recorded under the path the document was indexed from
+                uuids = instance.retriever.delete_document(document) or instance.retriever.delete_document(f"{instance.documents_path}/{document}")
+                if not uuids:
+                    documents_not_updated.append(document)
 
-        for document in added_documents:
-            docs = glob(f"{instance['documents_path']}/{document}")()
-            if not docs or docs == []:
-                documents_not_updated.append(document)
-            else:
-                instance.retriever.save_documents(docs)
+            for document in added_documents:
+                docs = glob(f"{instance.documents_path}/{document}")
+                if not docs:
+                    documents_not_updated.append(document)
+                else:
+                    instance.retriever.save_documents(docs)
+        finally:
+            # Cached answers and retrieval results were generated from the previous documents,
+            # also drop them when the update stopped halfway
+            instance.retrieval_cache.clear()
+            instance.clear_response_cache()
 
         return documents_not_updated
 
-    def delete_chatbot_instance(chatbot_id):
+    def delete_chatbot_instance(chatbot_id, chatbot_instance=None):
         # Delete vector_db_path
         # Fetch the vector_db_path for the chatbot instance
         result = ChatbotController.get_chatbot_instance_by_id(chatbot_id)
         if result:
             vector_db_path = result['vector_db_path']
-            if os.path.exists(vector_db_path) and vector_db_path != "rag_milvus.db":
+            if vector_db_path == VECTOR_DB_SHARED_PATH:
+                # The collection is shared with other chatbots, only remove this chatbot's chunks
+                if chatbot_instance is not None:
+                    chatbot_instance.retriever.delete_all_documents()
+            elif os.path.exists(vector_db_path) and vector_db_path != "rag_milvus.db":
                 try:
                     os.remove(vector_db_path)
                 except Exception as e:
                     app.logger.error(f"Error deleting vector_db_path file: {e}")
 
-        # First delete related user history
+        # First delete related user history, including entries still buffered
+        history_writer.flush()
         query1 = "DELETE FROM user_history WHERE chatbot_id = ?"
         params1 = (chatbot_id,)
         DatabaseController.execute_query(query1, params1)
+        HistoryStatsController.delete_stats_by_chatbot_id(chatbot_id)
         
         # Then delete the chatbot instance
         query2 = "DELETE FROM chatbot_instances WHERE id = ?"
         params2 = (chatbot_id,)
         DatabaseController.execute_query(query2, params2)
 
-        # Lastly, delete related documents
-        query3 = "DELETE FROM documents WHERE chatbot_id = ?"
-        params3 = (chatbot_id,)
-        DatabaseController.execute_query(query3, params3)
\ No newline at end of file
+        # Lastly, delete related document chunks
+        DocumentChunkController.delete_document_chunks_by_chatbot_id(chatbot_id)
\ No newline at end of file
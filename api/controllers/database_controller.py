@@ -21,6 +21,59 @@ class DatabaseController():
             con.close()
             return data
 
+    def execute_many(query, params_list):
+        """Execute the same query for every set of params in a single transaction."""
+        con = sqlite3.connect(CHATBOT_API_DB_PATH)
+        try:
+            cur = con.cursor()
+            cur.executemany(query, params_list)
+            con.commit()
+            return cur.rowcount
+        finally:
+            con.close()
+
+    def execute_transaction(statements):
+        """Execute several (query, params_list) statements in a single transaction, all or nothing."""
+        con = sqlite3.connect(CHATBOT_API_DB_PATH)
+        try:
+            with con:
+                for query, params_list in statements:
+                    con.executemany(query, params_list)
+        finally:
+            con.close()
+
+    def iterate_query(query, params=(), batch_size=1000):
+        """
+            Yield the rows of a SELECT query, fetching batch_size rows at a time.
+            Only one batch is held in memory, the connection is closed when the generator is exhausted or closed.
+        """
+        con = sqlite3.connect(CHATBOT_API_DB_PATH)
+        con.row_factory = sqlite3.Row
+        try:
+            cur = con.execute(query, params)
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    return
+                yield from rows
+        finally:
+            con.close()
+
+    def enable_write_ahead_logging():
+        """
+            Switch the database to WAL mode (persistent, stored in the file). Readers then work on a snapshot
+            and do not block writers, so a long export does not make history writes fail with "database is locked".
+        """
+        mode = DatabaseController.execute_query("PRAGMA journal_mode=WAL")[0][0]
+        app.logger.info(f"SQLite journal mode: {mode}")
+
+    def add_column_if_missing(table_name, column_name, column_definition):
+        """Add a column to an existing table, used to migrate databases created by older versions."""
+        columns = [row["name"] for row in DatabaseController.execute_query(f"PRAGMA table_info({table_name})")]
+        if column_name not in columns:
+            DatabaseController.execute_query(f"ALTER TABLE {table_name} ADD COLUMN {column_name} {column_definition}")
+            app.logger.info(f"Added column '{column_name}' to table '{table_name}'.")
+
     def create_table_query(query, table_name, params=()):
         if not table_name:
             raise ValueError("Table name must be provided")
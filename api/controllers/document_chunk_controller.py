@@ -8,10 +8,18 @@ class DocumentChunkController():
             chatbot_id INTEGER NOT NULL,
             document_name TEXT NOT NULL,
             uuid TEXT NOT NULL,
+            content_hash TEXT NULL,
+            page_number INTEGER NULL,
             timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
             FOREIGN KEY (chatbot_id) REFERENCES chatbot_instances (id)
             )
         """, "document_chunks")
+        DatabaseController.add_column_if_missing("document_chunks", "content_hash", "TEXT NULL")
+        # First page of each chunk, used to link citations to the page (NULL for chunks indexed before it was recorded)
+        DatabaseController.add_column_if_missing("document_chunks", "page_number", "INTEGER NULL")
+        # Chunks are looked up by content when deduplicating and by uuid when reference counting
+        DatabaseController.execute_query("CREATE INDEX IF NOT EXISTS document_chunks_content_hash ON document_chunks (content_hash)")
+        DatabaseController.execute_query("CREATE INDEX IF NOT EXISTS document_chunks_uuid ON document_chunks (uuid)")
 
     def get_all_document_chunks_from_chatbot(chatbot_id):
         query = "SELECT * FROM document_chunks WHERE chatbot_id = ?"
@@ -31,7 +39,57 @@ class DocumentChunkController():
         params = (chatbot_id, document_name, uuid)
         return DatabaseController.execute_query(query, params)
 
+    def get_document_chunks_uuids_by_content_hash(content_hash):
+        query = "SELECT DISTINCT uuid FROM document_chunks WHERE content_hash = ?"
+        params = (content_hash,)
+        return [row["uuid"] for row in DatabaseController.execute_query(query, params)]
+
+    def get_page_numbers_by_content_hash(content_hash):
+        """Return {uuid: page_number} for the chunks of a document content"""
+        query = "SELECT uuid, MAX(page_number) AS page_number FROM document_chunks WHERE content_hash = ? GROUP BY uuid"
+        params = (content_hash,)
+        return {row["uuid"]: row["page_number"] for row in DatabaseController.execute_query(query, params)}
+
+    def get_page_index(chatbot_id):
+        """Return {uuid: page_number} for every chunk of a chatbot with a known page"""
+        query = "SELECT DISTINCT uuid, page_number FROM document_chunks WHERE chatbot_id = ? AND page_number IS NOT NULL"
+        params = (chatbot_id,)
+        return {row["uuid"]: row["page_number"] for row in DatabaseController.execute_query(query, params)}
+
+    def get_content_hashes_from_chatbot(chatbot_id):
+        query = "SELECT DISTINCT content_hash FROM document_chunks WHERE chatbot_id = ? AND content_hash IS NOT NULL"
+        params = (chatbot_id,)
+        return [row["content_hash"] for row in DatabaseController.execute_query(query, params)]
+
+    def has_content_hash(chatbot_id, content_hash):
+        query = "SELECT 1 FROM document_chunks WHERE chatbot_id = ? AND content_hash = ? LIMIT 1"
+        params = (chatbot_id, content_hash)
+        return len(DatabaseController.execute_query(query, params)) > 0
+
+    def get_referenced_uuids(uuids, batch_size=500):
+        """Return the subset of uuids still referenced by at least one chatbot"""
+        referenced = set()
+        for start in range(0, len(uuids), batch_size):
+            batch = uuids[start:start + batch_size]
+            placeholders = ", ".join("?" for _ in batch)
+            query = f"SELECT DISTINCT uuid FROM document_chunks WHERE uuid IN ({placeholders})"
+            referenced.update(row["uuid"] for row in DatabaseController.execute_query(query, tuple(batch)))
+        return referenced
+
+    def create_document_chunks(chunks):
+        """Insert several (chatbot_id, document_name, uuid, content_hash, page_number) rows in one transaction"""
+        query = """
+            INSERT INTO document_chunks (chatbot_id, document_name, uuid, content_hash, page_number)
+            VALUES (?, ?, ?, ?, ?)
+        """
+        return DatabaseController.execute_many(query, chunks)
+
     def delete_document_chunks_by_document_name(document_name, chatbot_id):
         query = "DELETE FROM document_chunks WHERE document_name = ? and chatbot_id = ?"
         params = (document_name, chatbot_id)
+        return DatabaseController.execute_query(query, params)
+
+    def delete_document_chunks_by_chatbot_id(chatbot_id):
+        query = "DELETE FROM document_chunks WHERE chatbot_id = ?"
+        params = (chatbot_id,)
         return DatabaseController.execute_query(query, params)
\ No newline at end of file
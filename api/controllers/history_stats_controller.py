@@ -0,0 +1,87 @@
+from api.controllers.database_controller import DatabaseController
+
+class HistoryStatsController():
+    def create_history_stats_tables():
+        is_new = not DatabaseController.execute_query("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'history_daily_stats'")
+        DatabaseController.create_table_query("""
+            CREATE TABLE IF NOT EXISTS history_daily_stats (
+            chatbot_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            questions INTEGER NOT NULL DEFAULT 0,
+            answers INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (chatbot_id, day)
+            )
+        """, "history_daily_stats")
+        DatabaseController.create_table_query("""
+            CREATE TABLE IF NOT EXISTS retrieved_source_daily_stats (
+            chatbot_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            source TEXT NOT NULL,
+            retrievals INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (chatbot_id, day, source)
+            )
+        """, "retrieved_source_daily_stats")
+
+        # Databases created by older versions: build the daily counts from the existing history once.
+        # Answers only count replies to a question, greetings (written before the user's first question) are left out.
+        if is_new:
+            DatabaseController.execute_query("""
+                INSERT INTO history_daily_stats (chatbot_id, day, questions, answers)
+                SELECT h.chatbot_id, date(h.timestamp), SUM(h.role = 'user'), SUM(h.role = 'assistant' AND h.id > IFNULL(f.first_question, h.id))
+                FROM user_history h
+                LEFT JOIN (
+                    SELECT user_id, chatbot_id, MIN(id) AS first_question FROM user_history WHERE role = 'user' GROUP BY user_id, chatbot_id
+                ) f ON f.user_id = h.user_id AND f.chatbot_id = h.chatbot_id
+                GROUP BY h.chatbot_id, date(h.timestamp)
+            """)
+
+    ADD_DAILY_COUNTS_QUERY = """
+        INSERT INTO history_daily_stats (chatbot_id, day, questions, answers)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT (chatbot_id, day) DO UPDATE SET
+        questions = questions + excluded.questions,
+        answers = answers + excluded.answers
+    """
+
+    def add_daily_counts(counts):
+        """Add several (chatbot_id, day, questions, answers) counts in one transaction"""
+        return DatabaseController.execute_many(HistoryStatsController.ADD_DAILY_COUNTS_QUERY, counts)
+
+    def add_retrieved_source_counts(counts):
+        """Add several (chatbot_id, day, source, retrievals) counts in one transaction"""
+        query = """
+            INSERT INTO retrieved_source_daily_stats (chatbot_id, day, source, retrievals)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (chatbot_id, day, source) DO UPDATE SET
+            retrievals = retrievals + excluded.retrievals
+        """
+        return DatabaseController.execute_many(query, counts)
+
+    def get_daily_counts(chatbot_id, start=None, end=None):
+        query = "SELECT day, questions, answers FROM history_daily_stats WHERE chatbot_id = ?"
+        params = [chatbot_id]
+        if start is not None:
+            query += " AND day >= ?"
+            params.append(start)
+        if end is not None:
+            query += " AND day < ?"
+            params.append(end)
+        query += " ORDER BY day"
+        return [dict(row) for row in DatabaseController.execute_query(query, tuple(params))]
+
+    def get_top_retrieved_sources(chatbot_id, start=None, end=None, limit=10):
+        query = "SELECT source, SUM(retrievals) AS retrievals FROM retrieved_source_daily_stats WHERE chatbot_id = ?"
+        params = [chatbot_id]
+        if start is not None:
+            query += " AND day >= ?"
+            params.append(start)
+        if end is not None:
+            query += " AND day < ?"
+            params.append(end)
+        query += " GROUP BY source ORDER BY retrievals DESC, source LIMIT ?"
+        params.append(limit)
+        return [dict(row) for row in DatabaseController.execute_query(query, tuple(params))]
+
+    def delete_stats_by_chatbot_id(chatbot_id):
+        DatabaseController.execute_query("DELETE FROM history_daily_stats WHERE chatbot_id = ?", (chatbot_id,))
+        DatabaseController.execute_query("DELETE FROM retrieved_source_daily_stats WHERE chatbot_id = ?", (chatbot_id,))
@@ -1,5 +1,7 @@
 from api.settings import CHATBOT_DEFAULT_GREETING_MESSAGE
 from  api.controllers.database_controller import DatabaseController
+from api.controllers.history_stats_controller import HistoryStatsController
+from api.models.user_cache import user_cache
 
 class UserController():
     def create_users_table():
@@ -24,11 +26,15 @@ class UserController():
             FOREIGN KEY (chatbot_id) REFERENCES chatbot_instances(id)
         )
         """, "user_history")
+        # Exports and analytics read a chatbot's history over a time range
+        DatabaseController.execute_query("CREATE INDEX IF NOT EXISTS user_history_chatbot_timestamp ON user_history (chatbot_id, timestamp)")
 
     def create_user(username, user_email):
         DatabaseController.execute_query('''
         INSERT INTO users (username, email) VALUES (?, ?)
         ''', (username, user_email,))
+        # Drop any stale entry so the next lookup returns the new row
+        user_cache.invalidate(email=user_email)
 
     def add_user_history_entry(user_id, chatbot_id, content, role):
         DatabaseController.execute_query('''
@@ -36,12 +42,41 @@ class UserController():
             VALUES (?, ?, ?, ?)
         ''', (user_id, chatbot_id, content, role))
 
+    def add_user_history_entries(entries, daily_counts=()):
+        """
+            Insert several (user_id, chatbot_id, content, role) entries in one transaction,
+            together with the (chatbot_id, day, questions, answers) counts they add to the analytics.
+        """
+        statements = [('''
+            INSERT INTO user_history (user_id, chatbot_id, content, role)
+            VALUES (?, ?, ?, ?)
+        ''', entries)]
+        if daily_counts:
+            statements.append((HistoryStatsController.ADD_DAILY_COUNTS_QUERY, daily_counts))
+        DatabaseController.execute_transaction(statements)
+
     def get_user_history(user_id, chatbot_id):
         rows = DatabaseController.execute_query('''
             SELECT * FROM user_history WHERE user_id = ? AND chatbot_id = ?
         ''', (user_id, chatbot_id))
         return [dict(row) for row in rows]
 
+    def iterate_chatbot_history(chatbot_id, start=None, end=None, role=None, batch_size=1000):
+        """Yield the history entries of a chatbot in [start, end) in order, without loading them all in memory"""
+        query = "SELECT id, user_id, chatbot_id, role, content, timestamp FROM user_history WHERE chatbot_id = ?"
+        params = [chatbot_id]
+        if start is not None:
+            query += " AND timestamp >= ?"
+            params.append(start)
+        if end is not None:
+            query += " AND timestamp < ?"
+            params.append(end)
+        if role is not None:
+            query += " AND role = ?"
+            params.append(role)
+        query += " ORDER BY timestamp, id"
+        return DatabaseController.iterate_query(query, tuple(params), batch_size)
+
     def register_user_with_chatbot(user_id, chatbot_id, user_name):
         content = CHATBOT_DEFAULT_GREETING_MESSAGE
         content = content.format(user_name=user_name)
@@ -50,16 +85,30 @@ class UserController():
         UserController.add_user_history_entry(user_id, chatbot_id, content, role)
 
     def get_user_by_email(email):
+        user = user_cache.get_by_email(email)
+        if user is not None:
+            return user
+
         rows = DatabaseController.execute_query('''
             SELECT * FROM users WHERE email = ?
         ''', (email,))
-        return rows[0] if rows else None
+        user = rows[0] if rows else None
+        if user is not None:
+            user_cache.add(user)
+        return user
 
     def get_user_by_id(user_id):
+        user = user_cache.get_by_id(user_id)
+        if user is not None:
+            return user
+
         rows = DatabaseController.execute_query('''
             SELECT * FROM users WHERE id = ?
         ''', (user_id,))
-        return rows[0] if rows else None
+        user = rows[0] if rows else None
+        if user is not None:
+            user_cache.add(user)
+        return user
 
     def get_all_users():
         query = "SELECT * FROM users"
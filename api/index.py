@@ -12,26 +12,56 @@ Description:
 ================================================================================
 """
 
-import asyncio
-import sqlite3
-from flask import Response, send_from_directory, abort
-import json
-import os
+from datetime import datetime, timezone
+from flask import Response, abort
 
 from api.controllers.chatbot_controller import ChatbotController
+from api.controllers.history_stats_controller import HistoryStatsController
 from api.controllers.user_controller import UserController
 from flask import jsonify, request, render_template
 from flask import current_app as app
 
-from api import initialise_app, get_available_chatbots
-from api.models.chatbot import Chatbot
-from api.settings import LLM_TEMPERATURE
+from api import initialise_app, get_available_chatbots, load_chatbots_in_background
+from api.models.admission_control import AdmissionRejected, admission_controller
+from api.models.document_server import send_document
+from api.models.history_export import EXPORT_FORMATS, export_history, parquet_available
+from api.models.history_writer import history_writer
+from api.models.response_streams import response_streams
+from api.models.startup_timer import startup_timer
+from api.settings import CHATBOT_BACKGROUND_LOADING, EMBEDDING_BACKEND, LLM_TEMPERATURE, RERANKER_CANDIDATES, RETRIEVAL_PREFETCH_ENABLED, RETRIEVAL_SERVICE_ENABLED, HISTORY_EXPORT_BATCH_SIZE
+from components.embeddings import EMBEDDING_BACKENDS, get_embedding_stats
+from components.llm_router import provider_health
+from components.retrieval_service import get_service_embedding_stats
 
 # Initialize the app and load chatbots
 app = initialise_app()
 
-with app.app_context():
-    available_chatbots = get_available_chatbots()
+if CHATBOT_BACKGROUND_LOADING:
+    # Serve liveness/readiness straight away, chatbot routes answer 503 until every chatbot is loaded
+    available_chatbots = {}
+    load_chatbots_in_background(app, available_chatbots)
+else:
+    with app.app_context():
+        available_chatbots = get_available_chatbots()
+
+@app.before_request
+def reject_until_ready():
+    if not startup_timer.ready and request.endpoint not in ('healthz', 'readyz', 'static'):
+        response = jsonify({'error': 'The chatbots are still loading, please try again shortly.'})
+        response.headers['Retry-After'] = '5'
+        return response, 503
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    """Liveness: the process is up and serving requests"""
+    return jsonify({'status': 'ok'})
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    """Readiness: every chatbot is loaded (or loading failed, see errors). Includes the startup time breakdown"""
+    report = startup_timer.report()
+    report['chatbots_loaded'] = len(available_chatbots)
+    return jsonify(report), 200 if report['ready'] else 503
 
 @app.route('/chatbot/<chatbot_id>', methods=['GET'])
 def chat(chatbot_id):
@@ -45,7 +75,7 @@ def chat(chatbot_id):
         return jsonify({'error': 'Chatbot not found'}), 404
 
     user_email = request.args.get('user_email', None)  # Get user_email from query params
-    return render_template('my-form.html', chatbot_id=chatbot_id, user_email=user_email)
+    return render_template('my-form.html', chatbot_id=chatbot_id, user_email=user_email, prefetch_enabled=RETRIEVAL_PREFETCH_ENABLED)
 
 @app.route('/api/chatbot/list', methods=['GET'])
 def get_available_chatbots():
@@ -55,22 +85,44 @@ def get_available_chatbots():
     ]
     return jsonify({'available_chatbots': chatbot_instances})
 
+@app.route('/api/admission/stats', methods=['GET'])
+def get_admission_stats():
+    """Active and queued streams per chatbot and provider, and rejected prompts"""
+    return jsonify(admission_controller.snapshot())
+
+@app.route('/api/embeddings/stats', methods=['GET'])
+def get_embeddings_stats():
+    """Batch size distribution and queueing delay of the query embedding batchers"""
+    if RETRIEVAL_SERVICE_ENABLED:
+        # Queries are embedded by the retrieval service, not by this process
+        try:
+            return jsonify({'embeddings': get_service_embedding_stats()})
+        except Exception as e:
+            return jsonify({'error': "Something went wrong:" + str(e)}), 503
+    return jsonify({'embeddings': get_embedding_stats()})
+
+@app.route('/api/llm/stats', methods=['GET'])
+def get_llm_stats():
+    """Latency, failure rate and circuit state of each LLM provider used with fallback routing"""
+    return jsonify({'providers': provider_health.snapshot()})
+
+@app.route('/api/retrieval/stats', methods=['GET'])
+def get_retrieval_stats():
+    """Retrieval cache hits and prefetches of each chatbot"""
+    return jsonify({'chatbots': {chatbot_id: chatbot.retrieval_cache.stats() for chatbot_id, chatbot in available_chatbots.items()}})
+
+@app.route('/api/chatbot/<chatbot_id>/documents/<path:filename>')
+def serve_chatbot_document(chatbot_id, filename):
+    """Serve a document from the chatbot's documents folder, with range requests and caching headers"""
+    chatbot = available_chatbots.get(chatbot_id)
+    if chatbot is None:
+        abort(404)
+    return send_document(chatbot.documents_path, filename)
+
 @app.route('/documents/<filename>')
 def serve_document(filename):
-    """Serve PDF documents from the documents folder"""
-    try:
-        # Get the absolute path to the documents folder
-        project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        documents_path = os.path.join(project_root, 'documents')
-
-        # Check if the file exists in the documents folder
-        file_path = os.path.join(documents_path, filename)
-        if not os.path.exists(file_path):
-            abort(404)
-            
-        return send_from_directory(documents_path, filename, as_attachment=False)
-    except Exception as e:
-        abort(404)
+    """Serve PDF documents from the documents folder (citations in answers given before per-chatbot links)"""
+    return send_document("documents", filename)
 
 @app.route('/api/chatbot/create', methods=['POST'])
 def create_chatbot():
@@ -84,6 +136,10 @@ def create_chatbot():
         ('llm_model', isRequired),
         ('max_tokens', isRequired),
         ('documents_path', isRequired),
+        ('use_reranker', not isRequired),
+        ('rerank_candidates', not isRequired),
+        ('embedding_backend', not isRequired),
+        ('use_response_cache', not isRequired),
     ]
 
     data = get_data_from_request(request, fields)
@@ -93,6 +149,17 @@ def create_chatbot():
     except:
         return jsonify({'error': 'Max tokens needs to be a number.'}), 400
 
+    try:
+        use_reranker = int(data.get("use_reranker", 0))
+        rerank_candidates = int(data.get("rerank_candidates", RERANKER_CANDIDATES))
+        use_response_cache = int(data.get("use_response_cache", 0))
+    except:
+        return jsonify({'error': 'use_reranker, rerank_candidates and use_response_cache need to be numbers.'}), 400
+
+    embedding_backend = data.get("embedding_backend") or EMBEDDING_BACKEND
+    if embedding_backend not in EMBEDDING_BACKENDS:
+        return jsonify({'error': f"embedding_backend must be one of: {', '.join(EMBEDDING_BACKENDS)}."}), 400
+
     try: 
         id, chatbot_instance = ChatbotController.create_chatbot_instance(
             name = data.get("name"), 
@@ -101,7 +168,11 @@ def create_chatbot():
             llm_model = data.get("llm_model"), 
             temperature = LLM_TEMPERATURE, 
             max_tokens = max_tokens, 
-            documents_path = data.get("documents_path")
+            documents_path = data.get("documents_path"),
+            use_reranker = use_reranker,
+            rerank_candidates = rerank_candidates,
+            embedding_backend = embedding_backend,
+            use_response_cache = use_response_cache
         )
         available_chatbots[id] = chatbot_instance
 
@@ -124,7 +195,7 @@ def delete_chatbot():
         return jsonify({'error': 'Chatbot not found.'}), 404
 
     try: 
-        ChatbotController.delete_chatbot_instance(data.get('chatbot_id'))
+        ChatbotController.delete_chatbot_instance(data.get('chatbot_id'), available_chatbots[data.get('chatbot_id')])
         available_chatbots.pop(data.get('chatbot_id'), None)
 
     except Exception as e:
@@ -151,15 +222,21 @@ def update_chatbot_settings():
     if data.get('chatbot_id') not in available_chatbots.keys():
         return jsonify({'error': 'Chatbot not found.'}), 404
 
+    try:
+        max_tokens = int(data.get("max_tokens"))
+    except:
+        return jsonify({'error': 'Max tokens needs to be a number.'}), 400
+
     try:
         chatbot_instance = ChatbotController.update_chatbot_instance_settings(
+            chatbot_instance=available_chatbots[data.get('chatbot_id')],
             id=data.get('chatbot_id'),
             name=data.get('name'),
             area_expertise=data.get('area_expertise'),
             module_name=data.get('module_name'),
             llm_model=data.get('llm_model'),
             system_guidelines=data.get('system_guidelines'),
-            max_tokens=data.get('max_tokens')
+            max_tokens=max_tokens
         )
         available_chatbots[data.get('chatbot_id')] = chatbot_instance
 
@@ -186,8 +263,8 @@ def update_chatbot_memory():
     try:
         documents_not_updated = ChatbotController.update_chatbot_instance_memory(
             instance = available_chatbots[data.get("chatbot_id")],
-            deleted_files = data.get('deleted_documents', []),
-            added_files = data.get('added_documents', []),
+            deleted_documents = get_list_field(data, 'deleted_documents'),
+            added_documents = get_list_field(data, 'added_documents'),
         )
         
         if len(documents_not_updated) > 0:
@@ -197,10 +274,35 @@ def update_chatbot_memory():
     
     return jsonify({'is_updated': True}, 200)
 
+@app.route('/api/chatbot/<chatbot_id>/prefetch', methods=['POST'])
+def prefetch_chatbot_retrieval(chatbot_id):
+    """
+        Start retrieving documents for the partial prompt the student is typing, so the
+        retrieval of the submitted prompt is a cache hit. Returns straight away.
+    """
+    chatbot = available_chatbots.get(chatbot_id)
+    if chatbot is None:
+        return jsonify({'error': 'Chatbot not found'}), 404
+    if not RETRIEVAL_PREFETCH_ENABLED:
+        return jsonify({'scheduled': False}), 202
+
+    data = request.get_json(silent=True) or {}
+    partial_prompt = data.get('prompt', '')
+    user_email = data.get('user_email', None)
+
+    # Debounced per student, guests are told apart by address. No user lookup, this runs on every keystroke pause
+    session_key = user_email if user_email not in (None, "", "None") else f"guest:{request.remote_addr}"
+    if not partial_prompt:
+        chatbot.retrieval_cache.cancel(session_key)
+        return jsonify({'scheduled': False}), 202
+
+    return jsonify({'scheduled': chatbot.retrieval_cache.prefetch(session_key, partial_prompt)}), 202
+
 @app.route('/api/chatbot/<chatbot_id>/prompt', methods=['POST'])
 def stream_prompt_to_chatbot(chatbot_id):
     """
         Stream chatbot response as it's generated using Server-Sent Events.
+        Event ids are offsets into the answer, a dropped stream is resumed with /stream/<stream_id>.
     """
     chatbot = available_chatbots.get(chatbot_id)
     if not chatbot_id:
@@ -218,55 +320,65 @@ def stream_prompt_to_chatbot(chatbot_id):
         if not user_prompt:
             return jsonify({'error': 'No prompt provided'}), 400
 
-        def generate():
-            try:
-                # Create event loop for async operations
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-                
-                try:
-                    # Get the async generator from the chatbot
-                    async def run_streaming():
-                        stream_gen = await chatbot.stream(user_id, user_prompt)
-                        async for chunk in stream_gen:
-                            yield f"data: {json.dumps({'chunk': chunk})}\n\n"
-                        yield f"data: {json.dumps({'done': True})}\n\n"
-                    
-                    # Convert async generator to sync generator
-                    async_gen = run_streaming()
-                    
-                    # Iterate through the async generator synchronously:
-                    # - Gets the next chunk from the async generator
-                    # - Uses run_until_complete to wait for each chunk synchronously
-                    # - Yields each chunk to Flask's response stream
-                    # - Breaks when the async generator is exhausted
-
-                    while True:
-                        try:
-                            chunk = loop.run_until_complete(async_gen.__anext__())
-                            yield chunk
-                        except StopAsyncIteration:
-                            break
-                            
-                finally:
-                    loop.close()
-                    
-            except Exception as e:
-                yield f"data: {json.dumps({'error': str(e)})}\n\n"
-
-        return Response(
-            generate(),
-            mimetype='text/event-stream',
-            headers={
-                'Cache-Control': 'no-cache',
-                'Connection': 'keep-alive',
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Headers': 'Cache-Control'
-            }
-        )
+        # Guests share a single user, rate limit them by address instead
+        rate_limit_key = user_id if user['username'] != "guest_user" else f"guest:{request.remote_addr}"
+
+        # Wait for a free slot or reject the prompt straight away when saturated
+        try:
+            admission = admission_controller.admit(chatbot_id, chatbot.generator.provider_name, rate_limit_key)
+        except AdmissionRejected as e:
+            response = jsonify({'error': str(e), 'retry_after': e.retry_after})
+            response.headers['Retry-After'] = str(e.retry_after)
+            return response, 429
+
+        # The answer is generated in the background, so a dropped connection can resume it
+        # and the admission slot is held until the LLM call ends, not until the client leaves
+        try:
+            stream = response_streams.start(lambda: chatbot.stream(user_id, user_prompt), on_finish=admission.release, chatbot_id=chatbot_id)
+        except Exception:
+            admission.release()
+            raise
+
+        return event_stream_response(stream)
     except Exception as e:
         return jsonify({'error': "Something went wrong:" + str(e)}), 500
 
+@app.route('/api/chatbot/<chatbot_id>/stream/<stream_id>', methods=['GET'])
+def resume_chatbot_stream(chatbot_id, stream_id):
+    """
+        Resume an answer stream after a dropped connection. Events after the Last-Event-ID header
+        (or last_event_id query parameter) are replayed from the buffer, then the stream continues live.
+    """
+    stream = response_streams.get(stream_id)
+    if stream is None or stream.chatbot_id != chatbot_id:
+        return jsonify({'error': 'Stream not found or expired'}), 404
+
+    last_event_id = request.headers.get('Last-Event-ID', request.args.get('last_event_id', '0'))
+    try:
+        offset = int(last_event_id)
+    except ValueError:
+        return jsonify({'error': 'Invalid Last-Event-ID'}), 400
+    if offset < 0 or offset > len(stream.text):
+        return jsonify({'error': 'Invalid Last-Event-ID'}), 400
+
+    return event_stream_response(stream, offset)
+
+def event_stream_response(stream, offset=0):
+    return Response(
+        stream.events(offset),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'Connection': 'keep-alive',
+            # Frames are already coalesced, stop proxies from buffering them further
+            'X-Accel-Buffering': 'no',
+            'X-Stream-Id': stream.stream_id,
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Allow-Headers': 'Cache-Control, Last-Event-ID',
+            'Access-Control-Expose-Headers': 'X-Stream-Id'
+        }
+    )
+
 @app.route('/api/chatbot/<chatbot_id>/history', methods=['POST'])
 def get_chatbot_history(chatbot_id):
     """Retrieve chat history for a specific chatbot"""
@@ -278,6 +390,8 @@ def get_chatbot_history(chatbot_id):
 
     print(f"Retrieving history for user_email: {user['email']}, chatbot_id: {chatbot_id}")
     try:
+        # Make sure buffered messages are visible before reading the history
+        history_writer.flush()
         output = UserController.get_user_history(user['id'], chatbot_id)
 
         if len(output) == 0:
@@ -287,6 +401,72 @@ def get_chatbot_history(chatbot_id):
     except Exception as e:
         return jsonify({'error': "Something went wrong:" + str(e)}), 500
 
+@app.route('/api/chatbot/<chatbot_id>/history/export', methods=['GET'])
+def export_chatbot_history(chatbot_id):
+    """Stream the history of a chatbot as NDJSON, CSV or Parquet, optionally filtered by time range and role"""
+    if chatbot_id not in available_chatbots:
+        return jsonify({'error': 'Chatbot not found'}), 404
+
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'error': f"Unsupported format. Use one of: {', '.join(EXPORT_FORMATS)}"}), 400
+    if export_format == 'parquet' and not parquet_available():
+        return jsonify({'error': 'Parquet exports need pyarrow installed on the server'}), 501
+
+    try:
+        start = parse_timestamp(request.args.get('start'))
+        end = parse_timestamp(request.args.get('end'))
+    except ValueError as e:
+        return jsonify({'error': f"Invalid start or end, use ISO 8601 dates: {str(e)}"}), 400
+
+    # Make sure buffered messages are included in the export
+    history_writer.flush()
+    rows = UserController.iterate_chatbot_history(chatbot_id, start, end, request.args.get('role'), HISTORY_EXPORT_BATCH_SIZE)
+    mimetype, extension = EXPORT_FORMATS[export_format]
+    return Response(
+        export_history(rows, export_format),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename="chatbot-{chatbot_id}-history.{extension}"'}
+    )
+
+@app.route('/api/chatbot/<chatbot_id>/analytics', methods=['GET'])
+def get_chatbot_analytics(chatbot_id):
+    """Questions and answers per day and most retrieved documents, from the aggregates kept by the history writer"""
+    if chatbot_id not in available_chatbots:
+        return jsonify({'error': 'Chatbot not found'}), 404
+
+    try:
+        start = parse_day(request.args.get('start'))
+        end = parse_day(request.args.get('end'))
+        top = int(request.args.get('top', 10))
+    except ValueError as e:
+        return jsonify({'error': f"Invalid parameters: {str(e)}"}), 400
+
+    try:
+        history_writer.flush()
+        return jsonify({
+            'daily': HistoryStatsController.get_daily_counts(chatbot_id, start, end),
+            'top_sources': HistoryStatsController.get_top_retrieved_sources(chatbot_id, start, end, top)
+        })
+    except Exception as e:
+        return jsonify({'error': "Something went wrong:" + str(e)}), 500
+
+def parse_timestamp(value):
+    """ISO 8601 date or datetime as stored in user_history (UTC), None if not given"""
+    if not value:
+        return None
+    return to_utc(datetime.fromisoformat(value)).strftime("%Y-%m-%d %H:%M:%S")
+
+def parse_day(value):
+    if not value:
+        return None
+    return to_utc(datetime.fromisoformat(value)).strftime("%Y-%m-%d")
+
+def to_utc(value):
+    if value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
 def get_user_from_request(request, chatbot_id):
     try:
         data = request.get_json()
@@ -309,6 +489,11 @@ def get_user_from_request(request, chatbot_id):
         print(f"Error in get_user_from_request: {str(e)}")
         raise
 
+def get_list_field(data, field):
+    """A list parameter, also accepting a single value (form and query data)"""
+    value = data.get(field) or []
+    return [value] if isinstance(value, str) else list(value)
+
 def get_data_from_request(request, fields):
     # Handle both JSON and form data
     try:
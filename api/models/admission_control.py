@@ -0,0 +1,173 @@
+"""
+================================================================================
+RAG Chatbot API for Education - Thesis Project
+--------------------------------------------------------------------------------
+Author: Tomás Pinto
+Date: August 2025
+Description:
+    This file implements admission control for the streaming prompt endpoint.
+    Each user is rate limited with a token bucket, and the number of
+    concurrent streams is limited per chatbot and per LLM provider. Requests
+    over the limit wait in a bounded queue for a free slot; when the queue is
+    full, or no slot frees up within ADMISSION_QUEUE_TIMEOUT seconds, the
+    request is rejected straight away with a retry-after estimate so the
+    endpoint can answer 429 instead of piling up worker threads.
+================================================================================
+"""
+
+import math
+import threading
+import time
+
+from cachetools import TTLCache
+
+from api.settings import (ADMISSION_QUEUE_TIMEOUT, CHATBOT_MAX_CONCURRENT_STREAMS, CHATBOT_MAX_QUEUED_STREAMS,
+                          PROVIDER_MAX_CONCURRENT_STREAMS, PROVIDER_MAX_QUEUED_STREAMS, USER_CACHE_MAX_SIZE,
+                          USER_RATE_LIMIT_BURST, USER_RATE_LIMIT_PER_MINUTE)
+from components.rate_limiter import TokenBucket
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+
+class ConcurrencyLimiter:
+    """Allows max_concurrent holders at a time, with at most max_queued callers waiting for a slot."""
+    def __init__(self, name, max_concurrent, max_queued):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.max_waiting_seen = 0
+        # Moving average of how long a slot is held, used to estimate retry-after
+        self.average_hold = 5.0
+        self.condition = threading.Condition()
+
+    def estimate_wait(self):
+        return self.average_hold * (self.waiting + 1) / self.max_concurrent
+
+    def acquire(self, timeout):
+        with self.condition:
+            if self.active >= self.max_concurrent:
+                if self.waiting >= self.max_queued:
+                    self.rejected += 1
+                    raise AdmissionRejected(f"Too many requests waiting for {self.name}", self.estimate_wait())
+
+                self.waiting += 1
+                self.max_waiting_seen = max(self.max_waiting_seen, self.waiting)
+                try:
+                    if not self.condition.wait_for(lambda: self.active < self.max_concurrent, timeout=timeout):
+                        self.rejected += 1
+                        raise AdmissionRejected(f"{self.name} is busy", self.estimate_wait())
+                finally:
+                    self.waiting -= 1
+
+            self.active += 1
+            self.admitted += 1
+            return time.monotonic()
+
+    def release(self, acquired_at):
+        with self.condition:
+            self.active -= 1
+            self.average_hold = 0.9 * self.average_hold + 0.1 * (time.monotonic() - acquired_at)
+            self.condition.notify()
+
+    def snapshot(self):
+        with self.condition:
+            return {
+                "active": self.active,
+                "waiting": self.waiting,
+                "max_concurrent": self.max_concurrent,
+                "max_queued": self.max_queued,
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "max_waiting_seen": self.max_waiting_seen,
+                "average_hold_seconds": self.average_hold,
+            }
+
+class Admission:
+    """Slots held by an admitted request, released once its stream ends."""
+    def __init__(self):
+        self.slots = []
+        self.released = False
+
+    def release(self):
+        if self.released:
+            return
+        self.released = True
+        for limiter, acquired_at in reversed(self.slots):
+            limiter.release(acquired_at)
+
+class AdmissionController:
+    def __init__(self):
+        self.chatbot_limiters = {}
+        self.provider_limiters = {}
+        rate = USER_RATE_LIMIT_PER_MINUTE / 60
+        # Idle buckets are dropped once they would have refilled anyway
+        self.user_buckets = TTLCache(maxsize=USER_CACHE_MAX_SIZE, ttl=USER_RATE_LIMIT_BURST / rate)
+        self.rate_limited = 0
+        self.lock = threading.Lock()
+
+    def get_limiter(self, limiters, name, max_concurrent, max_queued):
+        with self.lock:
+            if name not in limiters:
+                limiters[name] = ConcurrencyLimiter(name, max_concurrent, max_queued)
+            return limiters[name]
+
+    def check_user_rate(self, user_key):
+        """Take a token from the user's bucket, returns the bucket so the token can be refunded"""
+        with self.lock:
+            bucket = self.user_buckets.get(user_key)
+            if bucket is None:
+                bucket = TokenBucket(USER_RATE_LIMIT_PER_MINUTE / 60, capacity=USER_RATE_LIMIT_BURST)
+            # Re-insert to refresh the expiry of active users
+            self.user_buckets[user_key] = bucket
+
+        wait = bucket.try_acquire()
+        if wait > 0:
+            with self.lock:
+                self.rate_limited += 1
+            raise AdmissionRejected("Too many prompts, please slow down", wait)
+        return bucket
+
+    def admit(self, chatbot_id, provider_name, user_key, timeout=ADMISSION_QUEUE_TIMEOUT):
+        """
+            Admit a prompt or raise AdmissionRejected. The returned Admission must be released
+            when the response is complete.
+        """
+        bucket = self.check_user_rate(user_key)
+
+        admission = Admission()
+        limiters = [
+            self.get_limiter(self.chatbot_limiters, f"chatbot {chatbot_id}", CHATBOT_MAX_CONCURRENT_STREAMS, CHATBOT_MAX_QUEUED_STREAMS),
+            self.get_limiter(self.provider_limiters, provider_name, PROVIDER_MAX_CONCURRENT_STREAMS, PROVIDER_MAX_QUEUED_STREAMS),
+        ]
+        deadline = time.monotonic() + timeout
+        try:
+            for limiter in limiters:
+                acquired_at = limiter.acquire(max(0.0, deadline - time.monotonic()))
+                admission.slots.append((limiter, acquired_at))
+        except AdmissionRejected:
+            admission.release()
+            # The prompt was not served, it does not count towards the user's rate limit
+            bucket.refund()
+            raise
+        return admission
+
+    def snapshot(self):
+        with self.lock:
+            chatbots = list(self.chatbot_limiters.values())
+            providers = list(self.provider_limiters.values())
+            rate_limited = self.rate_limited
+        return {
+            "chatbots": {limiter.name: limiter.snapshot() for limiter in chatbots},
+            "providers": {limiter.name: limiter.snapshot() for limiter in providers},
+            "rate_limited": rate_limited,
+            "queue_depth": sum(limiter.waiting for limiter in chatbots + providers),
+        }
+
+admission_controller = AdmissionController()
@@ -14,14 +14,19 @@ Description:
 """
 
 from api.controllers.user_controller import UserController
-from api.settings import CHATBOT_GUIDELINES, CHATBOT_SYSTEM_PROMPT, MAX_MESSAGES, CHATBOT_SUMMARY_SYSTEM_PROMPT
+from api.models.history_writer import history_writer
+from api.models.request_timeline import RequestTimeline
+from api.models.response_cache import ResponseCache
+from api.models.retrieval_prefetcher import RetrievalPrefetcher
+from api.settings import CHATBOT_GUIDELINES, CHATBOT_SYSTEM_PROMPT, MAX_MESSAGES, CHATBOT_SUMMARY_SYSTEM_PROMPT, EMBEDDING_BACKEND, RETRIEVAL_SERVICE_ENABLED, VECTOR_DB_SHARED_PATH
 from components.rag_generator import RagGenerator
 from components.rag_retriever import RagRetriever
+from components.retrieval_service import RemoteRagRetriever
+from components.session_store import AI, HUMAN, SYSTEM, MessageRecord, SessionStore
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.messages import SystemMessage, HumanMessage, AIMessage, RemoveMessage
-from langgraph.checkpoint.memory import MemorySaver
-from langgraph.graph import START, MessagesState, StateGraph
+from langchain_core.messages import HumanMessage
 
+import asyncio
 import os
 
 class Chatbot:
@@ -29,17 +34,63 @@ class Chatbot:
         self.chatbot_id = instance["id"]
         self.name = instance["name"]
         self.keep_memory = keep_memory
+        self.documents_path = instance["documents_path"]
 
         project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
         vector_db_path = os.path.join(project_root, instance["vector_db_path"])
-        self.retriever = RagRetriever(vector_db_path=vector_db_path, chatbot_id=self.chatbot_id, documents_path=instance["documents_path"])
-        self.generator = RagGenerator(model = instance["llm_model"],
+        self.retriever = self.create_retriever(instance, vector_db_path)
+        # Short-lived cache of retrieval results, filled ahead of time by the prefetch endpoint
+        self.retrieval_cache = RetrievalPrefetcher(self.retriever)
+        self.generator_settings = self.get_generator_settings(instance)
+        self.generator = self.create_generator(instance)
+        self.user_history_db_path = os.path.join(project_root, chatbot_api_db_path)
+        self.prompt_template = self.create_prompt_template(instance)
+        self.response_cache = self.create_response_cache(instance)
+
+        # Conversation of each user, converted to LangChain messages only when calling the model
+        self.sessions = SessionStore()
+
+    def get_generator_settings(self, instance):
+        """Settings that require a new RagGenerator when they change"""
+        return (instance["llm_model"], instance["temperature"], instance["max_tokens"], instance["use_ollama"])
+
+    def create_generator(self, instance):
+        return RagGenerator(model = instance["llm_model"],
             temperature = instance["temperature"],
             num_predict = instance["max_tokens"],
-            use_ollama=instance["use_ollama"]
+            use_ollama=instance["use_ollama"],
+            # Citations link to this chatbot's documents
+            documents_url=f"/api/chatbot/{self.chatbot_id}/documents"
         )
-        self.user_history_db_path = os.path.join(project_root, chatbot_api_db_path)
 
+    def create_retriever(self, instance, vector_db_path):
+        retriever_kwargs = dict(vector_db_path=vector_db_path, chatbot_id=self.chatbot_id, documents_path=instance["documents_path"],
+            multi_tenant=instance["vector_db_path"] == VECTOR_DB_SHARED_PATH,
+            embedding_backend=instance.get("embedding_backend") or EMBEDDING_BACKEND
+        )
+        if RETRIEVAL_SERVICE_ENABLED:
+            # Models and vector stores live in the shared retrieval service process
+            retriever = RemoteRagRetriever(**retriever_kwargs)
+        else:
+            retriever = RagRetriever(**retriever_kwargs)
+        retriever.configure_reranker(instance.get("use_reranker"), instance.get("rerank_candidates"))
+        return retriever
+
+    def create_response_cache(self, instance):
+        return ResponseCache() if instance.get("use_response_cache") else None
+
+    def clear_response_cache(self):
+        """Drop cached answers, called when the chatbot's settings or documents change"""
+        if self.response_cache is not None:
+            self.response_cache.clear()
+
+    def get_response_cache_key(self, streaming_data):
+        """Cache key of the answer, or None when the answer must not be cached"""
+        if self.response_cache is None or not streaming_data["cacheable"]:
+            return None
+        return ResponseCache.make_key(streaming_data["messages_for_llm"], self.generator_settings)
+
+    def create_prompt_template(self, instance):
         system_prompt = CHATBOT_SYSTEM_PROMPT.format(
             guidelines = instance["system_guidelines"] if "system_guidelines" in instance else CHATBOT_GUIDELINES,
             module_subject = instance["area_expertise"] if "area_expertise" in instance else "Unknown",
@@ -48,141 +99,167 @@ class Chatbot:
             context = "{context}" # Placeholder for context insertion
         )
 
-        self.prompt_template = ChatPromptTemplate.from_messages([
+        return ChatPromptTemplate.from_messages([
             ("system", system_prompt + "\n\n### Available Sources for Citation\nIf relevant to your answer, you should cite these sources using the output_context_reference tool: {sources}"),
             ("user", "{user_prompt}")
         ])
-        
-        # Initialize the workflow with a state graph (without compiling)
-        self.workflow = StateGraph(state_schema=MessagesState)
-        
-        # Define the node and edge
-        self.workflow.add_node("model", self.get_state)
-        self.workflow.add_edge(START, "model")
-        
-        # Store user-specific compiled apps
-        self.user_apps = {}
-
-    def get_state(self, state: MessagesState):
-        """Simple placeholder method that returns the state unchanged"""
-        return state
-        
-
-    def get_user_app(self, user_id,):
-        """Get or create a user-specific compiled workflow"""
-        if user_id not in self.user_apps:
-            self.create_user_app(user_id)
-
-        return self.user_apps[user_id]
-
-    def create_user_app(self, user_id):
-        """Create a user-specific workflow"""
-        config = {"configurable": {"thread_id": "default"}}
-        memory = MemorySaver()
-        user = UserController.get_user_by_id(user_id)
-        if not user:
-            raise ValueError(f"User with ID {user_id} not found")
-        user_name = user['username']
-        self.user_apps[user_id] = self.workflow.compile(checkpointer=memory)
-        self.user_apps[user_id].update_state(config, {"messages": [SystemMessage(content=f"You are talking to {user_name}.")]})
 
-    def prepare_streaming_context(self, state: MessagesState):
+    def update_settings(self, instance):
+        """
+            Apply new settings in place. The retriever, the vector store and every user's
+            conversation memory are kept; the prompt template is swapped and the generator
+            is only rebuilt if the model parameters changed.
+        """
+        generator_settings = self.get_generator_settings(instance)
+        if generator_settings != self.generator_settings:
+            self.generator = self.create_generator(instance)
+            self.generator_settings = generator_settings
+
+        self.retriever.configure_reranker(instance.get("use_reranker"), instance.get("rerank_candidates"))
+        self.retrieval_cache.clear()
+
+        if bool(instance.get("use_response_cache")) != (self.response_cache is not None):
+            self.response_cache = self.create_response_cache(instance)
+        # Cached answers may depend on the previous prompt or model
+        self.clear_response_cache()
+
+        self.prompt_template = self.create_prompt_template(instance)
+        self.name = instance["name"]
+
+    def get_session(self, user):
+        """Get or create the user's conversation"""
+        return self.sessions.get_or_create(user['id'], (MessageRecord(SYSTEM, f"You are talking to {user['username']}."),))
+
+    def prepare_streaming_context(self, records):
         """
             Prepares the context and messages required for streaming responses.
+            records is the user's conversation ending with the new user message.
             Retrieves relevant documents for the latest user message, manages conversation history,
             and summarises if the history exceeds the maximum allowed messages.
             Returns a dictionary containing:
                 - messages_for_llm: List of messages to send to the language model.
-                - state_updates: Messages to update the conversation state (if summarisation occurs).
+                - state_updates: Records replacing the conversation (if summarisation occurs).
                 - user_prompt: The latest user message.
+                - cacheable: Whether the messages only depend on the settings, the retrieved chunks
+                  and the user prompt (stateless or first-turn questions), so the answer can be cached.
         """
-
         # Get the last user message
-        user_message = state["messages"][-1].content
-
-        # Retrieve relevant documents to user_message
-        docs = self.retriever.invoke(user_message)
-        context = "\n\n".join([doc.page_content for doc in docs])
-        
-        # Extract unique source files for citation
-        sources = list(set([doc.metadata.get('source', 'unknown') for doc in docs if doc.metadata.get('source', 'unknown') != 'unknown']))
-
-        # Filter messages in state to only contain conversation messages (no system messages)
-        conversation_history = [
-            msg for msg in state["messages"] 
-            if isinstance(msg, (HumanMessage, AIMessage))
+        user_message = records[-1].content
+
+        retrieved = self.retrieve_context(user_message)
+        summary = self.summarise_history(records)
+        return self.build_streaming_context(records, user_message, retrieved, summary)
+
+    def retrieve_context(self, user_message):
+        """Retrieve the documents relevant to user_message, the sources to cite and the page to link for each source"""
+        docs = self.retrieval_cache.invoke(user_message)
+        source_pages = {}
+        for doc in docs:
+            # Chunks are ranked, link each source to the page of its best chunk
+            source = doc.metadata.get('source', 'unknown')
+            if source != 'unknown' and doc.metadata.get('page_number'):
+                source_pages.setdefault(os.path.basename(source), doc.metadata['page_number'])
+        return {
+            "docs": docs,
+            "context": "\n\n".join([doc.page_content for doc in docs]),
+            # Extract unique source files for citation
+            "sources": list(set([doc.metadata.get('source', 'unknown') for doc in docs if doc.metadata.get('source', 'unknown') != 'unknown'])),
+            "source_pages": source_pages,
+        }
+
+    def summarise_history(self, records):
+        """Summarise the conversation if it is too long. Returns the summary, or None."""
+        if SessionStore.count_turns(records) < MAX_MESSAGES or not self.keep_memory:
+            return None
+
+        # Only the conversation messages (no system messages) are summarised
+        clean_history = [
+            {"role": "user" if record.role == HUMAN else "assistant",
+            "content": record.content}
+            for record in records if record.role != SYSTEM
         ]
 
-        # If conversation history is too long, summarize it
-        if len(conversation_history) >= MAX_MESSAGES and self.keep_memory:
-            # Clean history for summarization by removing metadata
-            clean_history = [
-                {"role": "user" if isinstance(msg, HumanMessage) else "assistant", 
-                "content": msg.content}
-                for msg in conversation_history
-            ]
-    
-            # Generate summary 
-            summary_message = self.generator.invoke(
-                [HumanMessage(content=f"Conversation:\n{clean_history}\n\nInstructions:\n{CHATBOT_SUMMARY_SYSTEM_PROMPT}")]
-            )
-
-            # Try to safely create delete messages, but have a fallback approach
-            delete_messages = []
-            
-            for m in state["messages"]:
-                if hasattr(m, 'id') and m.id is not None:
-                    try:
-                        delete_messages.append(RemoveMessage(id=m.id))
-                    except Exception as e:
-                        # If any message deletion fails, fall back to a simpler approach
-                        print(f"Warning: Could not create RemoveMessage for message ID {getattr(m, 'id', 'None')}: {str(e)}")
-                        continue
-            
-            # Re-add user message
-            human_message = HumanMessage(content=user_message)
-
-            # Format the prompt_template with retrieved context and user message
-            formatted_messages = self.prompt_template.format_messages(
-                context=context, 
-                sources=sources,
-                user_prompt=user_message
-            )
-            messages_for_llm = [summary_message, human_message] + formatted_messages
-            
+        # Generate summary
+        return self.generator.invoke(
+            [HumanMessage(content=f"Conversation:\n{clean_history}\n\nInstructions:\n{CHATBOT_SUMMARY_SYSTEM_PROMPT}")]
+        )
+
+    def build_streaming_context(self, records, user_message, retrieved, summary):
+        """Build the messages sent to the LLM from the retrieved context and the (summarised) history"""
+        docs = retrieved["docs"]
+
+        # Format the prompt_template with retrieved context and user message
+        formatted_messages = self.prompt_template.format_messages(
+            context=retrieved["context"],
+            sources=retrieved["sources"],
+            user_prompt=user_message
+        )
+
+        if summary is not None:
+            # The summary and the user message replace the conversation
+            state_updates = (MessageRecord(HUMAN, summary), MessageRecord(HUMAN, user_message))
+            messages_for_llm = SessionStore.to_messages(state_updates) + formatted_messages
+
             return {
                 "messages_for_llm": messages_for_llm,
-                "state_updates": [summary_message, human_message] + delete_messages,
+                "state_updates": state_updates,
+                "user_prompt": user_message,
+                "context": [doc.page_content for doc in docs] if docs else None,
+                "cacheable": False,
+                "source_pages": retrieved["source_pages"],
+                "sources": retrieved["sources"]
+            }
+
+        # Use only the system message from formatted_messages and keep conversation history
+        system_message = formatted_messages[0]  # The system message with context
+
+        if self.keep_memory:
+            # Only the new user message, the conversation has no earlier turns
+            first_turn = SessionStore.count_turns(records) == 1
+            if first_turn and self.response_cache is not None:
+                # A cached answer is shared by every student, leave out the per-user "You are talking to ..." record
+                records = tuple(record for record in records if record.role != SYSTEM)
+            return {
+                "messages_for_llm": [system_message] + SessionStore.to_messages(records),
+                "state_updates": None,
                 "user_prompt": user_message,
-                "context": [doc.page_content for doc in docs] if docs else None
+                "context": [doc.page_content for doc in docs] if docs else None,
+                "cacheable": first_turn,
+                "source_pages": retrieved["source_pages"],
+                "sources": retrieved["sources"]
             }
+
+        return {
+            "messages_for_llm": [system_message, HumanMessage(content=user_message)],
+            "state_updates": None,
+            "user_prompt": user_message,
+            "context": [doc.page_content for doc in docs] if docs else None,
+            "cacheable": True,
+            "source_pages": retrieved["source_pages"],
+            "sources": retrieved["sources"]
+        }
+
+    def get_user(self, user_id):
+        if not user_id:
+            user = UserController.get_guest_user(self.chatbot_id)
         else:
-            # Format the prompt with context for the current conversation
-            formatted_messages = self.prompt_template.format_messages(
-                context=context, 
-                sources=sources,
-                user_prompt=user_message
-            )
-            # Use only the system message from formatted_messages and keep conversation history
-            system_message = formatted_messages[0]  # The system message with context
-            messages_for_llm = [system_message] + state["messages"]
+            user = UserController.get_user_by_id(user_id)
 
-            if self.keep_memory:
-                return {
-                    "messages_for_llm": messages_for_llm,
-                    "state_updates": None,
-                    "user_prompt": user_message,
-                    "context": [doc.page_content for doc in docs] if docs else None
+        if not user:
+            raise ValueError(f"User not found for user_id: {user_id}")
+        return user
 
-                }
-            else:
-                return {
-                    "messages_for_llm": [system_message, HumanMessage(content=user_message)],
-                    "state_updates": None,
-                    "user_prompt": user_message,
-                    "context": [doc.page_content for doc in docs] if docs else None
+    def load_state(self, user, user_prompt):
+        """The user's conversation with the new user message appended"""
+        return self.get_session(user) + (MessageRecord(HUMAN, user_prompt),)
 
-                }
+    def save_response(self, user, records, state_updates, response):
+        """Add the user message and the answer to the conversation, or replace it after summarisation"""
+        response_record = MessageRecord(AI, response)
+        if state_updates:
+            self.sessions.replace(user['id'], state_updates + (response_record,))
+        else:
+            self.sessions.append(user['id'], records[-1], response_record)
 
     def invoke(self, user_prompt, user_id=None):
         """Get response"""
@@ -195,44 +272,31 @@ class Chatbot:
             raise ValueError(f"User not found for user_id: {user_id}")
 
         if user['username'] != "guest_user":
-            UserController.add_user_history_entry(user_id, self.chatbot_id, str(user_prompt), "user")
+            history_writer.add_entry(user_id, self.chatbot_id, str(user_prompt), "user")
 
         try:
-            # Get user-specific app with dedicated memory for context
-            app = self.get_user_app(user['id'])
-            config = {"configurable": {"thread_id": "default"}}
-
-            # Get current state to build context with new user message
-            current_state = app.get_state(config)
-            existing_messages = current_state.values.get("messages", []) if current_state.values else []
-            
-            # Add the new user message
-            user_message = HumanMessage(content=user_prompt)
-            all_messages = existing_messages + [user_message]
-            state_with_user_message = {"messages": all_messages}
+            # The user's conversation with the new user message
+            records = self.load_state(user, user_prompt)
 
             # Prepare streaming context
-            streaming_data = self.prepare_streaming_context(state_with_user_message)
+            streaming_data = self.prepare_streaming_context(records)
             messages_for_llm = streaming_data["messages_for_llm"]
             state_updates = streaming_data["state_updates"]
             
-            response = self.generator.invoke(messages_for_llm)
-
-            # Create the AI response message
-            response_message = AIMessage(content=response)
-
-            # Update state based on whether we had summarisation or not
-            if state_updates:
-                final_state = {"messages": state_updates + [response_message]}
-            else:
-                final_state = {"messages": all_messages + [response_message]}
-            
-            # Update the LangGraph state
-            app.update_state(config, final_state)
+            cache_key = self.get_response_cache_key(streaming_data)
+            response = self.response_cache.get(cache_key) if cache_key else None
+            if response is None:
+                response = self.generator.invoke(messages_for_llm, source_pages=streaming_data["source_pages"])
+                if cache_key:
+                    self.response_cache.add(cache_key, response)
+
+            # Update the conversation based on whether we had summarisation or not
+            self.save_response(user, records, state_updates, response)
             
             # Save to user history
             if user['username'] != "guest_user":
-                UserController.add_user_history_entry(user_id, self.chatbot_id, str(response), "assistant")
+                history_writer.add_entry(user_id, self.chatbot_id, str(response), "assistant")
+                history_writer.add_retrieved_sources(self.chatbot_id, streaming_data["sources"])
 
             if self.keep_memory:
                 return response
@@ -245,72 +309,87 @@ class Chatbot:
             return error
 
     async def stream(self, user_id, user_prompt):
-        """Get response as a stream using the LangGraph workflow with call_model_streaming"""
+        """
+            Get response as a stream.
+            Retrieval does not depend on the user or the conversation, so it runs concurrently with
+            the user lookup, state loading and summarisation. Each stage is recorded in a per-request timeline.
+        """
+        timeline = RequestTimeline(f"Chatbot {self.chatbot_id} prompt")
 
-        if not user_id:
-            user = UserController.get_guest_user(self.chatbot_id)
-        else:
-            user = UserController.get_user_by_id(user_id)
+        async def retrieve():
+            with timeline.stage("retrieval"):
+                return await asyncio.to_thread(self.retrieve_context, user_prompt)
 
-        if not user:
-            raise ValueError(f"User not found for user_id: {user_id}")
+        retrieval = asyncio.ensure_future(retrieve())
+
+        try:
+            with timeline.stage("user lookup"):
+                user = await asyncio.to_thread(self.get_user, user_id)
+        except Exception:
+            retrieval.cancel()
+            raise
 
         if user['username'] != "guest_user":
-            UserController.add_user_history_entry(user_id, self.chatbot_id, str(user_prompt), "user")
+            history_writer.add_entry(user_id, self.chatbot_id, str(user_prompt), "user")
 
         try:
-            # Get user-specific app with dedicated memory for context
-            app = self.get_user_app(user['id'])
-            config = {"configurable": {"thread_id": "default"}}
+            with timeline.stage("state loading"):
+                records = self.load_state(user, user_prompt)
 
-            # Get current state to build context with new user message
-            current_state = app.get_state(config)
-            existing_messages = current_state.values.get("messages", []) if current_state.values else []
-            
-            # Add the new user message
-            user_message = HumanMessage(content=user_prompt)
-            all_messages = existing_messages + [user_message]
-            state_with_user_message = {"messages": all_messages}
+            with timeline.stage("summarisation"):
+                summary = await asyncio.to_thread(self.summarise_history, records)
+
+            retrieved = await retrieval
 
             # Prepare streaming context
-            streaming_data = self.prepare_streaming_context(state_with_user_message)
+            streaming_data = self.build_streaming_context(records, user_prompt, retrieved, summary)
             messages_for_llm = streaming_data["messages_for_llm"]
             state_updates = streaming_data["state_updates"]
             
+            cache_key = self.get_response_cache_key(streaming_data)
+            cached_response = self.response_cache.get(cache_key) if cache_key else None
+
             full_response = ""
             async def stream_generator():
                 nonlocal full_response
                 try:
-                    # Use the LLM's streaming
-                    async for chunk in self.generator.stream(messages_for_llm):
-                        if chunk:
-                            full_response += chunk
-                            yield chunk
-
-                    # Create the AI response message
-                    response_message = AIMessage(content=full_response)
-
-                    # Update state based on whether we had summarisation or not
-                    if state_updates:
-                        final_state = {"messages": state_updates + [response_message]}
-                    else:
-                        final_state = {"messages": all_messages + [response_message]}
-                    
-                    # Update the LangGraph state
-                    app.update_state(config, final_state)
+                    with timeline.stage("generation"):
+                        if cached_response is not None:
+                            # Replay the cached answer instead of calling the LLM
+                            chunks = self.response_cache.replay(cached_response)
+                        else:
+                            # Use the LLM's streaming
+                            chunks = self.generator.stream(messages_for_llm, source_pages=streaming_data["source_pages"])
+
+                        async for chunk in chunks:
+                            if chunk:
+                                timeline.mark("first token")
+                                full_response += chunk
+                                yield chunk
+
+                    if cache_key and cached_response is None:
+                        self.response_cache.add(cache_key, full_response)
+
+                    # Update the conversation based on whether we had summarisation or not
+                    self.save_response(user, records, state_updates, full_response)
                     
                     # Save to user history
                     if user['username'] != "guest_user":
-                        UserController.add_user_history_entry(user_id, self.chatbot_id, str(full_response), "assistant")
+                        history_writer.add_entry(user_id, self.chatbot_id, str(full_response), "assistant")
+                        history_writer.add_retrieved_sources(self.chatbot_id, streaming_data["sources"])
                         
                 except Exception as streaming_error:
                     yield f"Error during streaming: {str(streaming_error)}"
+                finally:
+                    timeline.log()
                     
             return stream_generator()
             
         except Exception as setup_error:
+            retrieval.cancel()
             error = f"Error setting up streaming: {str(setup_error)}"
+            timeline.log()
             async def error_generator():
                 nonlocal error
                 yield error
-            return error_generator()
\ No newline at end of file
+            return error_generator()
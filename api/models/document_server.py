@@ -0,0 +1,84 @@
+"""
+================================================================================
+RAG Chatbot API for Education - Thesis Project
+--------------------------------------------------------------------------------
+Author: Tomás Pinto
+Date: August 2025
+Description:
+    This file serves the documents cited in chatbot answers. Files are
+    resolved inside the documents_path of the chatbot that cited them, and
+    sent with byte-range support (for in-browser PDF viewers), a strong ETag
+    computed from the file content, Last-Modified and long-lived cache
+    headers. Content hashes are cached until the file changes. The bytes can
+    optionally be offloaded to the front-end web server with X-Sendfile
+    (Apache, lighttpd) or X-Accel-Redirect (nginx).
+================================================================================
+"""
+
+import hashlib
+import mimetypes
+import os
+import threading
+from urllib.parse import quote
+
+from flask import Response, abort, request, send_file
+from werkzeug.security import safe_join
+
+from api.settings import DOCUMENT_ACCEL_REDIRECT_PREFIX, DOCUMENT_CACHE_MAX_AGE, DOCUMENT_OFFLOAD
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# path -> (mtime_ns, size, content hash)
+_content_hashes = {}
+_lock = threading.Lock()
+
+def get_documents_root(documents_path):
+    """Absolute documents folder, relative paths are relative to the project root like the vector databases"""
+    return os.path.abspath(os.path.join(PROJECT_ROOT, documents_path or "documents"))
+
+def resolve_document(documents_path, filename):
+    """Path of filename inside the documents folder, or None if it does not exist or escapes the folder"""
+    path = safe_join(get_documents_root(documents_path), filename)
+    if path is None or not os.path.isfile(path):
+        return None
+    return path
+
+def get_content_hash(path, stat):
+    """SHA-256 of the file, only recomputed when its size or modification time change"""
+    with _lock:
+        cached = _content_hashes.get(path)
+    if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+        return cached[2]
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(block)
+    content_hash = digest.hexdigest()
+
+    with _lock:
+        _content_hashes[path] = (stat.st_mtime_ns, stat.st_size, content_hash)
+    return content_hash
+
+def send_document(documents_path, filename):
+    """Response for a document request, honouring If-None-Match, If-Modified-Since and Range"""
+    path = resolve_document(documents_path, filename)
+    if path is None:
+        abort(404)
+
+    stat = os.stat(path)
+    etag = get_content_hash(path, stat)
+
+    relative_path = os.path.relpath(path, PROJECT_ROOT)
+    if DOCUMENT_OFFLOAD == "x-accel-redirect" and not relative_path.startswith(os.pardir):
+        # nginx streams the file (and handles Range) from an internal location mapped to the project root
+        response = Response(mimetype=mimetypes.guess_type(path)[0] or "application/octet-stream")
+        response.headers["X-Accel-Redirect"] = f"{DOCUMENT_ACCEL_REDIRECT_PREFIX}/{quote(relative_path.replace(os.sep, '/'))}"
+        response.set_etag(etag)
+        response.last_modified = stat.st_mtime
+        response.cache_control.public = True
+        response.cache_control.max_age = DOCUMENT_CACHE_MAX_AGE
+        return response.make_conditional(request)
+
+    # With DOCUMENT_OFFLOAD == "x-sendfile" the app sets USE_X_SENDFILE and send_file only sends the header
+    return send_file(path, conditional=True, etag=etag, last_modified=stat.st_mtime, max_age=DOCUMENT_CACHE_MAX_AGE)
@@ -0,0 +1,105 @@
+"""
+================================================================================
+RAG Chatbot API for Education - Thesis Project
+--------------------------------------------------------------------------------
+Author: Tomás Pinto
+Date: August 2025
+Description:
+    This file serialises chatbot history for the export endpoint. Rows are
+    read from a cursor in batches and written to the response as they are
+    serialised (NDJSON, CSV, or Parquet row groups when pyarrow is
+    installed), so exporting a whole term never holds the table in memory.
+================================================================================
+"""
+
+import csv
+import io
+import json
+
+from api.settings import HISTORY_EXPORT_BATCH_SIZE
+
+EXPORT_COLUMNS = ["id", "user_id", "chatbot_id", "role", "content", "timestamp"]
+EXPORT_FORMATS = {
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "csv": ("text/csv", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+def batched(rows, batch_size=HISTORY_EXPORT_BATCH_SIZE):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def export_ndjson(rows):
+    for batch in batched(rows):
+        yield "".join(json.dumps({column: row[column] for column in EXPORT_COLUMNS}) + "\n" for row in batch)
+
+def export_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for batch in batched(rows):
+        writer.writerows([row[column] for column in EXPORT_COLUMNS] for row in batch)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+class _StreamSink:
+    """Write-only file object handing the bytes written so far to the response"""
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data, self.chunks = b"".join(self.chunks), []
+        return data
+
+def export_parquet(rows):
+    """One Parquet row group per batch. Requires pyarrow, check with parquet_available() first"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([
+        ("id", pa.int64()), ("user_id", pa.int64()), ("chatbot_id", pa.int64()),
+        ("role", pa.string()), ("content", pa.string()), ("timestamp", pa.string()),
+    ])
+    sink = _StreamSink()
+    with pq.ParquetWriter(sink, schema) as writer:
+        for batch in batched(rows):
+            writer.write_table(pa.Table.from_pylist([{column: row[column] for column in EXPORT_COLUMNS} for row in batch], schema=schema))
+            yield sink.take()
+    yield sink.take()
+
+def parquet_available():
+    try:
+        import pyarrow.parquet
+    except ModuleNotFoundError:
+        return False
+    return True
+
+EXPORTERS = {"ndjson": export_ndjson, "csv": export_csv, "parquet": export_parquet}
+
+def export_history(rows, export_format):
+    return EXPORTERS[export_format](rows)
@@ -0,0 +1,244 @@
+"""
+================================================================================
+RAG Chatbot API for Education - Thesis Project
+--------------------------------------------------------------------------------
+Author: Tomás Pinto
+Date: August 2025
+Description:
+    This file implements a write-behind buffer for the user_history table.
+    Chat messages are enqueued in memory and written to SQLite in batched
+    transactions by a background thread, so chat latency does not depend on
+    disk I/O. Each batch also updates the daily question and answer counts,
+    and the counts of retrieved sources, used by the analytics endpoint.
+
+    Durability guarantees:
+        - An entry is persisted once the batch containing it is committed. A
+          batch is written when it reaches HISTORY_WRITER_BATCH_SIZE entries,
+          when HISTORY_WRITER_FLUSH_INTERVAL seconds have passed since its
+          first entry, or when flush() is called.
+        - flush() blocks until every entry enqueued before the call has been
+          committed (entries enqueued after it are not waited for), or until
+          HISTORY_WRITER_FLUSH_TIMEOUT seconds have passed. It is used before
+          reading or deleting history so readers see their own writes.
+        - Pending entries are flushed when the interpreter shuts down normally
+          (atexit). If the process is killed abruptly (SIGKILL, power loss),
+          entries still in the buffer are lost: at most one flush interval
+          or one batch worth of messages.
+        - When the buffer is full, entries are written synchronously by the
+          caller instead of being dropped.
+        - A batch that fails to commit is logged with the number of entries lost.
+================================================================================
+"""
+
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+from api.controllers.history_stats_controller import HistoryStatsController
+from api.controllers.user_controller import UserController
+from api.settings import (HISTORY_WRITER_BATCH_SIZE, HISTORY_WRITER_FLUSH_INTERVAL, HISTORY_WRITER_FLUSH_TIMEOUT,
+                          HISTORY_WRITER_MAX_QUEUE_SIZE)
+
+logger = logging.getLogger(__name__)
+
+# Marker put in the queue to make the worker write its current batch immediately
+_FLUSH = object()
+
+class _FlushRequest:
+    """Marker put in the queue by flush(), done is set once the entries enqueued before it are written"""
+    __slots__ = ("done",)
+
+    def __init__(self):
+        self.done = threading.Event()
+
+class HistoryWriter:
+    def __init__(self, max_queue_size=HISTORY_WRITER_MAX_QUEUE_SIZE, batch_size=HISTORY_WRITER_BATCH_SIZE,
+                 flush_interval=HISTORY_WRITER_FLUSH_INTERVAL):
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stop_event = threading.Event()
+
+        # (chatbot_id, day, source) -> retrievals not written yet
+        self._source_counts = Counter()
+        self._source_counts_lock = threading.Lock()
+
+    def start(self):
+        """Start the background writer thread if it is not running yet."""
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+            self._thread.start()
+            atexit.register(self.shutdown)
+
+    def add_entry(self, user_id, chatbot_id, content, role):
+        """Enqueue a user_history entry to be written in the background."""
+        entry = (user_id, chatbot_id, content, role)
+        if self._stop_event.is_set():
+            self._persist([entry])
+            return
+
+        self.start()
+        try:
+            self.queue.put_nowait(entry)
+        except queue.Full:
+            # Apply back-pressure to the caller rather than losing history
+            logger.warning("History buffer is full, writing entry synchronously.")
+            self._persist([entry])
+
+    def add_retrieved_sources(self, chatbot_id, sources):
+        """Count the sources retrieved to answer a question, written with the next batch."""
+        day = get_day()
+        with self._source_counts_lock:
+            for source in sources:
+                self._source_counts[(chatbot_id, day, os.path.basename(source))] += 1
+
+    def flush(self, timeout=HISTORY_WRITER_FLUSH_TIMEOUT):
+        """
+            Block until every entry enqueued so far has been written, or timeout seconds have passed.
+            Entries enqueued after the call are not waited for. Returns False on timeout.
+        """
+        if self._thread is None or not self._thread.is_alive():
+            self._write_pending()
+            return True
+
+        request = _FlushRequest()
+        deadline = time.monotonic() + timeout
+        try:
+            self.queue.put(request, timeout=timeout)
+        except queue.Full:
+            logger.warning(f"History buffer stayed full for {timeout}s, reading without flushing.")
+            return False
+        if not request.done.wait(max(0.0, deadline - time.monotonic())):
+            logger.warning(f"History flush did not complete within {timeout}s.")
+            return False
+        return True
+
+    def shutdown(self, timeout=10):
+        """Stop the writer thread after writing all pending entries."""
+        self._stop_event.set()
+        if self._thread is not None and self._thread.is_alive():
+            try:
+                self.queue.put(_FLUSH, timeout=timeout)
+            except queue.Full:
+                pass
+            self._thread.join(timeout)
+
+        # Anything left (e.g. the thread did not stop in time) is written here
+        self._write_pending()
+
+    def _run(self):
+        while not (self._stop_event.is_set() and self.queue.empty()):
+            batch, received, flush_request = self._collect_batch()
+            try:
+                if batch:
+                    self._write(batch)
+                self._write_source_counts()
+            finally:
+                for _ in range(received):
+                    self.queue.task_done()
+                if flush_request is not None:
+                    flush_request.done.set()
+
+    def _collect_batch(self):
+        """
+            Wait for an entry, then keep collecting entries until the batch is full,
+            the flush interval has elapsed since the first entry, or a flush is requested.
+            Returns the batch, the number of items taken from the queue and the flush() request that ended it, if any.
+        """
+        batch = []
+        received = 0
+        deadline = None
+        flush_request = None
+
+        while len(batch) < self.batch_size:
+            timeout = self.flush_interval if deadline is None else deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+
+            received += 1
+            if isinstance(item, _FlushRequest):
+                flush_request = item
+                break
+            if item is _FLUSH:
+                break
+
+            batch.append(item)
+            if deadline is None:
+                deadline = time.monotonic() + self.flush_interval
+
+        return batch, received, flush_request
+
+    def _drain(self):
+        """Take everything from the queue, returns the entries and the flush() requests"""
+        entries = []
+        flush_requests = []
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                return entries, flush_requests
+            self.queue.task_done()
+            if isinstance(item, _FlushRequest):
+                flush_requests.append(item)
+            elif item is not _FLUSH:
+                entries.append(item)
+
+    def _write_pending(self):
+        """Write what is left in the queue from the caller's thread (no writer thread running)"""
+        entries, flush_requests = self._drain()
+        self._write(entries)
+        self._write_source_counts()
+        for flush_request in flush_requests:
+            flush_request.done.set()
+
+    def _write(self, entries):
+        for start in range(0, len(entries), self.batch_size):
+            batch = entries[start:start + self.batch_size]
+            try:
+                self._persist(batch)
+            except Exception as e:
+                logger.error(f"Failed to write {len(batch)} user history entries: {e}")
+
+    def _persist(self, entries):
+        """Insert entries and add them to the daily counts, in one transaction so the counts cannot drift"""
+        # Entries are timestamped by SQLite in UTC when inserted
+        day = get_day()
+        counts = Counter()
+        for _, chatbot_id, _, role in entries:
+            counts[(chatbot_id, role)] += 1
+        chatbot_ids = {chatbot_id for chatbot_id, _ in counts}
+        UserController.add_user_history_entries(entries, [
+            (chatbot_id, day, counts[(chatbot_id, "user")], counts[(chatbot_id, "assistant")])
+            for chatbot_id in chatbot_ids
+        ])
+
+    def _write_source_counts(self):
+        with self._source_counts_lock:
+            if not self._source_counts:
+                return
+            counts, self._source_counts = self._source_counts, Counter()
+        try:
+            HistoryStatsController.add_retrieved_source_counts([key + (retrievals,) for key, retrievals in counts.items()])
+        except Exception as e:
+            logger.error(f"Failed to write {len(counts)} retrieved source counts: {e}")
+
+def get_day():
+    """Current UTC date, as SQLite's date(CURRENT_TIMESTAMP)"""
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d")
+
+history_writer = HistoryWriter()
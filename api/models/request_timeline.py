@@ -0,0 +1,60 @@
+"""
+================================================================================
+RAG Chatbot API for Education - Thesis Project
+--------------------------------------------------------------------------------
+Author: Tomás Pinto
+Date: August 2025
+Description:
+    This file records the stages of a single prompt request (user lookup,
+    state loading, retrieval, summarisation, first token, generation) as
+    offsets from the start of the request. Stages that run concurrently
+    overlap in the timeline, which is logged when the request completes.
+================================================================================
+"""
+
+import logging
+import time
+from contextlib import contextmanager
+
+from api.settings import LOG_REQUEST_TIMELINE
+
+logger = logging.getLogger(__name__)
+
+class RequestTimeline:
+    def __init__(self, label):
+        self.label = label
+        self.started_at = time.perf_counter()
+        self.stages = []
+        self.marks = {}
+
+    def elapsed(self):
+        return time.perf_counter() - self.started_at
+
+    @contextmanager
+    def stage(self, name):
+        """Record the start and end offsets (in seconds) of a block of code"""
+        start = self.elapsed()
+        try:
+            yield
+        finally:
+            self.stages.append({"name": name, "start": round(start, 3), "end": round(self.elapsed(), 3)})
+
+    def mark(self, name):
+        """Record a point in time, only the first occurrence of each name is kept (e.g. first token)"""
+        self.marks.setdefault(name, round(self.elapsed(), 3))
+
+    def report(self):
+        return {
+            "label": self.label,
+            "total_seconds": round(self.elapsed(), 3),
+            "stages": sorted(self.stages, key=lambda stage: stage["start"]),
+            "marks": dict(self.marks),
+        }
+
+    def log(self):
+        if not LOG_REQUEST_TIMELINE:
+            return
+        report = self.report()
+        stages = ", ".join(f"{stage['name']}: {stage['start']:.3f}-{stage['end']:.3f}s" for stage in report["stages"])
+        marks = ", ".join(f"{name}: {seconds:.3f}s" for name, seconds in report["marks"].items())
+        logger.info(f"{self.label} took {report['total_seconds']:.3f}s ({stages}{'; ' + marks if marks else ''})")
@@ -0,0 +1,69 @@
+"""
+================================================================================
+RAG Chatbot API for Education - Thesis Project
+--------------------------------------------------------------------------------
+Author: Tomás Pinto
+Date: August 2025
+Description:
+    This file implements an opt-in cache of chatbot answers. For stateless
+    and first-turn questions the messages sent to the model are fully
+    determined by the chatbot settings, the retrieved chunks and the user
+    prompt, so answers are cached under a hash of those exact messages and
+    of the model parameters. Entries expire after RESPONSE_CACHE_TTL seconds,
+    at most RESPONSE_CACHE_MAX_SIZE answers are kept per chatbot, and the
+    cache is cleared whenever the chatbot's settings or documents change.
+================================================================================
+"""
+
+import asyncio
+import hashlib
+import json
+import re
+import threading
+
+from cachetools import TTLCache
+
+from api.settings import RESPONSE_CACHE_MAX_SIZE, RESPONSE_CACHE_REPLAY_DELAY, RESPONSE_CACHE_TTL
+
+# Cached answers are replayed word by word, keeping the whitespace
+REPLAY_CHUNK_PATTERN = re.compile(r"\S+\s*|\s+")
+
+class ResponseCache:
+    def __init__(self, max_size=RESPONSE_CACHE_MAX_SIZE, ttl=RESPONSE_CACHE_TTL, replay_delay=RESPONSE_CACHE_REPLAY_DELAY):
+        self._cache = TTLCache(maxsize=max_size, ttl=ttl)
+        self._lock = threading.Lock()
+        self.replay_delay = replay_delay
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(messages, model_settings):
+        """Hash of the exact messages sent to the model and of the model parameters."""
+        payload = {
+            "messages": [[message.type, message.content] for message in messages],
+            "model": list(model_settings),
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            response = self._cache.get(key)
+            if response is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return response
+
+    def add(self, key, response):
+        with self._lock:
+            self._cache[key] = response
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    async def replay(self, response):
+        """Yield a cached answer in chunks, like a streamed model response."""
+        for chunk in REPLAY_CHUNK_PATTERN.findall(response):
+            yield chunk
+            await asyncio.sleep(self.replay_delay)
@@ -0,0 +1,157 @@
+"""
+================================================================================
+RAG Chatbot API for Education - Thesis Project
+--------------------------------------------------------------------------------
+Author: Tomás Pinto
+Date: August 2025
+Description:
+    This file implements resumable Server-Sent Events streams for chatbot
+    answers. Each answer is generated in a background thread into a replay
+    buffer, independently of the HTTP connection, so a dropped connection does
+    not waste the LLM call. Clients read the buffer as SSE events whose id is
+    the number of characters delivered so far; reconnecting with Last-Event-ID
+    resumes from that offset without regenerating. Tokens are coalesced into
+    frames of at most SSE_FRAME_MAX_CHARS characters, flushed at least every
+    SSE_FRAME_MAX_DELAY seconds. Finished answers are kept for
+    SSE_REPLAY_TTL seconds.
+================================================================================
+"""
+
+import asyncio
+import json
+import logging
+import threading
+import time
+import uuid
+
+from api.settings import SSE_FRAME_MAX_CHARS, SSE_FRAME_MAX_DELAY, SSE_KEEPALIVE_INTERVAL, SSE_REPLAY_TTL, SSE_RETRY_MS
+
+logger = logging.getLogger(__name__)
+
+def format_event(data, event_id=None):
+    """Serialise one SSE event, the data is sent as compact JSON"""
+    frame = f"id: {event_id}\n" if event_id is not None else ""
+    return frame + f"data: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+class ResponseStream:
+    def __init__(self, stream_id, chatbot_id=None):
+        # Random and unguessable, knowing it is what allows a client to resume the stream
+        self.stream_id = stream_id
+        # Chatbot answering, a stream is only resumed under its own chatbot's URL
+        self.chatbot_id = chatbot_id
+        self.text = ""
+        self.done = False
+        self.error = None
+        self.finished_at = None
+        self._changed = threading.Condition()
+
+    def append(self, chunk):
+        with self._changed:
+            self.text += chunk
+            self._changed.notify_all()
+
+    def finish(self, error=None):
+        with self._changed:
+            self.done = True
+            self.error = error
+            self.finished_at = time.monotonic()
+            self._changed.notify_all()
+
+    def events(self, offset=0, max_chars=SSE_FRAME_MAX_CHARS, max_delay=SSE_FRAME_MAX_DELAY):
+        """
+            Yield the SSE events of the answer from offset (a previous event id) onwards.
+            New text is held back until max_chars characters are pending or the oldest
+            pending text has waited max_delay seconds, so tiny tokens share one frame.
+        """
+        yield f"retry: {SSE_RETRY_MS}\n" + format_event({"stream_id": self.stream_id}, event_id=offset)
+
+        pending_since = None
+        last_sent = time.monotonic()
+        while True:
+            with self._changed:
+                while True:
+                    pending = len(self.text) - offset
+                    now = time.monotonic()
+                    if pending > 0 and pending_since is None:
+                        pending_since = now
+                    if self.done or pending >= max_chars or (pending_since is not None and now - pending_since >= max_delay):
+                        break
+                    if now - last_sent >= SSE_KEEPALIVE_INTERVAL:
+                        break
+                    timeout = SSE_KEEPALIVE_INTERVAL - (now - last_sent)
+                    if pending_since is not None:
+                        timeout = min(timeout, max_delay - (now - pending_since))
+                    self._changed.wait(timeout)
+                text, done, error = self.text, self.done, self.error
+
+            if len(text) > offset:
+                end = min(len(text), offset + max_chars)
+                chunk, offset = text[offset:end], end
+                # Text left over from a full frame has already waited, send it without delay
+                pending_since = pending_since if len(text) > offset else None
+                last_sent = time.monotonic()
+                yield format_event({"chunk": chunk}, event_id=offset)
+                continue
+
+            if done:
+                if error is not None:
+                    yield format_event({"error": error}, event_id=offset)
+                else:
+                    yield format_event({"done": True}, event_id=offset)
+                return
+
+            # Nothing new for a while, a comment keeps proxies from closing the connection
+            last_sent = time.monotonic()
+            yield ": keep-alive\n\n"
+
+class ResponseStreamRegistry:
+    def __init__(self, ttl=SSE_REPLAY_TTL):
+        self.ttl = ttl
+        self._streams = {}
+        self._lock = threading.Lock()
+
+    def start(self, chunks_factory, on_finish=None, chatbot_id=None):
+        """
+            Generate an answer in a background thread. chunks_factory is an async function returning
+            the async generator of chunks; on_finish runs once generation ends, e.g. to release resources.
+        """
+        stream = ResponseStream(uuid.uuid4().hex, chatbot_id)
+        with self._lock:
+            self._prune()
+            self._streams[stream.stream_id] = stream
+
+        def run():
+            loop = asyncio.new_event_loop()
+            try:
+                loop.run_until_complete(self._generate(stream, chunks_factory))
+            finally:
+                loop.close()
+                if on_finish is not None:
+                    on_finish()
+
+        threading.Thread(target=run, name=f"response-stream-{stream.stream_id[:8]}", daemon=True).start()
+        return stream
+
+    def get(self, stream_id):
+        with self._lock:
+            self._prune()
+            return self._streams.get(stream_id)
+
+    def _prune(self):
+        now = time.monotonic()
+        expired = [stream_id for stream_id, stream in self._streams.items()
+                   if stream.finished_at is not None and now - stream.finished_at > self.ttl]
+        for stream_id in expired:
+            del self._streams[stream_id]
+
+    async def _generate(self, stream, chunks_factory):
+        try:
+            async for chunk in await chunks_factory():
+                if chunk:
+                    stream.append(chunk)
+            stream.finish()
+        except Exception as e:
+            logger.error(f"Streaming failed: {e}")
+            stream.finish(error=str(e))
+
+response_streams = ResponseStreamRegistry()
@@ -0,0 +1,179 @@
+"""
+================================================================================
+RAG Chatbot API for Education - Thesis Project
+--------------------------------------------------------------------------------
+Author: Tomás Pinto
+Date: August 2025
+Description:
+    This file implements speculative retrieval while a student is typing.
+    The chat page sends the partial input to the prefetch endpoint, which
+    schedules a retrieval for it once the student stops typing for
+    RETRIEVAL_PREFETCH_DEBOUNCE seconds. A newer input from the same student
+    cancels the pending one. Results are kept in a short-lived cache in front
+    of the chatbot's retriever, so when the prompt is submitted retrieval is
+    a cache hit (or waits for the retrieval already running) and generation
+    starts immediately.
+================================================================================
+"""
+
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from cachetools import TTLCache
+
+from api.settings import (RETRIEVAL_CACHE_MAX_SIZE, RETRIEVAL_CACHE_TTL, RETRIEVAL_PREFETCH_DEBOUNCE, RETRIEVAL_PREFETCH_MAX_PENDING,
+                          RETRIEVAL_PREFETCH_MAX_QUEUED, RETRIEVAL_PREFETCH_MIN_CHARS, RETRIEVAL_PREFETCH_WORKERS)
+
+logger = logging.getLogger(__name__)
+
+# Shared by every chatbot so prefetching never uses more than RETRIEVAL_PREFETCH_WORKERS threads
+_executor = ThreadPoolExecutor(max_workers=RETRIEVAL_PREFETCH_WORKERS, thread_name_prefix="retrieval-prefetch")
+# Prefetches waiting for a worker, a prefetch that cannot start soon is useless so newer ones are dropped
+_queue_slots = threading.BoundedSemaphore(RETRIEVAL_PREFETCH_MAX_QUEUED)
+
+def normalise_query(query):
+    return " ".join(str(query).split())
+
+class RetrievalPrefetcher:
+    def __init__(self, retriever, max_size=RETRIEVAL_CACHE_MAX_SIZE, ttl=RETRIEVAL_CACHE_TTL, debounce=RETRIEVAL_PREFETCH_DEBOUNCE):
+        self.retriever = retriever
+        self.debounce = debounce
+        self._cache = TTLCache(maxsize=max_size, ttl=ttl)
+        # Retrievals currently running, so a submitted prompt waits for them instead of retrieving twice.
+        # Prefetches still queued for a worker are not in it, a submitted prompt never waits behind the queue.
+        self._in_flight = {}
+        # Bumped by clear(), results of retrievals started before are not cached
+        self._generation = 0
+        # Pending (debounced) prefetch per student
+        self._timers = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.prefetched = 0
+        self.cancelled = 0
+        self.dropped = 0
+
+    def invoke(self, query):
+        """Retrieve the documents for query, using the cached or in-flight result when there is one."""
+        key = normalise_query(query)
+        owner = False
+        with self._lock:
+            docs = self._cache.get(key)
+            future = self._in_flight.get(key) if docs is None else None
+            if docs is not None or future is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+                # Retrieve in the caller's thread, other requests for the same query wait on the future
+                future = self._in_flight[key] = Future()
+                generation = self._generation
+                owner = True
+        if docs is not None:
+            return list(docs)
+
+        if owner:
+            self._retrieve(key, future, generation)
+            return list(future.result())
+
+        try:
+            return list(future.result())
+        except Exception:
+            # The prefetch failed, retrieve again for the submitted prompt
+            return self.retriever.invoke(key)
+
+    def prefetch(self, session_key, query):
+        """
+            Schedule a retrieval of a partial input, replacing the student's pending one.
+            Returns False when the input is too short, already cached or too many prefetches are pending.
+        """
+        key = normalise_query(query)
+        with self._lock:
+            timer = self._timers.pop(session_key, None)
+            if timer is not None:
+                timer.cancel()
+                self.cancelled += 1
+
+            if len(key) < RETRIEVAL_PREFETCH_MIN_CHARS or key in self._cache or key in self._in_flight:
+                return False
+            if len(self._timers) >= RETRIEVAL_PREFETCH_MAX_PENDING:
+                return False
+
+            timer = threading.Timer(self.debounce, self._start_prefetch, args=(session_key, key))
+            timer.daemon = True
+            self._timers[session_key] = timer
+        timer.start()
+        return True
+
+    def cancel(self, session_key):
+        with self._lock:
+            timer = self._timers.pop(session_key, None)
+            if timer is not None:
+                timer.cancel()
+                self.cancelled += 1
+
+    def clear(self):
+        """Forget cached results, e.g. after the documents or the retriever settings change."""
+        with self._lock:
+            self._generation += 1
+            self._cache.clear()
+            # Running retrievals may use the old documents, later prompts do not wait for them
+            self._in_flight.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "prefetched": self.prefetched,
+                "cancelled": self.cancelled,
+                "dropped": self.dropped,
+                "pending": len(self._timers),
+                "in_flight": len(self._in_flight),
+                "cached": len(self._cache),
+            }
+
+    def _start_prefetch(self, session_key, key):
+        with self._lock:
+            if self._timers.get(session_key) is not threading.current_thread():
+                # Superseded by a newer input
+                return
+            del self._timers[session_key]
+            if key in self._cache or key in self._in_flight:
+                return
+            if not _queue_slots.acquire(blocking=False):
+                self.dropped += 1
+                return
+        try:
+            _executor.submit(self._run_prefetch, key)
+        except RuntimeError:
+            # Interpreter shutting down
+            _queue_slots.release()
+
+    def _run_prefetch(self, key):
+        """Runs in a prefetch worker, the query becomes in flight only now that it is retrieved"""
+        _queue_slots.release()
+        with self._lock:
+            if key in self._cache or key in self._in_flight:
+                # Retrieved meanwhile, e.g. by the submitted prompt
+                return
+            self.prefetched += 1
+            future = self._in_flight[key] = Future()
+            generation = self._generation
+        self._retrieve(key, future, generation)
+
+    def _retrieve(self, key, future, generation):
+        """Run the retrieval and publish its result to the requests waiting on future"""
+        try:
+            docs = self.retriever.invoke(key)
+            with self._lock:
+                if generation == self._generation:
+                    self._cache[key] = docs
+            future.set_result(docs)
+        except Exception as e:
+            logger.warning(f"Retrieval failed: {e}")
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                if self._in_flight.get(key) is future:
+                    del self._in_flight[key]
@@ -0,0 +1,79 @@
+"""
+================================================================================
+RAG Chatbot API for Education - Thesis Project
+--------------------------------------------------------------------------------
+Author: Tomás Pinto
+Date: August 2025
+Description:
+    This file records how long each startup phase takes (imports, database
+    initialisation, embedding model and chatbot loading) and whether the API
+    is ready to serve chatbots. The breakdown is logged once startup
+    completes and returned by the readiness endpoint.
+================================================================================
+"""
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+class StartupTimer:
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.ready_at = None
+        self.phases = []
+        self.errors = []
+        self._seen = set()
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self):
+        return self.ready_at is not None
+
+    def record(self, name, seconds):
+        with self._lock:
+            self.phases.append({"name": name, "seconds": round(seconds, 3)})
+
+    @contextmanager
+    def phase(self, name, once=False):
+        """Time a block of code. With once=True only the first run is recorded (e.g. imports)."""
+        with self._lock:
+            skip = once and name in self._seen
+            self._seen.add(name)
+        if skip:
+            yield
+            return
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record_error(self, message):
+        """A startup step failed, the API may be ready without some of the chatbots"""
+        with self._lock:
+            self.errors.append(message)
+
+    def mark_ready(self):
+        if self.ready:
+            return
+        self.ready_at = time.perf_counter()
+        breakdown = ", ".join(f"{phase['name']}: {phase['seconds']:.2f}s" for phase in self.phases)
+        logger.info(f"Ready after {self.ready_at - self.started_at:.2f}s ({breakdown})")
+
+    def report(self):
+        with self._lock:
+            phases = list(self.phases)
+            errors = list(self.errors)
+        return {
+            "ready": self.ready,
+            "errors": errors,
+            "uptime_seconds": round(time.perf_counter() - self.started_at, 3),
+            "time_to_ready_seconds": round(self.ready_at - self.started_at, 3) if self.ready else None,
+            "phases": phases,
+        }
+
+startup_timer = StartupTimer()
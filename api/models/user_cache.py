@@ -0,0 +1,61 @@
+"""
+================================================================================
+RAG Chatbot API for Education - Thesis Project
+--------------------------------------------------------------------------------
+Author: Tomás Pinto
+Date: August 2025
+Description:
+    This file implements an in-process identity cache for user rows, indexed
+    by user id and by email. Entries expire after USER_CACHE_TTL seconds and
+    the least recently used ones are evicted once USER_CACHE_MAX_SIZE is
+    reached. It is used by UserController so that resolving the user of a
+    request is a dictionary lookup instead of a database query.
+================================================================================
+"""
+
+import threading
+
+from cachetools import TTLCache
+
+from api.settings import USER_CACHE_MAX_SIZE, USER_CACHE_TTL
+
+class UserCache:
+    def __init__(self, max_size=USER_CACHE_MAX_SIZE, ttl=USER_CACHE_TTL):
+        self._by_id = TTLCache(maxsize=max_size, ttl=ttl)
+        self._by_email = TTLCache(maxsize=max_size, ttl=ttl)
+        # TTLCache is not thread-safe and Flask serves requests from several threads
+        self._lock = threading.Lock()
+
+    def get_by_id(self, user_id):
+        with self._lock:
+            return self._by_id.get(int(user_id))
+
+    def get_by_email(self, email):
+        with self._lock:
+            return self._by_email.get(email)
+
+    def add(self, user):
+        """Cache a user row under both its id and its email."""
+        with self._lock:
+            self._by_id[int(user['id'])] = user
+            if user['email']:
+                self._by_email[user['email']] = user
+
+    def invalidate(self, user_id=None, email=None):
+        """Remove a user from the cache, either by id, by email or both."""
+        with self._lock:
+            if user_id is not None:
+                user = self._by_id.pop(int(user_id), None)
+                if user is not None and user['email']:
+                    self._by_email.pop(user['email'], None)
+            if email is not None:
+                user = self._by_email.pop(email, None)
+                if user is not None:
+                    self._by_id.pop(int(user['id']), None)
+
+    def clear(self):
+        with self._lock:
+            self._by_id.clear()
+            self._by_email.clear()
+
+user_cache = UserCache()
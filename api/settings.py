@@ -9,11 +9,132 @@ Description:
 ================================================================================
 """
 
-# This is the path to the SQLite database file for chatbot instances
-CHATBOT_API_DB_PATH = "./databases/chatbot_instances.db"
+import os
+
+# This is the path to the SQLite database file for chatbot instances (can be overridden, e.g. by benchmarks)
+CHATBOT_API_DB_PATH = os.environ.get("CHATBOT_API_DB_PATH", "./databases/chatbot_instances.db")
+
+# Multi-tenant vector store: when enabled, new chatbots store their chunks in a single shared
+# Milvus collection and retrieval is scoped to the documents each chatbot references.
+# Identical documents are stored once and shared by every chatbot that uses them.
+# Chatbots whose vector_db_path is VECTOR_DB_SHARED_PATH always run in this mode.
+VECTOR_DB_MULTI_TENANT = False
+VECTOR_DB_SHARED_PATH = "./databases/rag_milvus_shared.db"
+VECTOR_DB_SHARED_COLLECTION = "erca_shared_chunks"
+# Parser used to extract text from PDFs: "adaptive" reads the PDF text layer and only sends low-quality
+# pages (scans, image-heavy slides, garbled text) to the slower hi_res/OCR pipeline, "unstructured" runs
+# hi_res on every page, "text" and "pypdf" only read the text layer.
+DOCUMENT_PARSER = "adaptive"
+# Embedding model used for documents and queries. The backend can be chosen per chatbot (embedding_backend column):
+# "torch" runs the model with PyTorch, "onnx" with onnxruntime and "onnx-int8" with int8 dynamically quantised weights.
+# All backends produce vectors in the same space, so a chatbot can switch backend without re-indexing its documents.
+EMBEDDING_MODEL = "BAAI/bge-base-en-v1.5"
+EMBEDDING_BACKEND = "torch"
+ONNX_MODELS_PATH = "./databases/onnx_models"  # Exported ONNX models are cached here
+# Local snapshots of the embedding models, saved with `python -m components.embeddings` and loaded
+# from disk at startup instead of resolving the model on the Hugging Face Hub
+EMBEDDING_SNAPSHOT_PATH = "./databases/embedding_snapshots"
+# Micro-batching of query embeddings: queries arriving within EMBEDDING_BATCH_MAX_WAIT seconds of each other
+# are embedded in one forward pass. Always used by the retrieval service, optional in the web process.
+EMBEDDING_BATCHING_ENABLED = False
+EMBEDDING_BATCH_MAX_WAIT = 0.005
+EMBEDDING_BATCH_MAX_SIZE = 32
+
+# Optional cross-encoder reranking of retrieved chunks, enabled per chatbot (use_reranker column)
+RERANKER_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+RERANKER_CANDIDATES = 20  # Chunks retrieved before being reranked down to the chunks sent to the LLM
+RERANKER_LATENCY_BUDGET = 0.3  # Reranking is skipped when it is expected to take longer (in seconds)
+RERANKER_SKIP_DECAY = 0.8  # The latency estimate shrinks by this factor on every skip, so a slow spike does not disable reranking for good
+RERANKER_CACHE_SIZE = 10000  # Number of (query, chunk) scores kept in memory
 MAX_MESSAGES = 10  # Maximum number of messages to keep in the conversation history
 LLM_TEMPERATURE = 0.6
 LLM_MAX_TOKENS = 4096
+
+# Write-behind buffer for user_history logging (see api/models/history_writer.py)
+HISTORY_WRITER_MAX_QUEUE_SIZE = 10000  # Entries buffered in memory before writes fall back to synchronous
+HISTORY_WRITER_BATCH_SIZE = 200  # Maximum number of entries written in a single transaction
+HISTORY_WRITER_FLUSH_INTERVAL = 1.0  # Maximum time (in seconds) an entry waits in the buffer before being written
+HISTORY_WRITER_FLUSH_TIMEOUT = 5.0  # Maximum time (in seconds) reads wait for the entries buffered before them to be written
+
+# History export (see api/models/history_export.py)
+HISTORY_EXPORT_BATCH_SIZE = 1000  # Rows read from the database and written to the response at a time
+
+# In-process cache of user rows (see api/models/user_cache.py)
+USER_CACHE_MAX_SIZE = 10000  # Maximum number of users kept per lookup key (id and email)
+USER_CACHE_TTL = 300  # Time (in seconds) a cached user row stays valid
+
+# Provider fallback (see components/llm_router.py). When LLM_FALLBACK_MODEL is set, requests are routed to it
+# if the chatbot's model is rate limited, failing or has its circuit open, and streamed requests that have not
+# produced a first token within LLM_HEDGE_TTFT_DEADLINE seconds are also sent to it, the first to answer wins.
+LLM_FALLBACK_MODEL = None  # e.g. "openai/gpt-4o-mini"
+LLM_FALLBACK_USE_OLLAMA = False
+LLM_HEDGE_TTFT_DEADLINE = 3.0  # None disables hedging of streamed requests
+LLM_HEDGE_INVOKE_AFTER = None  # Hedging of non-streamed requests (summaries, tool calls), disabled by default
+LLM_CIRCUIT_FAILURE_THRESHOLD = 3  # Consecutive failures before a provider is skipped
+LLM_CIRCUIT_RESET_TIMEOUT = 30  # Time (in seconds) before a skipped provider is tried again
+
+# Admission control on the streaming prompt endpoint (see api/models/admission_control.py)
+CHATBOT_MAX_CONCURRENT_STREAMS = 16  # Streams answered at the same time by one chatbot
+CHATBOT_MAX_QUEUED_STREAMS = 32  # Streams waiting for a free slot before new ones are rejected with 429
+PROVIDER_MAX_CONCURRENT_STREAMS = 32  # Streams sent at the same time to one LLM provider, across chatbots
+PROVIDER_MAX_QUEUED_STREAMS = 64
+ADMISSION_QUEUE_TIMEOUT = 10  # Maximum time (in seconds) a stream waits for a free slot
+USER_RATE_LIMIT_PER_MINUTE = 10  # Prompts per user per minute, on average
+USER_RATE_LIMIT_BURST = 5  # Prompts a user can send in a quick burst
+
+# Startup: when enabled, chatbots are loaded in a background thread so the server starts accepting
+# connections immediately. /healthz reports liveness and /readyz returns 503 until every chatbot is loaded.
+CHATBOT_BACKGROUND_LOADING = False
+
+# Shared retrieval service for multi-worker deployments (see components/retrieval_service.py). When enabled,
+# web workers do not load embedding models or vector stores, they forward retrieval calls to the service
+# process started with `python -m components.retrieval_service`. Requests are pickled, so the service and the
+# workers must share a secret RETRIEVAL_SERVICE_AUTHKEY environment variable; nothing starts without it.
+RETRIEVAL_SERVICE_ENABLED = False
+RETRIEVAL_SERVICE_ADDRESS = "./databases/retrieval_service.sock"  # UNIX socket path (owner-only), or host:port on a loopback address
+RETRIEVAL_SERVICE_AUTHKEY = os.environ.get("RETRIEVAL_SERVICE_AUTHKEY", "").encode()
+RETRIEVAL_SERVICE_POOL_SIZE = 8  # Connections kept open per chatbot and worker
+
+# Opt-in cache of answers to stateless and first-turn questions, enabled per chatbot (use_response_cache column)
+RESPONSE_CACHE_MAX_SIZE = 1000  # Maximum number of answers kept per chatbot
+RESPONSE_CACHE_TTL = 3600  # Time (in seconds) a cached answer stays valid
+RESPONSE_CACHE_REPLAY_DELAY = 0.0  # Pause (in seconds) between the chunks of a replayed answer
+
+# Speculative retrieval while the student is typing (see api/models/retrieval_prefetcher.py). The chat page sends
+# the partial input to the prefetch endpoint and the retrieval results are cached for the submitted prompt.
+RETRIEVAL_PREFETCH_ENABLED = True
+RETRIEVAL_PREFETCH_DEBOUNCE = 0.3  # Time (in seconds) without a newer input before a prefetch starts
+RETRIEVAL_PREFETCH_MIN_CHARS = 12  # Shorter partial inputs are not prefetched
+RETRIEVAL_PREFETCH_WORKERS = 4  # Threads running prefetches, shared by every chatbot
+RETRIEVAL_PREFETCH_MAX_PENDING = 256  # Debounced prefetches waiting per chatbot, newer inputs are dropped beyond this
+RETRIEVAL_PREFETCH_MAX_QUEUED = 8  # Prefetches waiting for a worker across every chatbot, newer ones are dropped beyond this
+RETRIEVAL_CACHE_MAX_SIZE = 1000  # Retrieval results kept per chatbot
+RETRIEVAL_CACHE_TTL = 120  # Time (in seconds) a retrieval result stays valid
+
+# Resumable SSE streams of the prompt endpoint (see api/models/response_streams.py). Answers are generated in the
+# background into a replay buffer, clients resume a dropped stream with the Last-Event-ID of the last event received.
+SSE_FRAME_MAX_CHARS = 64  # Tokens are coalesced into frames of at most this many characters...
+SSE_FRAME_MAX_DELAY = 0.05  # ...sent at least this often (in seconds) while text is pending
+SSE_REPLAY_TTL = 300  # Time (in seconds) a finished answer can still be resumed
+SSE_RETRY_MS = 2000  # Reconnection delay suggested to clients
+SSE_KEEPALIVE_INTERVAL = 15  # Time (in seconds) without events before a keep-alive comment is sent
+
+# Serving of cited documents (see api/models/document_server.py)
+DOCUMENT_CACHE_MAX_AGE = 86400  # Time (in seconds) browsers may reuse a document before revalidating its ETag
+# Let the front-end web server send the file bytes: None, "x-sendfile" (Apache, lighttpd) or "x-accel-redirect" (nginx).
+# With nginx, DOCUMENT_ACCEL_REDIRECT_PREFIX must be an internal location aliased to the project root.
+DOCUMENT_OFFLOAD = None
+DOCUMENT_ACCEL_REDIRECT_PREFIX = "/protected-documents"
+
+# Log the per-stage timeline (user lookup, state loading, retrieval, summarisation, first token) of every streamed prompt
+LOG_REQUEST_TIMELINE = True
+
+# Local stub LLM for load and latency testing, selected with an llm_model starting with "stub"
+# (e.g. "stub" or "stub:ttft=0.5,tps=40,tokens=200,tool=reference"). Defaults for omitted options:
+STUB_LLM_TTFT = 0.3  # Time to first token (in seconds)
+STUB_LLM_TOKENS_PER_SECOND = 50.0
+STUB_LLM_RESPONSE_TOKENS = 100
+STUB_LLM_TOOL_CALL = "none"  # Tool called when tools are bound: "none", "email" or "reference"
 CHATBOT_DEFAULT_GREETING_MESSAGE = (
     "Hello {user_name}! I’m your assistant for image processing. "
     "I can help you understand concepts like filters, transformations, segmentation, and more – all based on the information I’ve been given. "
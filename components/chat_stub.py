@@ -0,0 +1,110 @@
+import hashlib
+import random
+import re
+import time
+from typing import Any, Iterator, List, Optional
+
+from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from api.settings import STUB_LLM_RESPONSE_TOKENS, STUB_LLM_TOKENS_PER_SECOND, STUB_LLM_TOOL_CALL, STUB_LLM_TTFT
+
+STUB_MODEL_PREFIX = "stub"
+
+WORDS = (
+    "image", "pixel", "filter", "edge", "kernel", "histogram", "threshold", "segmentation", "noise", "frequency",
+    "convolution", "gradient", "intensity", "morphology", "region", "contrast", "transform", "feature", "sample", "colour",
+)
+
+SOURCE_PATTERN = re.compile(r"[\w./-]+\.pdf")
+
+def is_stub_model(model_name):
+    return bool(model_name) and model_name.split(":", 1)[0] == STUB_MODEL_PREFIX
+
+class ChatStub(BaseChatModel):
+    """
+        Fake chat model for offline load and latency testing. Streams deterministic tokens
+        (the same prompt always gets the same answer) after a fixed time to first token and
+        at a fixed token rate. When tools are bound it answers with a tool call instead.
+    """
+    ttft: float = STUB_LLM_TTFT
+    tokens_per_second: float = STUB_LLM_TOKENS_PER_SECOND
+    response_tokens: int = STUB_LLM_RESPONSE_TOKENS
+    tool_call: str = STUB_LLM_TOOL_CALL
+    tools_bound: bool = False
+
+    @classmethod
+    def from_model_name(cls, model_name, max_tokens=None):
+        """Build a stub from a model name like "stub:ttft=0.5,tps=40,tokens=200,tool=reference" """
+        options = {}
+        _, _, spec = model_name.partition(":")
+        for option in filter(None, spec.split(",")):
+            key, _, value = option.partition("=")
+            options[key.strip()] = value.strip()
+
+        response_tokens = int(options.get("tokens", STUB_LLM_RESPONSE_TOKENS))
+        if max_tokens:
+            response_tokens = min(response_tokens, int(max_tokens))
+        return cls(
+            ttft=float(options.get("ttft", STUB_LLM_TTFT)),
+            tokens_per_second=float(options.get("tps", STUB_LLM_TOKENS_PER_SECOND)),
+            response_tokens=response_tokens,
+            tool_call=options.get("tool", STUB_LLM_TOOL_CALL),
+        )
+
+    @property
+    def _llm_type(self) -> str:
+        return "stub"
+
+    def bind_tools(self, tools, **kwargs):
+        return self.model_copy(update={"tools_bound": True})
+
+    def get_tokens(self, messages):
+        prompt = "\n".join(str(message.content) for message in messages)
+        seed = int.from_bytes(hashlib.sha256(prompt.encode()).digest()[:8], "big")
+        rng = random.Random(seed)
+        return [("" if index == 0 else " ") + rng.choice(WORDS) for index in range(self.response_tokens)]
+
+    def get_tool_calls(self, messages):
+        if self.tool_call == "email":
+            return [{"name": "output_email_button", "args": {"subject": "Question", "body": "Hello"}, "id": "stub-call-0"}]
+        if self.tool_call == "reference":
+            prompt = "\n".join(str(message.content) for message in messages)
+            sources = list(dict.fromkeys(SOURCE_PATTERN.findall(prompt)))[:3]
+            return [{"name": "output_context_reference", "args": {"cited_sources": sources}, "id": "stub-call-0"}]
+        return []
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        if self.tools_bound:
+            time.sleep(self.ttft)
+            message = AIMessage(content="", tool_calls=self.get_tool_calls(messages))
+        else:
+            content = "".join(chunk.text for chunk in self._stream(messages, stop, run_manager, **kwargs))
+            message = AIMessage(content=content)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        start = time.monotonic()
+        for index, token in enumerate(self.get_tokens(messages)):
+            # Tokens are scheduled from the start time so the rate does not drift with slow consumers
+            delay = start + self.ttft + index / self.tokens_per_second - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
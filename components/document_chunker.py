@@ -0,0 +1,106 @@
+from langchain_core.documents import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+class StreamingChunker:
+    """
+        Builds chunks incrementally from a stream of parsed document elements (titles,
+        paragraphs, tables, list items...). Only the chunk being built is kept in memory,
+        so peak memory does not depend on the size of the document.
+        Each chunk keeps the pages it spans and the types of the elements it contains.
+    """
+    def __init__(self, chunk_size, chunk_overlap):
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        # A title starts a new chunk once the current one is at least this long
+        self.min_chunk_size = chunk_size // 2
+        # Elements longer than a chunk (e.g. big tables) are split on their own
+        self.text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            length_function=len,
+        )
+
+    def chunk(self, elements):
+        """Yield chunks as Documents from an iterable of element Documents"""
+        chunk = _ChunkBuilder()
+
+        for element in elements:
+            text = element.page_content.strip()
+            if not text:
+                continue
+
+            source = element.metadata.get("source", "unknown")
+            page_number = element.metadata.get("page_number", 0)
+            category = element.metadata.get("category", "NarrativeText")
+
+            if chunk.source is not None and source != chunk.source:
+                if chunk.has_content:
+                    yield self.build_chunk(chunk)
+                chunk = _ChunkBuilder()
+
+            if len(text) > self.chunk_size:
+                if chunk.has_content:
+                    yield self.build_chunk(chunk)
+                for piece in self.text_splitter.split_text(text):
+                    piece_chunk = _ChunkBuilder()
+                    piece_chunk.add(piece, source, page_number, category)
+                    yield self.build_chunk(piece_chunk)
+                chunk = _ChunkBuilder()
+                continue
+
+            starts_section = category == "Title" and chunk.size >= self.min_chunk_size
+            if chunk.has_content and (starts_section or chunk.size + len(text) + 1 > self.chunk_size):
+                yield self.build_chunk(chunk)
+                chunk = chunk.overlap(self.chunk_overlap if not starts_section else 0)
+                if chunk.size + len(text) + 1 > self.chunk_size:
+                    chunk = _ChunkBuilder()
+
+            chunk.add(text, source, page_number, category)
+
+        if chunk.has_content:
+            yield self.build_chunk(chunk)
+
+    def build_chunk(self, chunk):
+        return Document(
+            page_content="\n".join(chunk.parts),
+            metadata={
+                "source": chunk.source,
+                "file_type": "pdf",
+                "page_number": chunk.pages[0],
+                "page_end": chunk.pages[-1],
+                "element_types": ",".join(chunk.categories),
+            }
+        )
+
+class _ChunkBuilder:
+    """Text and metadata of the chunk currently being built"""
+    __slots__ = ("parts", "size", "source", "pages", "categories", "has_content")
+
+    def __init__(self):
+        self.parts = []
+        self.size = 0
+        self.source = None
+        self.pages = []
+        self.categories = []
+        self.has_content = False
+
+    def add(self, text, source, page_number, category, is_content=True):
+        self.parts.append(text)
+        self.size += len(text) + 1
+        self.source = source
+        if not is_content:
+            # The overlap tail repeats the previous chunk, the pages are those of the chunk's own elements
+            return
+        if not self.pages or self.pages[-1] != page_number:
+            self.pages.append(page_number)
+        if category not in self.categories:
+            self.categories.append(category)
+        self.has_content = True
+
+    def overlap(self, overlap_size):
+        """Start the next chunk with the tail of this one"""
+        next_chunk = _ChunkBuilder()
+        if overlap_size > 0:
+            tail = "\n".join(self.parts)[-overlap_size:]
+            next_chunk.add(tail, self.source, None, None, is_content=False)
+        return next_chunk
@@ -1,10 +1,39 @@
-from langchain_community.document_loaders import PyPDFLoader
-from langchain_unstructured import UnstructuredLoader
+import os
+import re
+import tempfile
+import unicodedata
+
+import pymupdf
 from langchain_core.documents import Document
 
+# Thresholds used by the adaptive parser to decide if a page's text layer can be trusted
+MIN_PAGE_CHARACTERS = 20  # Pages with less text are most likely scanned or pure images
+MAX_GARBLED_RATIO = 0.05  # Share of replacement, private-use and control characters (broken font encodings)
+MAX_IMAGE_COVERAGE = 0.5  # Pages mostly covered by images...
+MIN_CHARACTER_DENSITY = 0.0002  # ...with fewer characters per square point than this (~80 on a slide) have text in images
+MAX_TITLE_LENGTH = 150
+
+LIST_ITEM_PATTERN = re.compile(r"^(?:[•·●▪‣◦\-–*]|\d+[.)]|[a-z][.)])\s")
+
 class DocumentParsers:
+    @staticmethod
+    def parse_elements(parser_name, pdf_files, stats=None):
+        """Lazily yield the elements of the PDFs using the given parser ("adaptive", "unstructured", "text" or "pypdf")"""
+        if parser_name == "adaptive":
+            return DocumentParsers.adaptive_elements(pdf_files, stats=stats)
+        if parser_name == "unstructured":
+            return DocumentParsers.unstructured_elements(pdf_files)
+        if parser_name == "text":
+            return DocumentParsers.text_layer_elements(pdf_files)
+        if parser_name == "pypdf":
+            return iter(DocumentParsers.pypdf_parser(pdf_files))
+        raise ValueError(f"Unknown document parser: {parser_name}")
+
     @staticmethod
     def pypdf_parser(pdf_files):
+        # Imported on first use, the loaders pull in heavy dependencies
+        from langchain_community.document_loaders import PyPDFLoader
+
         documents = []
         for pdf_file in pdf_files:
             loader = PyPDFLoader(pdf_file)
@@ -14,7 +43,8 @@ class DocumentParsers:
                 cleaned_metadata = {
                     "source": doc.metadata.get("source", pdf_file),
                     "file_type": "pdf",
-                    "page_number": doc.metadata.get("page_number", 0)
+                    # PyPDFLoader numbers pages from 0
+                    "page_number": doc.metadata.get("page", 0) + 1
                 }
                 doc.metadata = cleaned_metadata
             documents.extend(docs)
@@ -23,23 +53,164 @@ class DocumentParsers:
     @staticmethod
     def unstructured_parser(pdf_files):
         documents = []
+        for pdf_file in pdf_files:
+            parts = [doc.page_content for doc in DocumentParsers.unstructured_elements([pdf_file])]
+
+            combined_doc = Document(
+                page_content="".join(parts),
+                metadata={
+                    "source": pdf_file,
+                    "file_type": "pdf",
+                }
+            )
+            documents.append(combined_doc)
+
+        return documents
+
+    @staticmethod
+    def unstructured_elements(pdf_files):
+        """Lazily yield the elements (titles, text, tables...) of each PDF with their page number and type"""
+        from langchain_unstructured import UnstructuredLoader
+
         for pdf_file in pdf_files:
             loader_local = UnstructuredLoader(
                 file_path=pdf_file,
                 strategy="hi_res",
             )
-            doc_local = ""
             for doc in loader_local.lazy_load():
-                doc_local += doc.page_content
-                print(f"Loaded document: {doc.metadata['source']}, Page: {doc.metadata.get('page_number', 0)}")
+                page_number = doc.metadata.get("page_number", 0)
+                print(f"Loaded document: {doc.metadata['source']}, Page: {page_number}")
+                yield Document(
+                    page_content=doc.page_content,
+                    metadata={
+                        "source": pdf_file,
+                        "file_type": "pdf",
+                        "page_number": page_number,
+                        "category": doc.metadata.get("category", "NarrativeText"),
+                    }
+                )
 
-            combined_doc = Document(
-                page_content=doc_local,
+    @staticmethod
+    def text_layer_elements(pdf_files):
+        """Lazily yield the elements of each PDF from its text layer only (no OCR)"""
+        for pdf_file in pdf_files:
+            with pymupdf.open(pdf_file) as pdf:
+                for page in pdf:
+                    yield from DocumentParsers.page_text_elements(page, pdf_file)
+
+    @staticmethod
+    def adaptive_elements(pdf_files, stats=None):
+        """
+            Lazily yield the elements of each PDF, reading the text layer of the pages where it is
+            usable and sending only the low-quality pages (scans, image-heavy slides, garbled
+            text) to the hi_res pipeline. Elements are yielded in page order.
+            Params:
+                stats (dict): Optional dict updated with the number of pages read from the text layer and with hi_res.
+        """
+        if stats is not None:
+            stats.setdefault("text_layer_pages", 0)
+            stats.setdefault("hi_res_pages", 0)
+
+        for pdf_file in pdf_files:
+            with pymupdf.open(pdf_file) as pdf:
+                # Consecutive low-quality pages are sent to hi_res together
+                low_quality_pages = []
+                for page in pdf:
+                    quality = DocumentParsers.measure_page_quality(page)
+                    if DocumentParsers.is_low_quality(quality):
+                        low_quality_pages.append(page.number)
+                        continue
+
+                    if low_quality_pages:
+                        yield from DocumentParsers.hi_res_elements(pdf, pdf_file, low_quality_pages, stats)
+                        low_quality_pages = []
+
+                    if stats is not None:
+                        stats["text_layer_pages"] += 1
+                    yield from DocumentParsers.page_text_elements(page, pdf_file)
+
+                if low_quality_pages:
+                    yield from DocumentParsers.hi_res_elements(pdf, pdf_file, low_quality_pages, stats)
+
+    @staticmethod
+    def measure_page_quality(page):
+        """Character count and density, garbled glyph ratio and image coverage of a PDF page"""
+        text = page.get_text("text")
+        characters = [c for c in text if not c.isspace()]
+        garbled = sum(1 for c in characters if c == "\ufffd" or unicodedata.category(c) in ("Co", "Cc", "Cn"))
+
+        page_area = page.rect.width * page.rect.height or 1
+        image_area = 0
+        for image in page.get_image_info():
+            bbox = pymupdf.Rect(image["bbox"]) & page.rect
+            image_area += bbox.width * bbox.height
+
+        return {
+            "characters": len(characters),
+            "character_density": len(characters) / page_area,
+            "garbled_ratio": garbled / len(characters) if characters else 0,
+            "image_coverage": min(image_area / page_area, 1.0),
+        }
+
+    @staticmethod
+    def is_low_quality(quality):
+        if quality["characters"] < MIN_PAGE_CHARACTERS:
+            return True
+        if quality["garbled_ratio"] > MAX_GARBLED_RATIO:
+            return True
+        return quality["image_coverage"] > MAX_IMAGE_COVERAGE and quality["character_density"] < MIN_CHARACTER_DENSITY
+
+    @staticmethod
+    def page_text_elements(page, pdf_file):
+        """Yield the text blocks of a page as elements, using font sizes to detect titles"""
+        blocks = []
+        for block in page.get_text("dict")["blocks"]:
+            if block.get("type") != 0:
+                continue
+            lines = ["".join(span["text"] for span in line["spans"]) for line in block["lines"]]
+            text = "\n".join(lines).strip()
+            sizes = [span["size"] for line in block["lines"] for span in line["spans"]]
+            if text and sizes:
+                blocks.append((text, max(sizes)))
+
+        if not blocks:
+            return
+
+        largest_size = max(size for _, size in blocks)
+        has_smaller_text = any(size < largest_size for _, size in blocks)
+
+        for text, size in blocks:
+            if has_smaller_text and size == largest_size and len(text) <= MAX_TITLE_LENGTH:
+                category = "Title"
+            elif LIST_ITEM_PATTERN.match(text):
+                category = "ListItem"
+            else:
+                category = "NarrativeText"
+
+            yield Document(
+                page_content=text,
                 metadata={
                     "source": pdf_file,
                     "file_type": "pdf",
+                    "page_number": page.number + 1,
+                    "category": category,
                 }
             )
-            documents.append(combined_doc)
 
-        return documents
+    @staticmethod
+    def hi_res_elements(pdf, pdf_file, page_numbers, stats=None):
+        """Run the hi_res pipeline on a run of consecutive pages and yield their elements"""
+        if stats is not None:
+            stats["hi_res_pages"] += len(page_numbers)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            subset_path = os.path.join(tmp_dir, os.path.basename(pdf_file))
+            with pymupdf.open() as subset:
+                subset.insert_pdf(pdf, from_page=page_numbers[0], to_page=page_numbers[-1])
+                subset.save(subset_path)
+
+            for element in DocumentParsers.unstructured_elements([subset_path]):
+                # Map the page of the subset back to the page of the original PDF
+                element.metadata["page_number"] = page_numbers[0] + (element.metadata["page_number"] or 1)
+                element.metadata["source"] = pdf_file
+                yield element
@@ -0,0 +1,110 @@
+import queue
+import threading
+import time
+from collections import Counter, deque
+
+from langchain_core.embeddings import Embeddings
+
+from api.settings import EMBEDDING_BATCH_MAX_SIZE, EMBEDDING_BATCH_MAX_WAIT
+
+class _QueryRequest:
+    __slots__ = ("text", "embedding", "error", "done", "enqueued_at")
+
+    def __init__(self, text):
+        self.text = text
+        self.embedding = None
+        self.error = None
+        self.done = threading.Event()
+        self.enqueued_at = time.perf_counter()
+
+class BatcherStats:
+    """Batch size distribution and queueing delay added by the batcher"""
+    def __init__(self, window=10000):
+        self.batches = 0
+        self.queries = 0
+        self.batch_sizes = Counter()
+        self.queue_delays = deque(maxlen=window)
+        self.forward_seconds = deque(maxlen=window)
+        self.lock = threading.Lock()
+
+    def record(self, batch, started_at, finished_at):
+        with self.lock:
+            self.batches += 1
+            self.queries += len(batch)
+            self.batch_sizes[len(batch)] += 1
+            self.queue_delays.extend(started_at - request.enqueued_at for request in batch)
+            self.forward_seconds.append(finished_at - started_at)
+
+    def snapshot(self):
+        with self.lock:
+            delays = sorted(self.queue_delays)
+            forwards = sorted(self.forward_seconds)
+            return {
+                "batches": self.batches,
+                "queries": self.queries,
+                "mean_batch_size": self.queries / self.batches if self.batches else None,
+                "batch_sizes": dict(sorted(self.batch_sizes.items())),
+                "queue_delay_p50_ms": _percentile_ms(delays, 50),
+                "queue_delay_p95_ms": _percentile_ms(delays, 95),
+                "queue_delay_p99_ms": _percentile_ms(delays, 99),
+                "forward_p50_ms": _percentile_ms(forwards, 50),
+            }
+
+def _percentile_ms(ordered, percent):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))] * 1000
+
+class BatchedEmbeddings(Embeddings):
+    """
+        Wraps an embedding function so that queries embedded concurrently by different threads are
+        computed together in one forward pass. A background thread waits up to max_wait seconds after
+        the first query of a batch for more queries (at most max_batch_size), embeds them as a batch
+        and hands each caller its own vector.
+        Assumes queries and documents are embedded the same way (true for the bge models used here).
+    """
+    def __init__(self, embeddings, max_batch_size=EMBEDDING_BATCH_MAX_SIZE, max_wait=EMBEDDING_BATCH_MAX_WAIT):
+        self.embeddings = embeddings
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.stats = BatcherStats()
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name="query-embedding-batcher", daemon=True)
+        self.thread.start()
+
+    def embed_documents(self, texts):
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text):
+        request = _QueryRequest(text)
+        self.queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.embedding
+
+    def _collect_batch(self):
+        batch = [self.queue.get()]
+        deadline = batch[0].enqueued_at + self.max_wait
+        while len(batch) < self.max_batch_size:
+            try:
+                timeout = deadline - time.perf_counter()
+                batch.append(self.queue.get(timeout=timeout) if timeout > 0 else self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            started_at = time.perf_counter()
+            try:
+                embeddings = self.embeddings.embed_documents([request.text for request in batch])
+                for request, embedding in zip(batch, embeddings):
+                    request.embedding = embedding
+            except Exception as e:
+                for request in batch:
+                    request.error = e
+            self.stats.record(batch, started_at, time.perf_counter())
+            for request in batch:
+                request.done.set()
@@ -0,0 +1,87 @@
+import argparse
+import os
+import threading
+
+from api.models.startup_timer import startup_timer
+from api.settings import (EMBEDDING_BACKEND, EMBEDDING_BATCHING_ENABLED, EMBEDDING_MODEL, EMBEDDING_SNAPSHOT_PATH,
+                          ONNX_MODELS_PATH)
+
+EMBEDDING_BACKENDS = ("torch", "onnx", "onnx-int8")
+
+# Embedding models are loaded once per process and shared by every chatbot using the same backend
+_embeddings = {}
+_embeddings_lock = threading.Lock()
+# When enabled, concurrent query embeddings are computed in batches (see enable_query_batching)
+_batch_queries = EMBEDDING_BATCHING_ENABLED
+
+def enable_query_batching():
+    """Batch concurrent query embeddings of the models loaded from now on"""
+    global _batch_queries
+    _batch_queries = True
+
+def get_snapshot_path(model_name):
+    return os.path.join(EMBEDDING_SNAPSHOT_PATH, model_name.replace("/", "__"))
+
+def get_model_source(model_name):
+    """Local snapshot of the model if one was saved, otherwise the model name (resolved on the Hub)"""
+    snapshot_path = get_snapshot_path(model_name)
+    return snapshot_path if os.path.isdir(snapshot_path) else model_name
+
+def save_snapshot(model_name=EMBEDDING_MODEL):
+    """Save the model (weights, tokenizer and pooling configuration) to the local snapshot folder"""
+    from sentence_transformers import SentenceTransformer
+
+    snapshot_path = get_snapshot_path(model_name)
+    SentenceTransformer(model_name, device="cpu").save(snapshot_path)
+    return snapshot_path
+
+def create_embeddings(backend, model_name=EMBEDDING_MODEL):
+    model_source = get_model_source(model_name)
+    if backend == "torch":
+        from langchain_huggingface import HuggingFaceEmbeddings
+
+        return HuggingFaceEmbeddings(
+            model_name=model_source, model_kwargs={"device": "cpu"}, encode_kwargs={"normalize_embeddings": True}
+        )
+    if backend in ("onnx", "onnx-int8"):
+        from components.onnx_embeddings import OnnxEmbeddings
+
+        return OnnxEmbeddings(model_name, models_path=ONNX_MODELS_PATH, quantize=backend == "onnx-int8", model_source=model_source)
+    raise ValueError(f"Unknown embedding backend: {backend}. Available backends: {', '.join(EMBEDDING_BACKENDS)}")
+
+def get_embeddings(backend=EMBEDDING_BACKEND, model_name=EMBEDDING_MODEL):
+    """Return the shared embedding function for a backend ("torch", "onnx" or "onnx-int8")"""
+    key = (backend or EMBEDDING_BACKEND, model_name)
+    with _embeddings_lock:
+        if key not in _embeddings:
+            with startup_timer.phase(f"load embedding model ({key[0]})"):
+                embeddings = create_embeddings(*key)
+            if _batch_queries:
+                from components.embedding_batcher import BatchedEmbeddings
+
+                embeddings = BatchedEmbeddings(embeddings)
+            _embeddings[key] = embeddings
+        return _embeddings[key]
+
+def get_embedding_stats():
+    """Batching statistics of the loaded embedding models that batch their queries"""
+    with _embeddings_lock:
+        loaded = dict(_embeddings)
+    return {
+        f"{backend}:{model_name}": embeddings.stats.snapshot()
+        for (backend, model_name), embeddings in loaded.items() if hasattr(embeddings, "stats")
+    }
+
+if __name__ == "__main__":
+    # Prepare the local model files ahead of deployment, e.g. in the image build:
+    #     python -m components.embeddings --backends torch onnx-int8
+    parser = argparse.ArgumentParser(description="Save local snapshots of the embedding model")
+    parser.add_argument("--model", default=EMBEDDING_MODEL)
+    parser.add_argument("--backends", nargs="+", default=[EMBEDDING_BACKEND], choices=EMBEDDING_BACKENDS)
+    args = parser.parse_args()
+
+    print(f"Saved snapshot of {args.model} to {save_snapshot(args.model)}")
+    for backend in args.backends:
+        # Loading an ONNX backend exports (and quantises) the model if needed
+        create_embeddings(backend, args.model).embed_query("warm up")
+        print(f"Prepared the {backend} backend")
@@ -0,0 +1,310 @@
+import logging
+import queue
+import threading
+import time
+from collections import deque
+
+from api.settings import (LLM_CIRCUIT_FAILURE_THRESHOLD, LLM_CIRCUIT_RESET_TIMEOUT, LLM_HEDGE_INVOKE_AFTER,
+                          LLM_HEDGE_TTFT_DEADLINE)
+
+logger = logging.getLogger(__name__)
+
+# Events sent by attempts to the router
+_CHUNK, _DONE, _ERROR = "chunk", "done", "error"
+
+def is_retryable_error(error):
+    """Rate limits, server errors, timeouts and connection errors are worth retrying on another provider"""
+    status_code = getattr(error, "status_code", None)
+    if status_code is None:
+        status_code = getattr(getattr(error, "response", None), "status_code", None)
+    if status_code is not None:
+        return status_code == 429 or status_code >= 500
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    name = type(error).__name__
+    return "Timeout" in name or "Connection" in name
+
+class CircuitBreaker:
+    """
+        Stops sending requests to a provider after failure_threshold consecutive failures.
+        After reset_timeout seconds a single trial request is let through (half-open): it
+        closes the circuit if it succeeds and opens it again if it fails.
+    """
+    def __init__(self, failure_threshold=LLM_CIRCUIT_FAILURE_THRESHOLD, reset_timeout=LLM_CIRCUIT_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def acquire(self):
+        """Returns (allowed, is_trial), is_trial when the request is the single half-open trial"""
+        with self.lock:
+            state = self.state
+            if state == "closed":
+                return True, False
+            if state == "half-open" and not self.trial_running:
+                self.trial_running = True
+                return True, True
+            return False, False
+
+    def release_trial(self):
+        """The trial ended without telling whether the provider works (cancelled or a non-retryable error), let another one through"""
+        with self.lock:
+            self.trial_running = False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_running = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+class ProviderStats:
+    """Request counts and recent latencies of a provider"""
+    def __init__(self, window=1000):
+        self.requests = 0
+        self.failures = 0
+        self.cancelled = 0
+        self.hedges = 0
+        self.hedges_won = 0
+        self.ttfts = deque(maxlen=window)
+        self.latencies = deque(maxlen=window)
+        self.lock = threading.Lock()
+
+    def record(self, **counts):
+        with self.lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def record_latency(self, ttft=None, latency=None):
+        with self.lock:
+            if ttft is not None:
+                self.ttfts.append(ttft)
+            if latency is not None:
+                self.latencies.append(latency)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "failures": self.failures,
+                "failure_rate": self.failures / self.requests if self.requests else 0.0,
+                "cancelled": self.cancelled,
+                "hedges": self.hedges,
+                "hedges_won": self.hedges_won,
+                "ttft_p50": _percentile(self.ttfts, 50),
+                "ttft_p95": _percentile(self.ttfts, 95),
+                "latency_p50": _percentile(self.latencies, 50),
+                "latency_p95": _percentile(self.latencies, 95),
+            }
+
+def _percentile(values, percent):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+class ProviderHealth:
+    """Circuit breakers and statistics per provider, shared by every chatbot of the process"""
+    def __init__(self):
+        self.breakers = {}
+        self.stats = {}
+        self.lock = threading.Lock()
+
+    def get(self, provider_name):
+        with self.lock:
+            if provider_name not in self.breakers:
+                self.breakers[provider_name] = CircuitBreaker()
+                self.stats[provider_name] = ProviderStats()
+            return self.breakers[provider_name], self.stats[provider_name]
+
+    def snapshot(self):
+        with self.lock:
+            names = list(self.stats)
+        report = {}
+        for name in names:
+            breaker, stats = self.get(name)
+            report[name] = dict(stats.snapshot(), circuit=breaker.state)
+        return report
+
+provider_health = ProviderHealth()
+
+class _Attempt:
+    """A request to one provider, run in a background thread that reports events to the router"""
+    def __init__(self, name, llm, messages, events, streaming, is_hedge=False, is_trial=False, kwargs=None):
+        self.name = name
+        self.llm = llm
+        self.messages = messages
+        self.events = events
+        self.streaming = streaming
+        self.is_hedge = is_hedge
+        self.is_trial = is_trial
+        self.kwargs = kwargs or {}
+        self.breaker, self.stats = provider_health.get(name)
+        self.cancelled = threading.Event()
+        self.started_at = time.monotonic()
+        self.thread = threading.Thread(target=self._run, name=f"llm-{name}", daemon=True)
+
+    def start(self):
+        self.stats.record(requests=1, hedges=1 if self.is_hedge else 0)
+        self.thread.start()
+
+    def cancel(self):
+        if not self.cancelled.is_set():
+            self.cancelled.set()
+            self.stats.record(cancelled=1)
+
+    def _run(self):
+        resolved = False
+        try:
+            resolved = self._request()
+        finally:
+            if self.is_trial and not resolved:
+                self.breaker.release_trial()
+
+    def _request(self):
+        """Returns True if the outcome was recorded in the circuit breaker"""
+        ttft = None
+        try:
+            if self.streaming:
+                for chunk in self.llm.stream(self.messages, **self.kwargs):
+                    if self.cancelled.is_set():
+                        return False
+                    if ttft is None:
+                        ttft = time.monotonic() - self.started_at
+                    self.events.put((self, _CHUNK, chunk))
+                self.events.put((self, _DONE, None))
+            else:
+                result = self.llm.invoke(self.messages, **self.kwargs)
+                ttft = time.monotonic() - self.started_at
+                self.events.put((self, _DONE, result))
+        except Exception as e:
+            if self.cancelled.is_set():
+                return False
+            self.stats.record(failures=1)
+            retryable = is_retryable_error(e)
+            if retryable:
+                self.breaker.record_failure()
+            self.events.put((self, _ERROR, e))
+            return retryable
+
+        if self.cancelled.is_set():
+            return False
+        self.breaker.record_success()
+        self.stats.record_latency(ttft=ttft, latency=time.monotonic() - self.started_at)
+        return True
+
+class LLMRouter:
+    """
+        Chat model wrapper spreading requests over an ordered list of providers (name, chat model).
+        Providers whose circuit breaker is open are skipped and a request that fails with a rate limit,
+        server error or timeout is sent to the next provider. When a streamed response has not produced
+        its first token after hedge_after seconds, the request is also sent to the next provider and the
+        first one to answer wins, the other is cancelled.
+    """
+    def __init__(self, providers, hedge_after=LLM_HEDGE_TTFT_DEADLINE, hedge_invoke_after=LLM_HEDGE_INVOKE_AFTER):
+        self.providers = providers
+        self.hedge_after = hedge_after
+        self.hedge_invoke_after = hedge_invoke_after
+
+    def bind_tools(self, tools, **kwargs):
+        return LLMRouter(
+            [(name, llm.bind_tools(tools, **kwargs)) for name, llm in self.providers],
+            hedge_after=self.hedge_after,
+            hedge_invoke_after=self.hedge_invoke_after,
+        )
+
+    def invoke(self, messages, **kwargs):
+        for kind, payload in self._route(messages, False, self.hedge_invoke_after, kwargs):
+            return payload
+
+    def stream(self, messages, **kwargs):
+        for kind, payload in self._route(messages, True, self.hedge_after, kwargs):
+            if kind == _CHUNK:
+                yield payload
+
+    def _route(self, messages, streaming, hedge_after, kwargs):
+        events = queue.Queue()
+        remaining = list(self.providers)
+        running = []
+        winner = None
+        hedged = False
+
+        def launch(is_hedge=False):
+            """Start a request on the next provider whose circuit is closed, returns False if there is none"""
+            while remaining:
+                name, llm = remaining.pop(0)
+                allowed, is_trial = provider_health.get(name)[0].acquire()
+                if allowed:
+                    attempt = _Attempt(name, llm, messages, events, streaming, is_hedge=is_hedge, is_trial=is_trial, kwargs=kwargs)
+                    running.append(attempt)
+                    attempt.start()
+                    return True
+            return False
+
+        def choose(attempt):
+            for other in running:
+                if other is not attempt:
+                    other.cancel()
+            if attempt.is_hedge:
+                attempt.stats.record(hedges_won=1)
+                logger.info(f"Hedged request to {attempt.name} answered first")
+            return attempt
+
+        if not launch():
+            # With every circuit open, try the first provider anyway rather than failing straight away
+            name, llm = self.providers[0]
+            attempt = _Attempt(name, llm, messages, events, streaming, kwargs=kwargs)
+            running.append(attempt)
+            attempt.start()
+        try:
+            while True:
+                timeout = None
+                if winner is None and not hedged and remaining and hedge_after is not None:
+                    timeout = max(0.0, running[0].started_at + hedge_after - time.monotonic())
+                try:
+                    attempt, kind, payload = events.get(timeout=timeout)
+                except queue.Empty:
+                    # No answer before the deadline, race the next provider
+                    hedged = True
+                    launch(is_hedge=True)
+                    continue
+
+                if attempt.cancelled.is_set() or (winner is not None and attempt is not winner):
+                    continue
+
+                if kind == _ERROR:
+                    if attempt is winner:
+                        # Part of the answer was already sent, it cannot be resumed elsewhere
+                        raise payload
+                    running.remove(attempt)
+                    logger.warning(f"LLM provider {attempt.name} failed: {payload}")
+                    if not (is_retryable_error(payload) and launch()) and not running:
+                        raise payload
+                    continue
+
+                if winner is None:
+                    winner = choose(attempt)
+                yield kind, payload
+                if kind == _DONE:
+                    return
+        finally:
+            for attempt in running:
+                if attempt is not winner:
+                    attempt.cancel()
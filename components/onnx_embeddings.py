@@ -0,0 +1,98 @@
+import logging
+import os
+
+import numpy as np
+import onnxruntime as ort
+from langchain_core.embeddings import Embeddings
+from transformers import AutoTokenizer
+
+logger = logging.getLogger(__name__)
+
+class OnnxEmbeddings(Embeddings):
+    """
+        Sentence embeddings computed with onnxruntime instead of PyTorch. The model is exported to
+        ONNX on first use (and optionally quantised to int8 weights) and cached on disk.
+        Uses CLS pooling and L2 normalisation, like the bge models loaded by HuggingFaceEmbeddings.
+    """
+    def __init__(self, model_name, models_path, quantize=False, batch_size=32, max_length=512, model_source=None):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.max_length = max_length
+        # model_source is a local snapshot of the model, if any, used instead of downloading it
+        model_source = model_source or model_name
+        self.tokenizer = AutoTokenizer.from_pretrained(model_source)
+
+        model_path = self.get_model_path(model_name, models_path, quantize, model_source)
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+
+    @staticmethod
+    def get_model_path(model_name, models_path, quantize, model_source=None):
+        """Return the path of the ONNX model, exporting and quantising it if needed"""
+        model_dir = os.path.join(models_path, model_name.replace("/", "__"))
+        fp32_path = os.path.join(model_dir, "model.onnx")
+        int8_path = os.path.join(model_dir, "model-int8.onnx")
+
+        if not os.path.exists(fp32_path):
+            OnnxEmbeddings.export_model(model_source or model_name, fp32_path)
+        if not quantize:
+            return fp32_path
+
+        if not os.path.exists(int8_path):
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+
+            logger.info(f"Quantising {fp32_path} to int8")
+            # Quantise to a temporary file first so an interrupted quantisation is not picked up later
+            tmp_path = int8_path + ".tmp"
+            quantize_dynamic(fp32_path, tmp_path, weight_type=QuantType.QInt8)
+            os.replace(tmp_path, int8_path)
+        return int8_path
+
+    @staticmethod
+    def export_model(model_name, output_path):
+        import torch
+        from transformers import AutoModel
+
+        logger.info(f"Exporting {model_name} to ONNX at {output_path}")
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model = AutoModel.from_pretrained(model_name)
+        model.eval()
+
+        sample = tokenizer(["export sample"], return_tensors="pt")
+        input_names = list(sample.keys())
+        dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+        dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+
+        # Export to a temporary file first so an interrupted export is not picked up later
+        tmp_path = output_path + ".tmp"
+        with torch.no_grad():
+            torch.onnx.export(
+                model,
+                tuple(sample[name] for name in input_names),
+                tmp_path,
+                input_names=input_names,
+                output_names=["last_hidden_state"],
+                dynamic_axes=dynamic_axes,
+                opset_version=17,
+            )
+        os.replace(tmp_path, output_path)
+
+    def embed(self, texts):
+        inputs = self.tokenizer(texts, padding=True, truncation=True, max_length=self.max_length, return_tensors="np")
+        feed = {name: value.astype(np.int64) for name, value in inputs.items() if name in self.input_names}
+        last_hidden_state = self.session.run(["last_hidden_state"], feed)[0]
+        embeddings = last_hidden_state[:, 0]
+        embeddings = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings.tolist()
+
+    def embed_documents(self, texts):
+        embeddings = []
+        for start in range(0, len(texts), self.batch_size):
+            embeddings.extend(self.embed(texts[start:start + self.batch_size]))
+        return embeddings
+
+    def embed_query(self, text):
+        return self.embed([text])[0]
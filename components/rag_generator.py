@@ -2,35 +2,62 @@ import asyncio
 import threading
 import queue
 
-from langchain_ollama import ChatOllama
-
-from components.chat_open_router import ChatOpenRouter
+from api.settings import LLM_FALLBACK_MODEL, LLM_FALLBACK_USE_OLLAMA
+from components.chat_stub import ChatStub, is_stub_model
+from components.llm_router import LLMRouter
 from components.tools import output_email_button, output_context_reference
 
 class RagGenerator:
-    def __init__(self, model, temperature, num_predict, use_ollama=False):
+    def __init__(self, model, temperature, num_predict, use_ollama=False, documents_url=None):
         self.tools = [output_email_button, output_context_reference]
+        self.documents_url = documents_url
+        # Used to share concurrency limits and statistics between chatbots using the same provider
+        self.provider_name = self.get_provider_name(model, use_ollama)
+        self.llm = self.create_llm(model, temperature, num_predict, use_ollama)
+
+        if LLM_FALLBACK_MODEL and (LLM_FALLBACK_MODEL, bool(LLM_FALLBACK_USE_OLLAMA)) != (model, bool(use_ollama)):
+            # Route to the fallback model when the chatbot's model is slow, rate limited or failing
+            fallback_llm = self.create_llm(LLM_FALLBACK_MODEL, temperature, num_predict, LLM_FALLBACK_USE_OLLAMA)
+            self.llm = LLMRouter([
+                (self.provider_name, self.llm),
+                (self.get_provider_name(LLM_FALLBACK_MODEL, LLM_FALLBACK_USE_OLLAMA), fallback_llm),
+            ])
+
+        # Tool LLM with tools for tool calling
+        self.tool_llm = self.llm.bind_tools(self.tools)
+
+    @staticmethod
+    def create_llm(model, temperature, num_predict, use_ollama):
+        if is_stub_model(model):
+            # Local fake model for load and latency testing, no provider involved
+            return ChatStub.from_model_name(model, max_tokens=num_predict)
         if use_ollama:
-            self.llm = ChatOllama(
+            from langchain_ollama import ChatOllama
+
+            return ChatOllama(
                 model=model,
                 temperature=temperature,
-            num_predict=num_predict,
-        )
-        else:
-            self.llm = ChatOpenRouter(
-                model_name=model,
-                temperature=temperature,
-                max_tokens=num_predict,
+                num_predict=num_predict,
             )
+        from components.chat_open_router import ChatOpenRouter
 
-        # Tool LLM with tools for tool calling
-        self.tool_llm = self.llm.bind_tools(self.tools)
+        return ChatOpenRouter(
+            model_name=model,
+            temperature=temperature,
+            max_tokens=num_predict,
+        )
+
+    @staticmethod
+    def get_provider_name(model, use_ollama):
+        if is_stub_model(model):
+            return model
+        return f"{'ollama' if use_ollama else 'openrouter'}:{model}"
 
-    def invoke(self, prompt, async_mode=False):
+    def invoke(self, prompt, async_mode=False, source_pages=None):
         # Create a queue to communicate between threads
         tool_result_queue = queue.Queue()
         
-        t1 = threading.Thread(target=self.check_tool_calling, args=(prompt, tool_result_queue))
+        t1 = threading.Thread(target=self.check_tool_calling, args=(prompt, tool_result_queue, source_pages))
         t1.start()
 
         response = self.llm.invoke(prompt).content
@@ -49,11 +76,11 @@ class RagGenerator:
 
         return response
     
-    def stream(self, prompt):
+    def stream(self, prompt, source_pages=None):
         # Create a queue to communicate between threads
         tool_result_queue = queue.Queue()
         
-        t1 = threading.Thread(target=self.check_tool_calling, args=(prompt, tool_result_queue))
+        t1 = threading.Thread(target=self.check_tool_calling, args=(prompt, tool_result_queue, source_pages))
         t1.start()
 
         full_response = ""
@@ -79,7 +106,7 @@ class RagGenerator:
 
         return stream_generator()
     
-    def check_tool_calling(self, prompt, result_queue):
+    def check_tool_calling(self, prompt, result_queue, source_pages=None):
         # After the main response, check if tools should be called
         try:
             tool_response = self.tool_llm.invoke(prompt)
@@ -107,6 +134,9 @@ class RagGenerator:
                                 print(f"Skipping tool call with schema-only args: {args}")
                                 result_queue.put(None)
                                 return
+                        # Not part of the schema the model sees
+                        args['documents_url'] = self.documents_url
+                        args['source_pages'] = source_pages
                         tool_result = output_context_reference.invoke(args)
                         result_queue.put(tool_result)
                         return
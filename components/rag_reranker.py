@@ -0,0 +1,82 @@
+import hashlib
+import logging
+import threading
+import time
+
+from cachetools import LRUCache
+
+from api.settings import RERANKER_CACHE_SIZE, RERANKER_LATENCY_BUDGET, RERANKER_MODEL, RERANKER_SKIP_DECAY
+
+logger = logging.getLogger(__name__)
+
+# Cross-encoder models are shared by every chatbot using the same model
+_models = {}
+_models_lock = threading.Lock()
+
+def get_cross_encoder(model_name):
+    with _models_lock:
+        if model_name not in _models:
+            from sentence_transformers import CrossEncoder
+
+            model = CrossEncoder(model_name, device="cpu")
+            # The first forward pass is much slower, keep it out of the latency estimate
+            model.predict([("warm up", "warm up")], show_progress_bar=False)
+            _models[model_name] = model
+        return _models[model_name]
+
+class RagReranker:
+    """
+        Reorders retrieved chunks with a local cross-encoder. All the (query, chunk) pairs of a
+        query are scored in a single batched forward pass, scores are cached, and reranking is
+        skipped when it is expected to exceed the latency budget.
+    """
+    def __init__(self, model_name=RERANKER_MODEL, latency_budget=RERANKER_LATENCY_BUDGET, cache_size=RERANKER_CACHE_SIZE):
+        self.model = get_cross_encoder(model_name)
+        self.latency_budget = latency_budget
+        self.score_cache = LRUCache(maxsize=cache_size)
+        self.cache_lock = threading.Lock()
+        # Moving average of the time needed to score one pair, used to predict the cost of a batch
+        self.seconds_per_pair = None
+
+    def get_chunk_key(self, doc):
+        return doc.metadata.get("pk") or hashlib.sha256(doc.page_content.encode()).hexdigest()
+
+    def estimate_latency(self, pair_count):
+        if self.seconds_per_pair is None:
+            return 0
+        return self.seconds_per_pair * pair_count
+
+    def rerank(self, query, docs, k):
+        """
+            Return the k most relevant docs ordered by cross-encoder score,
+            or None if scoring them would exceed the latency budget.
+        """
+        keys = [(query, self.get_chunk_key(doc)) for doc in docs]
+        with self.cache_lock:
+            scores = [self.score_cache.get(key) for key in keys]
+        missing = [i for i, score in enumerate(scores) if score is None]
+
+        if missing:
+            if self.estimate_latency(len(missing)) > self.latency_budget:
+                logger.info(f"Skipping rerank of {len(missing)} chunks, expected to exceed the {self.latency_budget}s budget")
+                # The estimate only changes when a rerank runs, decay it so one will run again and measure
+                self.seconds_per_pair *= RERANKER_SKIP_DECAY
+                return None
+
+            start = time.perf_counter()
+            pairs = [(query, docs[i].page_content) for i in missing]
+            predictions = self.model.predict(pairs, batch_size=len(pairs), show_progress_bar=False)
+            elapsed = time.perf_counter() - start
+
+            per_pair = elapsed / len(pairs)
+            self.seconds_per_pair = per_pair if self.seconds_per_pair is None else 0.8 * self.seconds_per_pair + 0.2 * per_pair
+
+            with self.cache_lock:
+                for i, score in zip(missing, predictions):
+                    scores[i] = float(score)
+                    self.score_cache[keys[i]] = scores[i]
+
+        ranked = sorted(zip(docs, scores), key=lambda pair: pair[1], reverse=True)[:k]
+        for doc, score in ranked:
+            doc.metadata["rerank_score"] = score
+        return [doc for doc, _ in ranked]
@@ -1,133 +1,315 @@
 from glob import glob
+import hashlib
 import logging
 import os
-from uuid import uuid4
+from uuid import NAMESPACE_URL, uuid5
 from flask import current_app as app
-from langchain_milvus import BM25BuiltInFunction, Milvus
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from api.controllers.document_chunk_controller import DocumentChunkController
+from api.settings import DOCUMENT_PARSER, EMBEDDING_BACKEND, RERANKER_CANDIDATES, VECTOR_DB_SHARED_COLLECTION
+from components.document_chunker import StreamingChunker
 from components.document_parsers import DocumentParsers
+from components.embeddings import get_embeddings
+
+# Chunks are content-addressed: identical source files chunked with the same settings share
+# the same chunk ids, so they are embedded and stored once per vector store
+CONTENT_HASH_FIELD = "content_hash"
+PRIMARY_FIELD = "pk"
+
+# Build and search parameters of the supported dense index types (Milvus Lite only supports FLAT and IVF_FLAT)
+DENSE_INDEX_PARAMS = {
+    "FLAT": ({}, {}),
+    "IVF_FLAT": ({"nlist": 128}, {"nprobe": 16}),
+    "HNSW": ({"M": 16, "efConstruction": 200}, {"ef": 64}),
+    "AUTOINDEX": ({}, {}),
+}
 
 class RagRetriever:
-    def __init__(self, chatbot_id=None, vector_db_path=None, documents_path=None):
+    def __init__(self, chatbot_id=None, vector_db_path=None, documents_path=None, multi_tenant=False, parser_name=DOCUMENT_PARSER, load_documents=True,
+                 reranker=None, rerank_candidates=RERANKER_CANDIDATES, embedding_backend=EMBEDDING_BACKEND,
+                 chunk_size=1200, chunk_overlap=120, dense_index_type="FLAT", ranker_type="rrf", ranker_params=None):
         self.chatbot_id = chatbot_id
+        # Optional RagReranker reordering a larger pool of rerank_candidates chunks
+        self.reranker = reranker
+        self.rerank_candidates = rerank_candidates
+        # In multi-tenant mode every chatbot shares one collection and each chatbot only
+        # sees the chunks of the documents it references in document_chunks
+        self.multi_tenant = multi_tenant
+        if multi_tenant and chatbot_id is None:
+            raise ValueError("A chatbot_id is required to use a multi-tenant vector store")
         # Suppress verbose logging
         logging.getLogger("unstructured").setLevel(logging.WARNING)
         os.environ["GRPC_VERBOSITY"] = "ERROR"
-        model_name = "BAAI/bge-base-en-v1.5"
-        model_kwargs = {"device": "cpu"}
-        encode_kwargs = {"normalize_embeddings": True}
-        self.embeddings_function = HuggingFaceEmbeddings(
-            model_name=model_name, model_kwargs=model_kwargs, encode_kwargs=encode_kwargs
-        )
-        self.chunk_size = 1200
-        self.chunk_overlap = 120
+        # The embedding model is shared by every retriever using the same backend
+        self.embedding_backend = embedding_backend
+        self.embeddings_function = get_embeddings(embedding_backend)
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        # How the dense and BM25 results are fused: "rrf", or "weighted" with ranker_params={"weights": [dense, sparse]}
+        self.ranker_type = ranker_type
+        self.ranker_params = ranker_params
+        self.parser_name = parser_name
+        self.chunker = StreamingChunker(chunk_size=self.chunk_size, chunk_overlap=self.chunk_overlap)
+        # Number of chunks embedded and inserted at once while ingesting
+        self.ingest_batch_size = 64
 
         if vector_db_path is None:
             project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
             vector_db_path = os.path.join(project_root, "rag_milvus.db")
 
+        self.vector_db_path = vector_db_path
+        self.content_hashes = set()
+        # Page of each chunk of this chatbot, so citations can link to it without parsing the document
+        self.page_index = {}
+        if chatbot_id is not None:
+            self.refresh_content_hashes()
+
         URI = vector_db_path
         parse_documents = False
 
         if not os.path.exists(vector_db_path):
             parse_documents = True
 
+        if dense_index_type not in DENSE_INDEX_PARAMS:
+            raise ValueError(f"Unknown dense index type: {dense_index_type}. Available types: {', '.join(DENSE_INDEX_PARAMS)}")
+        index_params, search_params = DENSE_INDEX_PARAMS[dense_index_type]
+
+        tenant_kwargs = {}
+        if self.multi_tenant:
+            tenant_kwargs["collection_name"] = VECTOR_DB_SHARED_COLLECTION
+            # Milvus Lite (local .db files) has no partition key support, there the
+            # content_hash scalar field and its index are used to filter searches
+            if not URI.endswith(".db"):
+                tenant_kwargs["partition_key_field"] = CONTENT_HASH_FIELD
+            if not parse_documents:
+                parse_documents = len(self.content_hashes) == 0
+
+        from langchain_milvus import BM25BuiltInFunction, Milvus
+
         self.vector_store = Milvus(
             embedding_function=self.embeddings_function,
             connection_args={"uri": URI},
             builtin_function=BM25BuiltInFunction(),
             vector_field=["dense", "sparse"],
             index_params=[
-                {"index_type": "FLAT", "metric_type": "COSINE"},  # for dense vectors
+                {"index_type": dense_index_type, "metric_type": "COSINE", "params": index_params},  # for dense vectors
                 {"index_type": "SPARSE_INVERTED_INDEX", "metric_type": "IP"}  # for sparse vectors (BM25)
             ],
+            search_params=[
+                {"metric_type": "COSINE", "params": search_params},
+                {"metric_type": "IP", "params": {}}
+            ] if search_params else None,
             consistency_level="Bounded",
             drop_old=False,
+            **tenant_kwargs,
         )
 
-        if parse_documents:
+        if parse_documents and load_documents:
             if documents_path is None:
                 documents_path = "./documents/"
             self.save_pdf_documents_at_path(documents_path)
 
+    def configure_reranker(self, use_reranker, rerank_candidates=RERANKER_CANDIDATES):
+        """Enable or disable the cross-encoder rerank stage"""
+        if bool(use_reranker) != (self.reranker is not None):
+            if use_reranker:
+                from components.rag_reranker import RagReranker
+
+                self.reranker = RagReranker()
+            else:
+                self.reranker = None
+        self.rerank_candidates = rerank_candidates or RERANKER_CANDIDATES
+
     def process_documents(self, documents):
-        """Process documents for text extraction"""
-        text_documents = DocumentParsers.unstructured_parser(documents)
-        return text_documents
-
-    def chunk_documents(self, documents):
-        """Chunk documents for storage in Milvus"""
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=self.chunk_size,
-            chunk_overlap=self.chunk_overlap,
-            length_function=len,
-        )
-        chunks = text_splitter.split_documents(documents)
+        """Lazily extract the elements of the documents"""
+        return DocumentParsers.parse_elements(self.parser_name, documents)
 
-        # Ensure chunk metadata for tracking
-        for chunk in chunks:
-            if 'source' not in chunk.metadata:
-                chunk.metadata['source'] = 'unknown'
+    def chunk_documents(self, elements):
+        """Lazily chunk document elements for storage in Milvus, keeping page numbers and element types"""
+        return self.chunker.chunk(elements)
 
-        return chunks
+    def compute_content_hash(self, file_path):
+        """Hash of a file's contents and of the settings used to parse and chunk it"""
+        digest = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+        digest.update(f"{self.parser_name}:{self.chunk_size}:{self.chunk_overlap}".encode())
+        return digest.hexdigest()
 
-    def generate_unique_uuids(self, document_count):
-        """Generate unique UUIDs that don't already exist in the vector store"""
+    def generate_chunk_uuid(self, content_hash, chunk_index):
+        """Deterministic chunk id, namespaced by the vector store so reference counts are per store"""
+        return str(uuid5(NAMESPACE_URL, f"{self.vector_db_path}#{content_hash}#{chunk_index}"))
+
+    def get_store_chunk_uuids(self, content_hash, known_uuids):
+        """
+            Ids of the chunks of a content in this vector store, among known_uuids (the ids recorded
+            for that content in every store). Chunk ids are consecutive from index 0 for each store.
+        """
         uuids = []
-        max_attempts = 3
-
-        for _ in range(document_count):
-            attempts = 0
-            while attempts < max_attempts:
-                new_uuid = str(uuid4())
-                try:
-                    # Check if the UUID already exists
-                    existing = self.vector_store.get(ids=[new_uuid])
-                    if not existing or len(existing) == 0:
-                        # UUID doesn't exist, we can use it
-                        uuids.append(new_uuid)
-                        break
-                except Exception:
-                    uuids.append(new_uuid)
-                    break
-                attempts += 1
+        while (uuid := self.generate_chunk_uuid(content_hash, len(uuids))) in known_uuids:
+            uuids.append(uuid)
         return uuids
 
+    def get_existing_chunk_uuids(self, uuids, batch_size=500):
+        """Return the subset of uuids already stored in the vector store"""
+        existing = set()
+        for start in range(0, len(uuids), batch_size):
+            batch = uuids[start:start + batch_size]
+            pks = self.vector_store.get_pks(f"{PRIMARY_FIELD} in {batch}")
+            existing.update(pks or [])
+        return existing
+
     def save_documents(self, documents):
         """Save and index a list of documents into the vector store.
+            Documents whose content was already chunked into this vector store (e.g. by another
+            chatbot using the same documents) are not parsed or embedded again, their existing
+            chunks are referenced instead.
             Params:
                 documents (list): A list of document paths to be saved.
         """
-        text_documents = self.process_documents(documents)
-        chunks = self.chunk_documents(text_documents)
+        documents_to_parse = {}
+        document_chunks = []
+
+        for document in documents:
+            content_hash = self.compute_content_hash(document)
+            if self.chatbot_id is not None and DocumentChunkController.has_content_hash(self.chatbot_id, content_hash):
+                # Already indexed for this chatbot
+                continue
+
+            page_numbers = DocumentChunkController.get_page_numbers_by_content_hash(content_hash)
+            uuids = self.get_store_chunk_uuids(content_hash, page_numbers)
+            if uuids and len(self.get_existing_chunk_uuids(uuids)) == len(uuids):
+                document_chunks.extend((self.chatbot_id, document, uuid, content_hash, page_numbers[uuid]) for uuid in uuids)
+            else:
+                documents_to_parse[document] = content_hash
 
-        # Save to vector store with unique UUIDs
-        uuids = self.generate_unique_uuids(len(chunks))
-        
-        for chunk, uuid in zip(chunks, uuids):
-            DocumentChunkController.create_document_chunk(self.chatbot_id, document_name=chunk.metadata['source'], uuid=uuid)
+        reused_count = len(document_chunks)
+        indexed_count = 0
 
-        # Add documents to vector store
-        self.vector_store.add_documents(chunks, ids=uuids)
-        print(f"Loaded and indexed {len(chunks)} document chunks")
+        if documents_to_parse:
+            # Chunks are streamed from the parser and indexed in small batches,
+            # so only a batch of chunks is held in memory regardless of the document size
+            chunks = self.chunk_documents(self.process_documents(list(documents_to_parse)))
+            chunk_indexes = {}
+            batch = []
+            for chunk in chunks:
+                source = chunk.metadata['source']
+                content_hash = documents_to_parse.get(source)
+                if content_hash is None:
+                    # Chunk ids and reference counts are per document, a chunk must belong to one of them
+                    raise ValueError(f"Parser returned a chunk from {source}, which is not one of the documents being saved")
+                chunk_index = chunk_indexes.get(content_hash, 0)
+                chunk_indexes[content_hash] = chunk_index + 1
+
+                chunk.metadata[CONTENT_HASH_FIELD] = content_hash
+                uuid = self.generate_chunk_uuid(content_hash, chunk_index)
+                document_chunks.append((self.chatbot_id, source, uuid, content_hash, chunk.metadata.get("page_number")))
+                batch.append((chunk, uuid))
+
+                if len(batch) >= self.ingest_batch_size:
+                    indexed_count += self.index_chunks(batch)
+                    batch = []
+
+            if batch:
+                indexed_count += self.index_chunks(batch)
+
+            if indexed_count and self.multi_tenant:
+                self.create_tenant_index()
+
+        DocumentChunkController.create_document_chunks(document_chunks)
+        self.refresh_content_hashes()
+        print(f"Loaded and indexed {indexed_count} document chunks, reused {reused_count} existing chunks")
+
+    def index_chunks(self, batch):
+        """Embed and insert a batch of (chunk, uuid) pairs, returns the number of chunks inserted"""
+        # Skip chunks left over from a previous, interrupted ingestion of the same content
+        existing = self.get_existing_chunk_uuids([uuid for _, uuid in batch])
+        batch = [(chunk, uuid) for chunk, uuid in batch if uuid not in existing]
+        if not batch:
+            return 0
+
+        self.vector_store.add_documents([chunk for chunk, _ in batch], ids=[uuid for _, uuid in batch])
+        return len(batch)
+
+    def create_tenant_index(self):
+        """Create a scalar index on the content_hash field of the shared collection, if missing"""
+        collection = self.vector_store.col
+        if collection is None:
+            return
+        try:
+            if not collection.has_index(index_name=f"{CONTENT_HASH_FIELD}_index"):
+                collection.create_index(field_name=CONTENT_HASH_FIELD, index_name=f"{CONTENT_HASH_FIELD}_index")
+        except Exception as e:
+            # Not every Milvus deployment supports scalar indexes, filtering still works without it
+            logging.getLogger(__name__).warning(f"Could not create index on {CONTENT_HASH_FIELD}: {e}")
+
+    def refresh_content_hashes(self):
+        self.content_hashes = set(DocumentChunkController.get_content_hashes_from_chatbot(self.chatbot_id))
+        self.page_index = DocumentChunkController.get_page_index(self.chatbot_id)
+
+    def add_page_numbers(self, docs):
+        """Set the page_number of retrieved chunks from the page index, falling back to the stored metadata"""
+        for doc in docs:
+            page_number = self.page_index.get(doc.metadata.get(PRIMARY_FIELD))
+            if page_number is not None:
+                doc.metadata["page_number"] = page_number
+        return docs
+
+    def delete_unreferenced_chunks(self, uuids, batch_size=500):
+        """Delete chunks from the vector store once no chatbot references them anymore"""
+        referenced = DocumentChunkController.get_referenced_uuids(uuids)
+        unreferenced = [uuid for uuid in uuids if uuid not in referenced]
+        for start in range(0, len(unreferenced), batch_size):
+            self.vector_store.delete(ids=unreferenced[start:start + batch_size])
+        return unreferenced
+
+    def delete_all_documents(self):
+        """Delete every chunk of this chatbot from a shared vector store"""
+        rows = DocumentChunkController.get_all_document_chunks_from_chatbot(self.chatbot_id)
+        DocumentChunkController.delete_document_chunks_by_chatbot_id(self.chatbot_id)
+        self.delete_unreferenced_chunks(list({row["uuid"] for row in rows}))
+        self.content_hashes = set()
+        self.page_index = {}
+
+    def get_tenant_filter(self):
+        """Milvus filter expression restricting results to this chatbot's chunks"""
+        if not self.multi_tenant:
+            return None
+        return f"{CONTENT_HASH_FIELD} in {sorted(self.content_hashes)}"
 
     def delete_document(self, document_name):
-        uuids = DocumentChunkController.get_document_chunks_uuids_by_document_name(self.chatbot_id, document_name)
+        rows = DocumentChunkController.get_document_chunks_uuids_by_document_name(self.chatbot_id, document_name)
+        uuids = [row["uuid"] for row in rows]
         DocumentChunkController.delete_document_chunks_by_document_name(document_name, self.chatbot_id)
-        self.vector_store.delete_documents(uuids)
+        # Chunks shared with other chatbots stay in the vector store
+        self.delete_unreferenced_chunks(uuids)
+        self.refresh_content_hashes()
         return uuids
 
     def save_pdf_documents_at_path(self, documents_path):
         pdf_documents = glob(f"{documents_path}/*.pdf")
         self.save_documents(pdf_documents)
 
-    def invoke(self, query):
-        # Retrieve documents based on the query
-        # Rerank results using RRF
-        results = self.vector_store.similarity_search(
-            query, k=5, ranker_type="rrf"
-        )
+    def invoke(self, query, k=5):
+        if self.multi_tenant and not self.content_hashes:
+            # This chatbot has no documents in the shared collection
+            return []
 
-        return results
\ No newline at end of file
+        if self.reranker is None:
+            # Retrieve documents based on the query
+            # Rerank results using RRF (or the configured ranker)
+            return self.add_page_numbers(self.vector_store.similarity_search(
+                query, k=k, ranker_type=self.ranker_type, ranker_params=self.ranker_params or {}, expr=self.get_tenant_filter()
+            ))
+
+        # Retrieve a larger pool of candidates and let the cross-encoder pick the best ones
+        candidates = self.vector_store.similarity_search(
+            query, k=self.rerank_candidates, fetch_k=self.rerank_candidates, ranker_type=self.ranker_type,
+            ranker_params=self.ranker_params or {}, expr=self.get_tenant_filter()
+        )
+        candidates = self.add_page_numbers(candidates)
+        reranked = self.reranker.rerank(query, candidates, k)
+        if reranked is None:
+            # Over the latency budget, keep the fused order
+            return candidates[:k]
+        return reranked
\ No newline at end of file
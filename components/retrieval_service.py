@@ -0,0 +1,220 @@
+import argparse
+import ipaddress
+import logging
+import os
+import queue
+import threading
+from multiprocessing.connection import AuthenticationError, Client, Listener
+
+from api.settings import RETRIEVAL_SERVICE_ADDRESS, RETRIEVAL_SERVICE_AUTHKEY, RETRIEVAL_SERVICE_POOL_SIZE
+
+logger = logging.getLogger(__name__)
+
+# RagRetriever methods that clients can call
+REMOTE_METHODS = {
+    "invoke", "save_documents", "save_pdf_documents_at_path", "delete_document", "delete_all_documents",
+    "configure_reranker", "refresh_content_hashes",
+}
+
+class RetrievalServiceError(Exception):
+    pass
+
+def get_address(address):
+    """"host:port" listens on TCP (loopback addresses only), anything else is the path of a UNIX socket"""
+    host, separator, port = address.rpartition(":")
+    if separator and port.isdigit() and not address.startswith((".", "/")):
+        host = host.strip("[]")
+        if not is_loopback(host):
+            raise RetrievalServiceError(f"The retrieval service only accepts loopback TCP addresses, got {host}")
+        return (host, int(port))
+    return address
+
+def is_loopback(host):
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+def check_authkey(authkey):
+    """Anyone holding the authkey can run code in the service (requests are pickled), a default would be public"""
+    if not authkey:
+        raise RetrievalServiceError("Set the RETRIEVAL_SERVICE_AUTHKEY environment variable to a secret shared by the service and the web workers")
+    return authkey
+
+class RetrievalService:
+    """
+        Process owning the embedding models, rerankers and vector stores, shared by every web worker.
+        Each retriever is created on first use from the settings sent by the client, and queries
+        embedded concurrently by different clients are batched into one forward pass.
+    """
+    def __init__(self, flask_app, address=RETRIEVAL_SERVICE_ADDRESS, authkey=RETRIEVAL_SERVICE_AUTHKEY):
+        self.flask_app = flask_app
+        self.address = get_address(address)
+        self.authkey = check_authkey(authkey)
+        self.retrievers = {}
+        self.retriever_locks = {}
+        self.lock = threading.Lock()
+
+    def get_retriever(self, retriever_kwargs):
+        from components.rag_retriever import RagRetriever
+
+        key = (retriever_kwargs.get("chatbot_id"), retriever_kwargs.get("vector_db_path"))
+        with self.lock:
+            if key in self.retrievers:
+                return self.retrievers[key]
+            # One lock per retriever so documents are ingested once without blocking other chatbots
+            retriever_lock = self.retriever_locks.setdefault(key, threading.Lock())
+
+        with retriever_lock:
+            if key not in self.retrievers:
+                logger.info(f"Opening retriever for chatbot {key[0]} ({key[1]})")
+                retriever = RagRetriever(**retriever_kwargs)
+                with self.lock:
+                    self.retrievers[key] = retriever
+        return self.retrievers[key]
+
+    def handle_request(self, request):
+        method = request["method"]
+        if method == "embedding_stats":
+            from components.embeddings import get_embedding_stats
+
+            return get_embedding_stats()
+
+        retriever = self.get_retriever(request["retriever"])
+        if method == "open":
+            return None
+        if method not in REMOTE_METHODS:
+            raise ValueError(f"Unknown retriever method: {method}")
+        return getattr(retriever, method)(*request.get("args", ()), **request.get("kwargs", {}))
+
+    def serve_connection(self, connection):
+        with connection, self.flask_app.app_context():
+            while True:
+                try:
+                    request = connection.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    response = ("ok", self.handle_request(request))
+                except Exception as e:
+                    logger.exception(f"Retrieval service request {request.get('method')} failed")
+                    response = ("error", f"{type(e).__name__}: {e}")
+                connection.send(response)
+
+    def serve_forever(self):
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            # Left over by a previous run
+            os.remove(self.address)
+
+        # The UNIX socket is created readable and writable by the owner only
+        umask = os.umask(0o177)
+        try:
+            listener = Listener(self.address, authkey=self.authkey)
+        finally:
+            os.umask(umask)
+
+        with listener:
+            logger.info(f"Retrieval service listening on {self.address}")
+            while True:
+                try:
+                    connection = listener.accept()
+                except AuthenticationError:
+                    logger.warning("Rejected a retrieval service connection with a wrong authkey")
+                    continue
+                threading.Thread(target=self.serve_connection, args=(connection,), name="retrieval-client", daemon=True).start()
+
+def get_service_embedding_stats(address=RETRIEVAL_SERVICE_ADDRESS, authkey=RETRIEVAL_SERVICE_AUTHKEY):
+    """Query embedding batching statistics of the retrieval service"""
+    with Client(get_address(address), authkey=check_authkey(authkey)) as connection:
+        connection.send({"method": "embedding_stats"})
+        status, result = connection.recv()
+    if status == "error":
+        raise RetrievalServiceError(result)
+    return result
+
+class RemoteRagRetriever:
+    """
+        Thin client with the RagRetriever interface, used by web workers when RETRIEVAL_SERVICE_ENABLED
+        is set. Calls are forwarded to the retrieval service over a small pool of connections.
+    """
+    def __init__(self, address=RETRIEVAL_SERVICE_ADDRESS, authkey=RETRIEVAL_SERVICE_AUTHKEY,
+                 pool_size=RETRIEVAL_SERVICE_POOL_SIZE, **retriever_kwargs):
+        self.address = get_address(address)
+        self.authkey = check_authkey(authkey)
+        self.pool_size = pool_size
+        self.pool = queue.LifoQueue()
+        # Sent with every call so a restarted service can recreate the retriever
+        self.retriever_kwargs = retriever_kwargs
+        self.chatbot_id = retriever_kwargs.get("chatbot_id")
+        self.call("open")
+
+    def call(self, method, *args, **kwargs):
+        request = {"method": method, "retriever": self.retriever_kwargs, "args": args, "kwargs": kwargs}
+        for attempt in range(2):
+            try:
+                connection = self.pool.get_nowait()
+                pooled = True
+            except queue.Empty:
+                connection = Client(self.address, authkey=self.authkey)
+                pooled = False
+
+            try:
+                connection.send(request)
+                status, result = connection.recv()
+            except (EOFError, OSError) as e:
+                connection.close()
+                # A pooled connection may have been closed by a service restart, retry on a new one
+                if pooled and attempt == 0:
+                    continue
+                raise RetrievalServiceError(f"Lost connection to the retrieval service: {e}")
+
+            if self.pool.qsize() < self.pool_size:
+                self.pool.put(connection)
+            else:
+                connection.close()
+
+            if status == "error":
+                raise RetrievalServiceError(result)
+            return result
+
+    def configure_reranker(self, use_reranker, rerank_candidates=None):
+        self.call("configure_reranker", use_reranker, rerank_candidates)
+
+    def invoke(self, query, k=5):
+        return self.call("invoke", query, k=k)
+
+    def save_documents(self, documents):
+        return self.call("save_documents", documents)
+
+    def save_pdf_documents_at_path(self, documents_path):
+        return self.call("save_pdf_documents_at_path", documents_path)
+
+    def delete_document(self, document_name):
+        return self.call("delete_document", document_name)
+
+    def delete_all_documents(self):
+        return self.call("delete_all_documents")
+
+    def refresh_content_hashes(self):
+        return self.call("refresh_content_hashes")
+
+def main():
+    # Run next to the web workers, e.g.:
+    #     python -m components.retrieval_service &
+    #     gunicorn -w 4 api.index:app
+    parser = argparse.ArgumentParser(description="Serve the retrievers of every chatbot to the web workers")
+    parser.add_argument("--address", default=RETRIEVAL_SERVICE_ADDRESS, help="UNIX socket path or host:port")
+    args = parser.parse_args()
+
+    from flask import Flask
+
+    from components.embeddings import enable_query_batching
+
+    logging.basicConfig(level=logging.INFO, format="[%(asctime)s] %(levelname)s in %(module)s: %(message)s")
+    enable_query_batching()
+    RetrievalService(Flask(__name__), address=args.address).serve_forever()
+
+if __name__ == "__main__":
+    main()
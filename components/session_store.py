@@ -0,0 +1,82 @@
+import sys
+import threading
+
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+# Roles are stored as small ints, the LangChain message classes are only built for the provider
+SYSTEM, HUMAN, AI = 0, 1, 2
+_MESSAGE_CLASSES = (SystemMessage, HumanMessage, AIMessage)
+_ROLES = {"system": SYSTEM, "human": HUMAN, "ai": AI}
+
+class MessageRecord:
+    """
+        One message of a conversation, its role and its text. A fraction of the size of a
+        LangChain message (no ids, metadata dicts or pydantic state) and immutable once created.
+    """
+    __slots__ = ("role", "content")
+
+    def __init__(self, role, content):
+        self.role = role
+        # Repeated short texts (greetings, "thanks"...) share one string
+        self.content = sys.intern(content) if len(content) <= 64 else content
+
+    @classmethod
+    def from_message(cls, message):
+        if isinstance(message, str):
+            return cls(HUMAN, message)
+        return cls(_ROLES.get(message.type, HUMAN), message.content)
+
+    def to_message(self):
+        return _MESSAGE_CLASSES[self.role](content=self.content)
+
+    def __repr__(self):
+        return f"MessageRecord({_MESSAGE_CLASSES[self.role].__name__}, {self.content!r})"
+
+class SessionStore:
+    """
+        Conversations of the users of a chatbot, as tuples of MessageRecords keyed by user id.
+        A conversation is replaced as a whole on every update, so readers get a snapshot
+        without copying and tuples carry no spare capacity.
+    """
+    def __init__(self):
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __contains__(self, user_id):
+        return user_id in self._sessions
+
+    def get(self, user_id):
+        """The user's conversation, or None if they have none yet"""
+        return self._sessions.get(user_id)
+
+    def get_or_create(self, user_id, initial_records=()):
+        with self._lock:
+            records = self._sessions.get(user_id)
+            if records is None:
+                records = self._sessions[user_id] = tuple(initial_records)
+            return records
+
+    def append(self, user_id, *records):
+        with self._lock:
+            self._sessions[user_id] = self._sessions.get(user_id, ()) + records
+
+    def replace(self, user_id, records):
+        with self._lock:
+            self._sessions[user_id] = tuple(records)
+
+    def delete(self, user_id):
+        with self._lock:
+            self._sessions.pop(user_id, None)
+
+    @staticmethod
+    def to_messages(records):
+        """LangChain messages for the provider"""
+        return [record.to_message() for record in records]
+
+    @staticmethod
+    def count_turns(records):
+        """Number of user and assistant messages"""
+        return sum(1 for record in records if record.role != SYSTEM)
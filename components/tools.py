@@ -1,7 +1,8 @@
-from typing import List
+from typing import Annotated, List
+from urllib.parse import quote
 from pydantic import BaseModel, Field
 from langchain_core.messages import AIMessage
-from langchain_core.tools import tool
+from langchain_core.tools import InjectedToolArg, tool
 import os
 
 @tool
@@ -15,7 +16,8 @@ def output_email_button(email_address: str = "", subject: str = "", body: str =
     )
 
 @tool
-def output_context_reference(cited_sources: List[str] = None) -> AIMessage:
+def output_context_reference(cited_sources: List[str] = None, documents_url: Annotated[str, InjectedToolArg] = None,
+                             source_pages: Annotated[dict, InjectedToolArg] = None) -> AIMessage:
     """Use this tool to reference specific course materials, lectures, or lab sessions from retrieved context when answering academic questions. Use when the answer directly relates to specific course content that should be cited, include the name of the file material."""
 
     if not cited_sources:
@@ -30,7 +32,11 @@ def output_context_reference(cited_sources: List[str] = None) -> AIMessage:
         
         # Get base URL from environment variable or use default
         base_url = os.getenv('BASE_URL', '')
-        document_url = f"{base_url}/documents/{filename}"
+        document_url = f"{base_url}{documents_url or '/documents'}/{quote(filename)}"
+        # Page of the best retrieved chunk of this source, PDF viewers open the document there
+        page_number = (source_pages or {}).get(filename)
+        if page_number:
+            document_url += f"#page={page_number}"
 
         output += f'<a href="{document_url}" target="_blank">{display_name}</a>\n\n'
 
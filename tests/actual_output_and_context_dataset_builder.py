@@ -1,3 +1,4 @@
+import argparse
 import sys
 import os
 
@@ -6,26 +7,46 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from deepeval.dataset import EvaluationDataset, Golden
 
 from tests.evaluation_chatbot import EvaluationChatbot
+from tests.evaluation_runner import EvaluationRunner
+
+parser = argparse.ArgumentParser(description="Generate the actual outputs and retrieval contexts of the evaluation dataset")
+parser.add_argument("--model", default="anthropic/claude-sonnet-4")
+parser.add_argument("--workers", type=int, default=4, help="Number of goldens generated concurrently")
+parser.add_argument("--rate", type=float, default=1.0, help="Maximum generations started per second")
+parser.add_argument("--checkpoint", default=None, help="JSONL file with completed rows, used to resume an interrupted run")
+args = parser.parse_args()
 
 dataset = EvaluationDataset()
 dataset.pull(alias="erca_qa_dataset")
 
-chatbot = EvaluationChatbot(model="anthropic/claude-sonnet-4", use_rag=True)
-
-new_goldens = []
+# The chatbot (and its embedding model) is built once and shared by every worker
+chatbot = EvaluationChatbot(model=args.model, use_rag=True)
+model_name = chatbot.model_name.split('/')[-1]
+checkpoint_path = args.checkpoint or f"./tests/erca-test-datasets/.checkpoint_{model_name}.jsonl"
 
-for i, golden in enumerate(dataset.goldens):
-    print(f"Processing input: {i+1}/{len(dataset.goldens)}")
+def generate(golden):
     output, context = chatbot.generate(golden.input)
-    new_golden = Golden(
+    return {"actual_output": output, "context": context}
+
+runner = EvaluationRunner(generate, checkpoint_path, workers=args.workers, requests_per_second=args.rate)
+rows = {row["input"]: row for row in runner.run(dataset.goldens)}
+
+new_goldens = []
+for golden in dataset.goldens:
+    row = rows.get(golden.input)
+    if row is None:
+        continue
+    new_goldens.append(Golden(
         input=golden.input,
         expected_output=golden.expected_output,
-        actual_output=output,
-        retrieval_context=context,
-        context=context
-    )
-    new_goldens.append(new_golden)
+        actual_output=row["actual_output"],
+        retrieval_context=row["context"],
+        context=row["context"]
+    ))
+
+if len(new_goldens) < len(dataset.goldens):
+    print(f"{len(dataset.goldens) - len(new_goldens)} goldens failed, run again to resume from {checkpoint_path}")
 
 new_dataset = EvaluationDataset(goldens=new_goldens)
-filename = f"test_dataset_{chatbot.model_name.split('/')[-1]}"
-new_dataset.save_as(file_type="csv", directory="./tests/erca-test-datasets", file_name=filename)
\ No newline at end of file
+filename = f"test_dataset_{model_name}"
+new_dataset.save_as(file_type="csv", directory="./tests/erca-test-datasets", file_name=filename)
@@ -0,0 +1,107 @@
+"""
+Benchmark of the PDF parsing strategies on the lecture slides.
+
+For each parser it reports the parsing speed (pages/second, including chunking), how many pages
+were sent to hi_res, and the retrieval quality obtained when the resulting chunks are indexed:
+answer term recall of the top-k chunks against the expected answers of the evaluation dataset,
+and source hit rate when the dataset lists expected sources.
+
+Usage:
+    python tests/benchmark_document_parsers.py --parsers adaptive unstructured text
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tests.benchmark_utils import (answer_term_recall, create_benchmark_tables, load_questions, mean, same_source,
+                                   use_temporary_database, write_json)
+
+benchmark_dir = use_temporary_database()
+
+from glob import glob
+
+import pymupdf
+
+from components.document_parsers import DocumentParsers
+from components.rag_retriever import RagRetriever
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Benchmark the PDF parsing strategies")
+    parser.add_argument("--documents", default="./documents", help="Folder with the PDF documents")
+    parser.add_argument("--dataset", default="./tests/erca-test-datasets/test_dataset_gpt-5.csv", help="Question set (CSV or JSON)")
+    parser.add_argument("--parsers", nargs="+", default=["adaptive", "unstructured", "text", "pypdf"])
+    parser.add_argument("--k", type=int, default=5, help="Number of chunks retrieved per question")
+    parser.add_argument("--limit", type=int, default=None, help="Only use the first N questions")
+    parser.add_argument("--output", default="./tests/benchmark-results/document_parsers.json")
+    return parser.parse_args()
+
+def benchmark_parser(parser_name, pdf_files, questions, k):
+    retriever = RagRetriever(
+        chatbot_id=1,
+        vector_db_path=os.path.join(benchmark_dir, f"{parser_name}.db"),
+        parser_name=parser_name,
+        load_documents=False,
+    )
+
+    # Parse and chunk everything first so the timing does not include embedding
+    stats = {}
+    start = time.perf_counter()
+    elements = DocumentParsers.parse_elements(parser_name, pdf_files, stats=stats)
+    chunks = list(retriever.chunk_documents(elements))
+    parse_seconds = time.perf_counter() - start
+
+    pages = 0
+    for pdf_file in pdf_files:
+        with pymupdf.open(pdf_file) as pdf:
+            pages += pdf.page_count
+
+    batch = [(chunk, retriever.generate_chunk_uuid(parser_name, index)) for index, chunk in enumerate(chunks)]
+    retriever.index_chunks(batch)
+
+    recalls = []
+    source_hits = []
+    for question in questions:
+        docs = retriever.invoke(question["question"])[:k]
+        recalls.append(answer_term_recall(question["expected_output"], docs))
+        if question["expected_sources"]:
+            retrieved_sources = [doc.metadata.get("source", "") for doc in docs]
+            source_hits.append(any(same_source(retrieved, expected)
+                                   for retrieved in retrieved_sources for expected in question["expected_sources"]))
+
+    return {
+        "parser": parser_name,
+        "pages": pages,
+        "parse_seconds": parse_seconds,
+        "pages_per_second": pages / parse_seconds if parse_seconds else None,
+        "hi_res_pages": stats.get("hi_res_pages", pages if parser_name == "unstructured" else 0),
+        "chunks": len(chunks),
+        "answer_term_recall": mean(recalls),
+        "source_hit_rate": mean(source_hits) if source_hits else None,
+    }
+
+def main():
+    args = parse_arguments()
+    create_benchmark_tables()
+
+    pdf_files = sorted(glob(os.path.join(args.documents, "*.pdf")))
+    if not pdf_files:
+        print(f"No PDF documents found in {args.documents}")
+        return
+    questions = load_questions(args.dataset, args.limit)
+
+    results = []
+    for parser_name in args.parsers:
+        print(f"Benchmarking parser '{parser_name}' on {len(pdf_files)} documents...")
+        result = benchmark_parser(parser_name, pdf_files, questions, args.k)
+        results.append(result)
+        print(f"  {result['pages_per_second']:.2f} pages/s, {result['hi_res_pages']} hi_res pages, "
+              f"{result['chunks']} chunks, answer term recall@{args.k}: {result['answer_term_recall'] or 0:.3f}")
+
+    write_json(args.output, {"documents": len(pdf_files), "questions": len(questions), "k": args.k, "results": results})
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Benchmark of the embedding backends (torch, onnx, onnx-int8) on CPU.
+
+For each backend it reports the model load time, the resident memory added by loading it,
+the query embedding latency (p50/p95), the ingestion throughput (chunks/second) on the chunks
+of the lecture slides, and how closely the backend agrees with the torch reference: mean cosine
+similarity of the embeddings and overlap of the top-k chunks retrieved for each question.
+
+Backends are loaded one after the other in the same process, so the memory figures are the
+increase over everything loaded before (the torch reference is always loaded first).
+
+Usage:
+    python tests/benchmark_embeddings.py --backends torch onnx onnx-int8
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tests.benchmark_utils import load_questions, mean, percentile, write_json
+
+from glob import glob
+
+import numpy as np
+import psutil
+
+from components.document_chunker import StreamingChunker
+from components.document_parsers import DocumentParsers
+from components.embeddings import create_embeddings
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Benchmark the embedding backends")
+    parser.add_argument("--documents", default="./documents", help="Folder with the PDF documents")
+    parser.add_argument("--dataset", default="./tests/erca-test-datasets/test_dataset_gpt-5.csv", help="Question set (CSV or JSON)")
+    parser.add_argument("--backends", nargs="+", default=["torch", "onnx", "onnx-int8"])
+    parser.add_argument("--k", type=int, default=5, help="Number of chunks compared per question")
+    parser.add_argument("--limit", type=int, default=None, help="Only use the first N questions")
+    parser.add_argument("--max-chunks", type=int, default=500, help="Only embed the first N chunks")
+    parser.add_argument("--output", default="./tests/benchmark-results/embeddings.json")
+    return parser.parse_args()
+
+def load_chunks(pdf_files, max_chunks):
+    # Same chunk size as the retriever, the text layer parser keeps this step fast
+    chunker = StreamingChunker(chunk_size=1200, chunk_overlap=120)
+    chunks = []
+    for chunk in chunker.chunk(DocumentParsers.parse_elements("text", pdf_files)):
+        chunks.append(chunk.page_content)
+        if len(chunks) >= max_chunks:
+            break
+    return chunks
+
+def resident_memory_mb():
+    return psutil.Process().memory_info().rss / (1024 * 1024)
+
+def top_k(query_embeddings, chunk_embeddings, k):
+    # Embeddings are normalised, the dot product is the cosine similarity
+    scores = query_embeddings @ chunk_embeddings.T
+    return [set(np.argsort(-row)[:k]) for row in scores]
+
+def benchmark_backend(backend, questions, chunks, k, reference=None):
+    memory_before = resident_memory_mb()
+    start = time.perf_counter()
+    embeddings = create_embeddings(backend)
+    # The first call includes lazy initialisation, keep it out of the latency figures
+    embeddings.embed_query("warm up")
+    load_seconds = time.perf_counter() - start
+    memory_mb = resident_memory_mb() - memory_before
+
+    latencies = []
+    query_embeddings = []
+    for question in questions:
+        start = time.perf_counter()
+        query_embeddings.append(embeddings.embed_query(question["question"]))
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    chunk_embeddings = embeddings.embed_documents(chunks)
+    ingest_seconds = time.perf_counter() - start
+
+    query_embeddings = np.array(query_embeddings)
+    chunk_embeddings = np.array(chunk_embeddings)
+    result = {
+        "backend": backend,
+        "load_seconds": load_seconds,
+        "memory_mb": memory_mb,
+        "query_latency_p50_ms": percentile(latencies, 50) * 1000,
+        "query_latency_p95_ms": percentile(latencies, 95) * 1000,
+        "chunks_per_second": len(chunks) / ingest_seconds if ingest_seconds else None,
+    }
+
+    if reference is not None:
+        reference_queries, reference_chunks = reference
+        result["mean_cosine_to_torch"] = float(np.mean(np.sum(chunk_embeddings * reference_chunks, axis=1)))
+        overlaps = [len(ours & theirs) / k for ours, theirs in
+                    zip(top_k(query_embeddings, chunk_embeddings, k), top_k(reference_queries, reference_chunks, k))]
+        result[f"top{k}_overlap_with_torch"] = mean(overlaps)
+
+    return result, (query_embeddings, chunk_embeddings)
+
+def main():
+    args = parse_arguments()
+
+    pdf_files = sorted(glob(os.path.join(args.documents, "*.pdf")))
+    if not pdf_files:
+        print(f"No PDF documents found in {args.documents}")
+        return
+    questions = load_questions(args.dataset, args.limit)
+    chunks = load_chunks(pdf_files, args.max_chunks)
+
+    backends = ["torch"] + [backend for backend in args.backends if backend != "torch"]
+    results = []
+    reference = None
+    for backend in backends:
+        print(f"Benchmarking embedding backend '{backend}' on {len(questions)} queries and {len(chunks)} chunks...")
+        result, embeddings = benchmark_backend(backend, questions, chunks, args.k, reference)
+        if backend == "torch":
+            reference = embeddings
+            if "torch" not in args.backends:
+                continue
+        results.append(result)
+        print(f"  p50 {result['query_latency_p50_ms']:.1f} ms/query, {result['chunks_per_second']:.1f} chunks/s, "
+              f"+{result['memory_mb']:.0f} MB, top-{args.k} overlap with torch: {result.get(f'top{args.k}_overlap_with_torch', 1.0):.3f}")
+
+    write_json(args.output, {"questions": len(questions), "chunks": len(chunks), "k": args.k, "results": results})
+
+if __name__ == "__main__":
+    main()
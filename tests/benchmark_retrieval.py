@@ -0,0 +1,155 @@
+"""
+Offline benchmark of retrieval quality and latency over the stored chunks.
+
+Runs RagRetriever.invoke for every combination of the given configurations (k, dense index
+type, ranker, chunk size, reranker) and reports recall@k, MRR, p50/p95/p99 latency and QPS.
+One index is built per (index type, chunk size) pair and reused by the other settings.
+
+A retrieved chunk is relevant when its source is one of the question's expected sources. Datasets
+without expected sources fall back to the answer: a chunk is relevant when it contains at least
+--term-threshold of the content words of the expected answer.
+
+Usage:
+    python tests/benchmark_retrieval.py --dataset questions.json --k 3 5 10 --rankers rrf weighted --rerankers off on
+"""
+
+import argparse
+import itertools
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tests.benchmark_utils import (content_terms, create_benchmark_tables, load_questions, mean, percentile, same_source,
+                                   use_temporary_database, write_json)
+
+benchmark_dir = use_temporary_database()
+
+from glob import glob
+
+from components.rag_reranker import RagReranker
+from components.rag_retriever import RagRetriever
+
+RANKER_PARAMS = {
+    "rrf": None,
+    "weighted": {"weights": [0.6, 0.4]},
+}
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Benchmark retrieval quality and latency")
+    parser.add_argument("--documents", default="./documents", help="Folder with the PDF documents")
+    parser.add_argument("--dataset", default="./tests/erca-test-datasets/test_dataset_gpt-5.csv", help="Question set (CSV or JSON)")
+    parser.add_argument("--k", type=int, nargs="+", default=[5])
+    parser.add_argument("--index-types", nargs="+", default=["FLAT"])
+    parser.add_argument("--rankers", nargs="+", default=["rrf"], choices=list(RANKER_PARAMS))
+    parser.add_argument("--chunk-sizes", type=int, nargs="+", default=[1200])
+    parser.add_argument("--rerankers", nargs="+", default=["off"], choices=["off", "on"])
+    parser.add_argument("--term-threshold", type=float, default=0.3,
+                        help="Answer term coverage for a chunk to count as relevant when no sources are given")
+    parser.add_argument("--limit", type=int, default=None, help="Only use the first N questions")
+    parser.add_argument("--output", default="./tests/benchmark-results/retrieval.json")
+    return parser.parse_args()
+
+def build_retriever(pdf_files, index_type, chunk_size):
+    retriever = RagRetriever(
+        chatbot_id=1,
+        vector_db_path=os.path.join(benchmark_dir, f"{index_type}_{chunk_size}.db"),
+        load_documents=False,
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_size // 10,
+        dense_index_type=index_type,
+    )
+    start = time.perf_counter()
+    retriever.save_documents(pdf_files)
+    return retriever, time.perf_counter() - start
+
+def is_relevant(doc, question, term_threshold):
+    if question["expected_sources"]:
+        return any(same_source(doc.metadata.get("source", ""), source) for source in question["expected_sources"])
+    expected = content_terms(question["expected_output"])
+    if not expected:
+        return False
+    return len(expected & content_terms(doc.page_content)) / len(expected) >= term_threshold
+
+def evaluate(retriever, questions, k, term_threshold):
+    # One untimed query so model loading and caches do not count as latency
+    retriever.invoke(questions[0]["question"], k=k)
+
+    latencies = []
+    recalls = []
+    reciprocal_ranks = []
+    start = time.perf_counter()
+    for question in questions:
+        query_start = time.perf_counter()
+        docs = retriever.invoke(question["question"], k=k)[:k]
+        latencies.append(time.perf_counter() - query_start)
+
+        relevant = [is_relevant(doc, question, term_threshold) for doc in docs]
+        if question["expected_sources"]:
+            found = {source for source in question["expected_sources"]
+                     for doc in docs if same_source(doc.metadata.get("source", ""), source)}
+            recalls.append(len(found) / len(question["expected_sources"]))
+        else:
+            recalls.append(1.0 if any(relevant) else 0.0)
+        reciprocal_ranks.append(next((1 / rank for rank, hit in enumerate(relevant, start=1) if hit), 0.0))
+    total_seconds = time.perf_counter() - start
+
+    return {
+        "recall_at_k": mean(recalls),
+        "mrr": mean(reciprocal_ranks),
+        "latency_p50_ms": percentile(latencies, 50) * 1000,
+        "latency_p95_ms": percentile(latencies, 95) * 1000,
+        "latency_p99_ms": percentile(latencies, 99) * 1000,
+        "qps": len(questions) / total_seconds if total_seconds else None,
+    }
+
+def main():
+    args = parse_arguments()
+    create_benchmark_tables()
+
+    pdf_files = sorted(glob(os.path.join(args.documents, "*.pdf")))
+    if not pdf_files:
+        print(f"No PDF documents found in {args.documents}")
+        return
+    questions = load_questions(args.dataset, args.limit)
+    if not questions:
+        print(f"No questions found in {args.dataset}")
+        return
+    with_sources = sum(1 for question in questions if question["expected_sources"])
+    print(f"{len(questions)} questions, {with_sources} with expected sources")
+
+    reranker = RagReranker() if "on" in args.rerankers else None
+    results = []
+    for index_type, chunk_size in itertools.product(args.index_types, args.chunk_sizes):
+        print(f"Indexing {len(pdf_files)} documents with {index_type} index and chunk size {chunk_size}...")
+        retriever, index_seconds = build_retriever(pdf_files, index_type, chunk_size)
+
+        for ranker, use_reranker, k in itertools.product(args.rankers, args.rerankers, args.k):
+            retriever.ranker_type = ranker
+            retriever.ranker_params = RANKER_PARAMS[ranker]
+            retriever.reranker = reranker if use_reranker == "on" else None
+
+            result = {
+                "index_type": index_type,
+                "chunk_size": chunk_size,
+                "ranker": ranker,
+                "reranker": use_reranker == "on",
+                "k": k,
+                "index_seconds": index_seconds,
+            }
+            result.update(evaluate(retriever, questions, k, args.term_threshold))
+            results.append(result)
+            print(f"  {ranker}, reranker {use_reranker}, k={k}: recall@k {result['recall_at_k']:.3f}, MRR {result['mrr']:.3f}, "
+                  f"p50 {result['latency_p50_ms']:.1f} ms, p95 {result['latency_p95_ms']:.1f} ms, {result['qps']:.1f} QPS")
+
+    write_json(args.output, {
+        "documents": len(pdf_files),
+        "questions": len(questions),
+        "questions_with_sources": with_sources,
+        "term_threshold": args.term_threshold,
+        "results": results,
+    })
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Benchmark of the memory used by active conversations.
+
+Simulates students holding a conversation with a chatbot and reports the bytes per active session
+for the SessionStore used by the chatbots (tuples of slotted MessageRecords) and for the previous
+representation (a compiled LangGraph workflow per student with a MemorySaver checkpointer holding
+LangChain messages). Memory is measured with tracemalloc, so it only counts Python allocations.
+
+The LangGraph representation is much slower to build, by default it is measured on fewer students
+and the total is extrapolated to --students.
+
+Usage:
+    python tests/benchmark_session_memory.py --students 10000 --turns 10
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tests.benchmark_utils import write_json
+
+from components.session_store import AI, HUMAN, SYSTEM, MessageRecord, SessionStore
+
+QUESTIONS = [
+    "What is the difference between a mean filter and a median filter?",
+    "How does histogram equalisation improve the contrast of an image?",
+    "Can you explain how the Canny edge detector chooses its thresholds?",
+    "What is the Fourier transform used for in image processing?",
+    "Thanks!",
+    "How do morphological opening and closing differ?",
+]
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Benchmark the memory used by active conversations")
+    parser.add_argument("--students", type=int, default=10000, help="Number of active sessions")
+    parser.add_argument("--turns", type=int, default=10, help="Question and answer pairs per session")
+    parser.add_argument("--answer-length", type=int, default=800, help="Characters per answer")
+    parser.add_argument("--langgraph-students", type=int, default=500, help="Sessions measured with the LangGraph representation (0 to skip)")
+    parser.add_argument("--output", default="./tests/benchmark-results/session_memory.json")
+    return parser.parse_args()
+
+def conversation(student, turns, answer_length, rng):
+    """(question, answer) pairs, answers are unique like real model output"""
+    for turn in range(turns):
+        question = rng.choice(QUESTIONS)
+        answer = (f"Answer {student}.{turn}: " + "lorem ipsum dolor sit amet " * (answer_length // 27 + 1))[:answer_length]
+        yield question, answer
+
+def measure(name, build, students):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    sessions = build(students)
+    seconds = time.perf_counter() - start
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    result = {
+        "representation": name,
+        "students_measured": students,
+        "bytes_per_session": round(used / students),
+        "build_seconds": round(seconds, 3),
+    }
+    print(f"{name}: {result['bytes_per_session'] / 1024:.1f} KiB per session ({students} sessions built in {seconds:.1f}s)")
+    # Keep the sessions alive until they are measured
+    del sessions
+    return result
+
+def build_session_store(args):
+    def build(students):
+        rng = random.Random(0)
+        store = SessionStore()
+        for student in range(students):
+            store.get_or_create(student, (MessageRecord(SYSTEM, f"You are talking to student{student}."),))
+            for question, answer in conversation(student, args.turns, args.answer_length, rng):
+                store.append(student, MessageRecord(HUMAN, question), MessageRecord(AI, answer))
+        return store
+    return build
+
+def build_langgraph(args):
+    from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+    from langgraph.checkpoint.memory import MemorySaver
+    from langgraph.graph import START, MessagesState, StateGraph
+
+    workflow = StateGraph(state_schema=MessagesState)
+    workflow.add_node("model", lambda state: state)
+    workflow.add_edge(START, "model")
+    config = {"configurable": {"thread_id": "default"}}
+
+    def build(students):
+        rng = random.Random(0)
+        apps = {}
+        for student in range(students):
+            app = apps[student] = workflow.compile(checkpointer=MemorySaver())
+            app.update_state(config, {"messages": [SystemMessage(content=f"You are talking to student{student}.")]})
+            for question, answer in conversation(student, args.turns, args.answer_length, rng):
+                messages = app.get_state(config).values.get("messages", [])
+                app.update_state(config, {"messages": messages + [HumanMessage(content=question), AIMessage(content=answer)]})
+        return apps
+    return build
+
+def main():
+    args = parse_arguments()
+    results = [measure("session_store", build_session_store(args), args.students)]
+    if args.langgraph_students:
+        results.append(measure("langgraph_memory_saver", build_langgraph(args), min(args.langgraph_students, args.students)))
+
+    for result in results:
+        result["estimated_total_mb"] = round(result["bytes_per_session"] * args.students / (1024 * 1024), 1)
+    if len(results) == 2:
+        print(f"Estimated for {args.students} students: {results[0]['estimated_total_mb']} MB with SessionStore, "
+              f"{results[1]['estimated_total_mb']} MB with LangGraph ({results[1]['bytes_per_session'] / results[0]['bytes_per_session']:.1f}x)")
+
+    write_json(args.output, {"students": args.students, "turns": args.turns, "answer_length": args.answer_length, "results": results})
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+import csv
+import json
+import math
+import os
+import re
+import sys
+import tempfile
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+STOPWORDS = {
+    "about", "also", "because", "been", "being", "between", "both", "could", "does", "each", "from",
+    "have", "into", "more", "most", "only", "other", "same", "should", "some", "such", "than", "that",
+    "their", "them", "then", "there", "these", "they", "this", "those", "through", "used", "using",
+    "very", "what", "when", "where", "which", "while", "will", "with", "would", "your",
+}
+
+def use_temporary_database():
+    """Point the API at a throwaway SQLite database. Must be called before importing any api module."""
+    directory = tempfile.mkdtemp(prefix="erca-benchmark-")
+    os.environ["CHATBOT_API_DB_PATH"] = os.path.join(directory, "chatbot_instances.db")
+    return directory
+
+def create_benchmark_tables():
+    """Create the tables used by the retriever in the temporary database"""
+    from flask import Flask
+    from api.controllers.document_chunk_controller import DocumentChunkController
+
+    app = Flask(__name__)
+    with app.app_context():
+        DocumentChunkController.create_document_chunks_table()
+
+def load_questions(path, limit=None):
+    """
+        Load a question set, either a deepeval CSV dataset (input, expected_output, source_file columns)
+        or a JSON list of {"question", "expected_output", "expected_sources"} objects.
+    """
+    questions = []
+    if path.endswith(".json"):
+        with open(path) as f:
+            for item in json.load(f):
+                questions.append({
+                    "question": item["question"],
+                    "expected_output": item.get("expected_output", ""),
+                    "expected_sources": item.get("expected_sources", []),
+                })
+    else:
+        with open(path, newline="") as f:
+            for row in csv.DictReader(f):
+                sources = [source for source in row.get("source_file", "").split(";") if source]
+                questions.append({
+                    "question": row["input"],
+                    "expected_output": row.get("expected_output", ""),
+                    "expected_sources": sources,
+                })
+    return questions[:limit] if limit else questions
+
+def content_terms(text):
+    return {word for word in re.findall(r"[a-z0-9]+", text.lower()) if len(word) > 3 and word not in STOPWORDS}
+
+def answer_term_recall(expected_output, docs):
+    """Share of the content words of the expected answer that appear in the retrieved chunks"""
+    expected = content_terms(expected_output)
+    if not expected:
+        return None
+    retrieved = content_terms(" ".join(doc.page_content for doc in docs))
+    return len(expected & retrieved) / len(expected)
+
+def same_source(retrieved_source, expected_source):
+    return os.path.basename(retrieved_source) == os.path.basename(expected_source)
+
+def percentile(values, percent):
+    """Percentile with linear interpolation between the closest ranks"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * percent / 100
+    lower, upper = math.floor(rank), math.ceil(rank)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+def mean(values):
+    values = [value for value in values if value is not None]
+    return sum(values) / len(values) if values else None
+
+def write_json(path, data):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(data, f, indent=2)
+    print(f"Results saved to {path}")
@@ -0,0 +1,108 @@
+"""
+Concurrent, resumable runner for evaluation jobs.
+
+Runs a function over a list of goldens with a thread pool, paced by a token bucket so remote
+model providers are not flooded. Every completed row is appended to a JSONL checkpoint file as
+soon as it finishes, and rows already in the checkpoint are skipped, so an interrupted run
+resumes where it stopped.
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from components.rate_limiter import TokenBucket
+
+class EvaluationRunner:
+    def __init__(self, run_fn, checkpoint_path, workers=4, requests_per_second=1.0, retries=2, retry_delay=5.0):
+        """
+            Params:
+                run_fn (callable): Takes a golden and returns a JSON-serialisable dict (the completed row).
+                checkpoint_path (str): JSONL file where completed rows are appended.
+                workers (int): Number of goldens processed concurrently.
+                requests_per_second (float): Maximum rate at which goldens are started.
+                retries (int): Extra attempts for a golden whose run raised an exception.
+        """
+        self.run_fn = run_fn
+        self.checkpoint_path = checkpoint_path
+        self.workers = workers
+        self.rate_limiter = TokenBucket(requests_per_second, capacity=workers)
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.write_lock = threading.Lock()
+
+    def load_checkpoint(self):
+        """Completed rows of a previous run, keyed by input"""
+        rows = {}
+        if not os.path.exists(self.checkpoint_path):
+            return rows
+        with open(self.checkpoint_path) as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    row = json.loads(line)
+                except json.JSONDecodeError:
+                    # Last line of a run killed while writing
+                    continue
+                rows[row["input"]] = row
+        return rows
+
+    def save_row(self, row):
+        with self.write_lock:
+            with open(self.checkpoint_path, "a") as f:
+                f.write(json.dumps(row) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def run_one(self, golden):
+        for attempt in range(self.retries + 1):
+            self.rate_limiter.acquire()
+            try:
+                return self.run_fn(golden)
+            except Exception as e:
+                if attempt == self.retries:
+                    raise
+                print(f"Retrying '{golden.input[:60]}' after error: {e}")
+                time.sleep(self.retry_delay * (attempt + 1))
+
+    def run(self, goldens):
+        """Process every golden not in the checkpoint yet. Returns the completed rows in the order of goldens"""
+        directory = os.path.dirname(self.checkpoint_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        completed = self.load_checkpoint()
+        pending = [golden for golden in goldens if golden.input not in completed]
+        print(f"{len(completed)} goldens already completed, {len(pending)} to run with {self.workers} workers")
+
+        failed = 0
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(self.run_one, golden): golden for golden in pending}
+            for done, future in enumerate(as_completed(futures), start=1):
+                golden = futures[future]
+                try:
+                    row = future.result()
+                except Exception as e:
+                    failed += 1
+                    print(f"✗ Failed '{golden.input[:60]}': {e}")
+                    continue
+                row["input"] = golden.input
+                self.save_row(row)
+                completed[golden.input] = row
+                elapsed = time.perf_counter() - start
+                print(f"Processed {done}/{len(pending)} ({done / elapsed:.2f} goldens/s)")
+
+        elapsed = time.perf_counter() - start
+        processed = len(pending) - failed
+        if pending:
+            print(f"Completed {processed} goldens in {elapsed:.1f}s ({processed / elapsed if elapsed else 0:.2f} goldens/s), {failed} failed")
+
+        return [completed[golden.input] for golden in goldens if golden.input in completed]
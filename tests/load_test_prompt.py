@@ -0,0 +1,150 @@
+"""
+Load test of the streaming prompt endpoint (/api/chatbot/<id>/prompt).
+
+Runs N concurrent SSE clients, each sending prompts one after the other, and reports the time to
+first chunk and the total response time percentiles, plus the throughput. Point it at a chatbot
+using the stub LLM (llm_model "stub:ttft=...,tps=...,tokens=...") and pass the same model name
+with --stub-model: the expected provider time is then subtracted to report our own overhead
+(retrieval, prompt building, streaming) separately from the model latency.
+
+The prompt endpoint rate limits each user (USER_RATE_LIMIT_PER_MINUTE and USER_RATE_LIMIT_BURST in
+api/settings.py, 10 per minute with bursts of 5 by default), and guests are limited by address, so every
+client of this script shares one bucket. With the defaults most prompts are rejected with HTTP 429: use
+--distinct-users and at most USER_RATE_LIMIT_BURST --requests per client, or raise both settings on the
+server under test. Rejected prompts are reported separately from other errors.
+
+Usage:
+    python tests/load_test_prompt.py --chatbot-id 1 --clients 16 --requests 5 --distinct-users --stub-model "stub:ttft=0.3,tps=50,tokens=100"
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests
+
+from tests.benchmark_utils import mean, percentile, write_json
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Load test the streaming prompt endpoint")
+    parser.add_argument("--base-url", default="http://127.0.0.1:5000")
+    parser.add_argument("--chatbot-id", default="1")
+    parser.add_argument("--clients", type=int, default=8, help="Number of concurrent SSE clients")
+    parser.add_argument("--requests", type=int, default=5, help="Prompts sent by each client")
+    parser.add_argument("--prompt", default="What is histogram equalisation?")
+    parser.add_argument("--distinct-users", action="store_true", help="Give each client its own user instead of the guest user")
+    parser.add_argument("--stub-model", default=None, help="llm_model of the stub used by the chatbot, to compute the overhead")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--output", default="./tests/benchmark-results/load_test_prompt.json")
+    return parser.parse_args()
+
+def expected_stub_timing(stub_model):
+    """Expected (time to first token, total generation time) of the stub model, in seconds"""
+    # Imported here so the script does not need the API dependencies when no stub is used
+    from components.chat_stub import ChatStub
+
+    stub = ChatStub.from_model_name(stub_model)
+    return stub.ttft, stub.ttft + max(stub.response_tokens - 1, 0) / stub.tokens_per_second
+
+def send_prompt(session, url, payload, timeout):
+    """Send one prompt and read the SSE stream. Returns (time to first chunk, total time, chunks, error)"""
+    start = time.perf_counter()
+    first_chunk = None
+    chunks = 0
+    with session.post(url, json=payload, stream=True, timeout=timeout) as response:
+        if response.status_code != 200:
+            return None, time.perf_counter() - start, 0, f"HTTP {response.status_code}"
+        for line in response.iter_lines(decode_unicode=True):
+            if not line or not line.startswith("data: "):
+                continue
+            event = json.loads(line[len("data: "):])
+            if "error" in event:
+                return first_chunk, time.perf_counter() - start, chunks, event["error"]
+            if "chunk" in event:
+                chunks += 1
+                if first_chunk is None:
+                    first_chunk = time.perf_counter() - start
+            if event.get("done"):
+                break
+    return first_chunk, time.perf_counter() - start, chunks, None
+
+def run_client(client_index, args, results, lock):
+    url = f"{args.base_url}/api/chatbot/{args.chatbot_id}/prompt"
+    payload = {"prompt": args.prompt}
+    if args.distinct_users:
+        payload["user_email"] = f"load-test-{client_index}@example.com"
+        payload["user_name"] = f"load-test-{client_index}"
+
+    with requests.Session() as session:
+        for request_index in range(args.requests):
+            try:
+                result = send_prompt(session, url, dict(payload, prompt=f"{args.prompt} ({request_index})"), args.timeout)
+            except requests.RequestException as e:
+                result = (None, None, 0, str(e))
+            with lock:
+                results.append(result)
+
+def summarise(values, prefix):
+    values = [value for value in values if value is not None]
+    return {
+        f"{prefix}_p50_ms": percentile(values, 50) * 1000 if values else None,
+        f"{prefix}_p95_ms": percentile(values, 95) * 1000 if values else None,
+        f"{prefix}_p99_ms": percentile(values, 99) * 1000 if values else None,
+        f"{prefix}_mean_ms": mean(values) * 1000 if values else None,
+    }
+
+def main():
+    args = parse_arguments()
+    results = []
+    lock = threading.Lock()
+
+    print(f"Running {args.clients} clients x {args.requests} prompts against chatbot {args.chatbot_id}...")
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.clients) as executor:
+        for client_index in range(args.clients):
+            executor.submit(run_client, client_index, args, results, lock)
+    elapsed = time.perf_counter() - start
+
+    successful = [result for result in results if result[3] is None]
+    errors = [result[3] for result in results if result[3] is not None]
+    rate_limited = errors.count("HTTP 429")
+    ttfts = [result[0] for result in successful]
+    totals = [result[1] for result in successful]
+
+    report = {
+        "clients": args.clients,
+        "requests": len(results),
+        "errors": len(errors),
+        "rate_limited": rate_limited,
+        "error_samples": errors[:5],
+        "seconds": elapsed,
+        "requests_per_second": len(successful) / elapsed if elapsed else None,
+        "chunks_per_request": mean([result[2] for result in successful]),
+    }
+    report.update(summarise(ttfts, "first_chunk"))
+    report.update(summarise(totals, "total"))
+
+    if args.stub_model:
+        expected_ttft, expected_total = expected_stub_timing(args.stub_model)
+        report["stub_model"] = args.stub_model
+        report.update(summarise([ttft - expected_ttft for ttft in ttfts if ttft is not None], "overhead_first_chunk"))
+        report.update(summarise([total - expected_total for total in totals], "overhead_total"))
+
+    print(f"{len(successful)}/{len(results)} successful, {report['requests_per_second'] or 0:.2f} requests/s")
+    if rate_limited:
+        print(f"{rate_limited} prompts were rejected with HTTP 429 (rate limit or admission queue full), see the usage notes")
+    print(f"First chunk p50 {report['first_chunk_p50_ms'] or 0:.0f} ms, p95 {report['first_chunk_p95_ms'] or 0:.0f} ms, "
+          f"p99 {report['first_chunk_p99_ms'] or 0:.0f} ms")
+    if args.stub_model:
+        print(f"Overhead on first chunk p50 {report['overhead_first_chunk_p50_ms'] or 0:.0f} ms, "
+              f"p95 {report['overhead_first_chunk_p95_ms'] or 0:.0f} ms, p99 {report['overhead_first_chunk_p99_ms'] or 0:.0f} ms")
+    write_json(args.output, report)
+
+if __name__ == "__main__":
+    main()
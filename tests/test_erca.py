@@ -3,10 +3,13 @@ from deepeval import assert_test
 from deepeval.metrics import AnswerRelevancyMetric, FaithfulnessMetric, HallucinationMetric, ContextualPrecisionMetric, ContextualRelevancyMetric, ContextualRecallMetric
 from deepeval.test_case import LLMTestCase
 from deepeval.dataset import EvaluationDataset
-import time
 
+from components.rate_limiter import TokenBucket
 from tests.evaluation_chatbot import EvaluationChatbot
 
+# Maximum number of test cases evaluated per second, each one makes several calls to the evaluation model
+EVALUATION_RATE = 0.5
+
 dataset = EvaluationDataset()
 dataset.add_test_cases_from_csv_file(
     # file_path is the absolute path to you .csv file
@@ -22,12 +25,21 @@ dataset.add_test_cases_from_csv_file(
 
 print(f"Loaded {len(dataset.test_cases)} test cases for evaluation")
 
+rate_limiter = TokenBucket(EVALUATION_RATE, capacity=1)
+
+@pytest.fixture(scope="module")
+def evaluation_model():
+    """Evaluation model shared by every test case"""
+    print(f"Initializing evaluation model...")
+    # Use OpenAI GPT-4o-mini through OpenRouter for reliable JSON evaluation
+    return EvaluationChatbot(model="openai/gpt-4o-mini")
+
 @pytest.mark.parametrize(
     "test_case",
     dataset.test_cases,
     ids=[f"test_case_{i+1:03d}" for i in range(len(dataset.test_cases))]
 )
-def test_rag(test_case: LLMTestCase):
+def test_rag(test_case: LLMTestCase, evaluation_model):
     """Test individual RAG test case with progress tracking and rate limiting"""
     
     # Get the test case index for progress tracking
@@ -38,18 +50,8 @@ def test_rag(test_case: LLMTestCase):
     print(f"Input: {test_case.input[:100]}...")
     
     try:
-        # Add delay every 10 tests to prevent rate limiting
-        if test_index > 1 and test_index % 10 == 1:
-            print(f"Pausing for 5 seconds to avoid rate limiting...")
-            time.sleep(5)
-        
-        # Add small delay between each test to be conservative
-        if test_index > 1:
-            time.sleep(1)
-        
-        print(f"Initializing evaluation model...")
-        # Use OpenAI GPT-4o-mini through OpenRouter for reliable JSON evaluation
-        evaluation_model = EvaluationChatbot(model="openai/gpt-4o-mini")
+        # Pace the test cases to avoid rate limiting
+        rate_limiter.acquire()
 
         print(f"Creating metrics...")
         answer_relevancy_metric = AnswerRelevancyMetric(model=evaluation_model)